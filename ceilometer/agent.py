@@ -17,9 +17,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import bisect
 import collections
 import itertools
+import logging
+import random
+import time
+import zlib
 
+import eventlet
+from eventlet import semaphore
+from oslo.config import cfg
 from six.moves.urllib import parse as urlparse
 from stevedore import extension
 
@@ -29,8 +37,43 @@ from ceilometer.openstack.common import log
 from ceilometer.openstack.common import service as os_service
 from ceilometer import pipeline
 
+OPTS = [
+    cfg.IntOpt('polling_concurrency',
+               default=1,
+               help='Maximum number of pollsters of a polling task run at '
+               'the same time, each in its own greenthread. The default '
+               'runs them one after the other.'),
+    cfg.FloatOpt('pollster_timeout',
+                 default=0,
+                 help='Number of seconds after which a pollster still '
+                 'running is abandoned and its samples are dropped, 0 to '
+                 'wait for it whatever its duration. The timeout can only '
+                 'expire while the pollster yields to other greenthreads, '
+                 'it does not interrupt a blocking call into a native '
+                 'library such as libvirt.'),
+    cfg.BoolOpt('polling_stagger',
+                default=True,
+                help='Spread the polling of the agents over each interval '
+                'according to a hash of the host name and of the interval, '
+                'instead of polling one interval after the start of the '
+                'agent.'),
+    cfg.FloatOpt('polling_jitter',
+                 default=0,
+                 help='Maximum random delay added to each polling cycle, '
+                 'as a fraction of its interval.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+cfg.CONF.import_opt('host', 'ceilometer.service')
+
 LOG = log.getLogger(__name__)
 
+# Upper bounds in seconds of the buckets of the pollster durations, a
+# last bucket counts the longer ones
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+DURATION_LABELS = (['<=%ss' % b for b in DURATION_BUCKETS] +
+                   ['>%ss' % DURATION_BUCKETS[-1]])
+
 
 class Resources(object):
     def __init__(self, agent_manager):
@@ -66,6 +109,10 @@ class PollingTask(object):
         self.resources = collections.defaultdict(resource_factory)
         self.publish_context = pipeline.PublishContext(
             agent_manager.context)
+        self._publish_lock = semaphore.Semaphore()
+        # count of the polls of each pollster by duration bucket
+        self.durations = collections.defaultdict(
+            lambda: [0] * (len(DURATION_BUCKETS) + 1))
 
     def add(self, pollster, pipelines):
         self.publish_context.add_pipelines(pipelines)
@@ -73,27 +120,119 @@ class PollingTask(object):
             self.resources[pollster.name].extend(pipe_line)
         self.pollsters.update([pollster])
 
-    def poll_and_publish(self):
-        """Polling sample and publish into pipeline."""
-        agent_resources = self.manager.discover()
-        with self.publish_context as publisher:
-            cache = {}
-            for pollster in self.pollsters:
-                key = pollster.name
-                LOG.info(_("Polling pollster %s"), key)
-                source_resources = list(self.resources[key].resources)
-                try:
+    def _record_duration(self, name, duration):
+        self.durations[name][bisect.bisect_left(DURATION_BUCKETS,
+                                                duration)] += 1
+
+    def _poll(self, pollster, publisher, cache, agent_resources):
+        key = pollster.name
+        LOG.info(_("Polling pollster %s"), key)
+        source_resources = list(self.resources[key].resources)
+        start = time.time()
+        try:
+            samples = None
+            try:
+                # a timeout of None never expires; it is raised in this
+                # greenthread, so it can not interrupt a native call that
+                # blocks without yielding, such as most libvirt calls
+                with eventlet.Timeout(cfg.CONF.pollster_timeout or None,
+                                      False):
                     samples = list(pollster.obj.get_samples(
                         manager=self.manager,
                         cache=cache,
                         resources=source_resources or agent_resources,
                     ))
-                    publisher(samples)
-                except Exception as err:
-                    LOG.warning(_(
-                        'Continue after error from %(name)s: %(error)s')
-                        % ({'name': pollster.name, 'error': err}),
-                        exc_info=True)
+            finally:
+                self._record_duration(key, time.time() - start)
+            if samples is None:
+                LOG.warning(_('Pollster %(name)s timed out after %(timeout)s '
+                              'seconds, dropping its samples')
+                            % {'name': key,
+                               'timeout': cfg.CONF.pollster_timeout})
+                return
+            # the samples of a pollster are published as soon as it
+            # completes, but one batch at a time as the transformers and
+            # the publishers may yield to the other greenthreads
+            with self._publish_lock:
+                publisher(samples)
+        except Exception as err:
+            LOG.warning(_(
+                'Continue after error from %(name)s: %(error)s')
+                % ({'name': pollster.name, 'error': err}),
+                exc_info=True)
+
+    def poll_and_publish(self):
+        """Polling sample and publish into pipeline."""
+        agent_resources = self.manager.discover()
+        with self.publish_context as publisher:
+            # the cache is shared by the greenthreads of the pollsters:
+            # they only switch on I/O so the dict is never seen half
+            # updated, at worst two pollsters both compute a missing entry
+            cache = {}
+            concurrency = cfg.CONF.polling_concurrency
+            if concurrency > 1 and len(self.pollsters) > 1:
+                pool = eventlet.GreenPool(concurrency)
+                for pollster in self.pollsters:
+                    pool.spawn_n(self._poll, pollster, publisher, cache,
+                                 agent_resources)
+                pool.waitall()
+            else:
+                for pollster in self.pollsters:
+                    self._poll(pollster, publisher, cache, agent_resources)
+        if LOG.isEnabledFor(logging.DEBUG):
+            for name, counts in sorted(self.durations.iteritems()):
+                LOG.debug(_("Durations of pollster %(name)s: %(counts)s"),
+                          {'name': name,
+                           'counts': ', '.join(
+                               '%s: %d' % (label, count)
+                               for label, count in zip(DURATION_LABELS,
+                                                       counts))})
+
+
+class PollingSchedule(object):
+    """Start times of the polling cycles of a task.
+
+    The cycles start on a grid of period interval. With stagger, the grid
+    is offset by a hash of the host and the interval, so that the agents
+    of a cloud spread their polling over the interval while each agent
+    keeps its slot across restarts; otherwise the first cycle starts one
+    interval after the schedule is created. Every start is computed from
+    the grid rather than from the end of the previous cycle, so the
+    schedule does not drift, and is delayed by a random jitter of up to
+    jitter times the interval.
+
+    A cycle outlasting its interval skips the slots it overran instead of
+    having the missed cycles run back to back; they are reported and
+    counted in overruns.
+    """
+
+    def __init__(self, interval, host, stagger=True, jitter=0):
+        self.interval = interval
+        if stagger:
+            key = ('%s:%s' % (host, interval)).encode('utf-8')
+            self.offset = (zlib.crc32(key) & 0xffffffff) % interval
+        else:
+            self.offset = time.time() % interval
+        self.jitter = jitter
+        self.overruns = 0
+        self._slot = None
+
+    def delay(self, now):
+        """Return the number of seconds to wait for the next cycle."""
+        wait = (self.offset - now) % self.interval
+        slot = now + (wait or self.interval)
+        if self._slot is not None:
+            missed = int(round((slot - self._slot) / self.interval)) - 1
+            if missed < 0:
+                # woken up early, the cycle just ran in this slot
+                slot += self.interval
+            elif missed > 0:
+                self.overruns += missed
+                LOG.warning(_('Polling cycle of interval %(interval)ss '
+                              'overran, skipping %(missed)d cycles')
+                            % {'interval': self.interval, 'missed': missed})
+        self._slot = slot
+        return slot - now + random.uniform(0, self.jitter * self.interval)
 
 
 class AgentManager(os_service.Service):
@@ -137,9 +276,23 @@ class AgentManager(os_service.Service):
         self.pipeline_manager = pipeline.setup_pipeline()
 
         for interval, task in self.setup_polling_tasks().iteritems():
-            self.tg.add_timer(interval,
-                              self.interval_task,
-                              task=task)
+            schedule = PollingSchedule(interval, cfg.CONF.host,
+                                       stagger=cfg.CONF.polling_stagger,
+                                       jitter=cfg.CONF.polling_jitter)
+            self.tg.add_dynamic_timer(self.scheduled_task,
+                                      schedule.delay(time.time()),
+                                      None,
+                                      task=task,
+                                      schedule=schedule)
+
+    def scheduled_task(self, task, schedule):
+        """Run a polling cycle and return the delay until the next one."""
+        try:
+            self.interval_task(task)
+        except Exception:
+            LOG.exception(_('Polling cycle of interval %ss failed')
+                          % schedule.interval)
+        return schedule.delay(time.time())
 
     @staticmethod
     def interval_task(task):
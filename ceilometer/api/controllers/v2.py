@@ -2503,7 +2503,8 @@ class Capabilities(_Base):
                                                  'complex': True}}},
                 'events': {'query': {'simple': True}},
             }),
-            storage=_flatten_capabilities({'production_ready': True}),
+            storage=_flatten_capabilities({'production_ready': True,
+                                           'rollups': False}),
         )
 
 
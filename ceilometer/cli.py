@@ -57,6 +57,10 @@ OPTS = [
 cfg.CONF.register_opts(OPTS, group='alarm')
 cfg.CONF.import_opt('time_to_live', 'ceilometer.storage',
                     group='database')
+cfg.CONF.import_opt('expirer_chunk_size', 'ceilometer.storage',
+                    group='database')
+cfg.CONF.import_opt('expirer_throttle', 'ceilometer.storage',
+                    group='database')
 
 LOG = logging.getLogger(__name__)
 
@@ -117,7 +121,9 @@ def storage_expirer():
         LOG.debug(_("Clearing expired metering data"))
         storage_conn = storage.get_connection_from_config(cfg.CONF)
         storage_conn.clear_expired_metering_data(
-            cfg.CONF.database.time_to_live)
+            cfg.CONF.database.time_to_live,
+            chunk_size=cfg.CONF.database.expirer_chunk_size,
+            throttle=cfg.CONF.database.expirer_throttle)
     else:
         LOG.info(_("Nothing to clean, database time to live is disabled"))
 
@@ -15,8 +15,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import os
 import socket
+import sys
+import threading
+import time
 
+from eventlet import queue
 import msgpack
 from oslo.config import cfg
 
@@ -35,6 +41,49 @@ OPTS = [
     cfg.IntOpt('udp_port',
                default=4952,
                help='Port to which the UDP socket is bound.'),
+    cfg.IntOpt('udp_queue_size',
+               default=1024,
+               help='Maximum number of decoded datagrams waiting to be '
+               'stored by a collector worker. Datagrams received while the '
+               'queue is full are dropped.'),
+    cfg.IntOpt('udp_batch_size',
+               default=64,
+               help='Maximum number of datagrams whose samples are handed '
+               'to the dispatchers in a single call.'),
+    cfg.IntOpt('udp_stats_interval',
+               default=0,
+               help='Interval in seconds between two logs of the counters '
+               'of received, decoded, dropped and stored datagrams of a '
+               'collector worker (0 disables them).'),
+    cfg.IntOpt('write_behind_size',
+               default=0,
+               help='Maximum number of samples buffered in memory by a '
+               'collector worker before they are handed to the dispatchers '
+               'by writer threads. Received samples are acknowledged before '
+               'being stored, so buffered samples are lost if the collector '
+               'dies. 0 disables the buffer and stores the samples as they '
+               'are received.'),
+    cfg.IntOpt('write_behind_flush_size',
+               default=100,
+               help='Number of buffered samples handed to the dispatchers '
+               'at once.'),
+    cfg.FloatOpt('write_behind_flush_interval',
+                 default=1.0,
+                 help='Maximum number of seconds a sample stays buffered '
+                 'before being handed to the dispatchers.'),
+    cfg.IntOpt('write_behind_workers',
+               default=1,
+               help='Number of writer threads of the write-behind buffer.'),
+    cfg.StrOpt('write_behind_overflow',
+               default='block',
+               help='What to do with received samples when the write-behind '
+               'buffer is full: "block" until there is room for them, '
+               '"drop_oldest" buffered samples, or "spill" them to '
+               'write_behind_spill_dir until there is room.'),
+    cfg.StrOpt('write_behind_spill_dir',
+               help='Directory the samples overflowing the write-behind '
+               'buffer are spilled to. Spilled samples left by a previous '
+               'run are stored at startup.'),
 ]
 
 cfg.CONF.register_opts(OPTS, group="collector")
@@ -44,9 +93,181 @@ cfg.CONF.import_opt('metering_topic', 'ceilometer.publisher.rpc',
 
 LOG = log.getLogger(__name__)
 
+# NOTE: Python 2 does not expose the constant, but Linux >= 3.9 supports it
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
+UDP_COUNTERS = ('received', 'decoded', 'dropped', 'buffered', 'stored')
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+
+class WriteBehindBuffer(object):
+    """Bounded buffer of samples stored by writer threads.
+
+    Samples are handed to write by batches of flush_size samples, or as
+    soon as the oldest buffered sample has waited for flush_interval
+    seconds. When the buffer holds size samples, the samples put in it
+    are handled according to the overflow policy:
+
+    - block: wait until writers have made room for them;
+    - drop_oldest: drop the oldest buffered samples;
+    - spill: write them to a file of spill_dir. Spilled samples are read
+      back by the writers once the buffer is empty.
+    """
+
+    SPILL_SUFFIX = '.spill'
+
+    def __init__(self, write, size, flush_size, flush_interval,
+                 overflow='block', spill_dir=None):
+        self.write = write
+        self.size = size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        if overflow not in OVERFLOW_POLICIES:
+            LOG.warn(_('Write-behind overflow policy is unknown (%s) force '
+                       'to block') % overflow)
+            overflow = 'block'
+        elif overflow == 'spill' and not spill_dir:
+            LOG.warn(_('No directory to spill samples to, write-behind '
+                       'overflow policy forced to block'))
+            overflow = 'block'
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.dropped = 0
+        self.spilled = 0
+        self.written = 0
+        self.running = True
+        # (time the sample was buffered, sample) pairs
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._spill_seq = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, samples):
+        """Buffer samples, applying the overflow policy if needed."""
+        with self._cond:
+            if len(self._pending) + len(samples) > self.size:
+                if self.overflow == 'block':
+                    while (self.running and self._pending and
+                           len(self._pending) + len(samples) > self.size):
+                        self._cond.wait()
+                elif self.overflow == 'drop_oldest':
+                    if len(samples) > self.size:
+                        self.dropped += len(samples) - self.size
+                        samples = samples[-self.size:]
+                    while len(self._pending) + len(samples) > self.size:
+                        self._pending.popleft()
+                        self.dropped += 1
+                else:
+                    self._spill(samples)
+                    return
+            now = time.time()
+            self._pending.extend((now, s) for s in samples)
+            self._cond.notify_all()
+
+    def stop(self):
+        """Stop the writers once the buffered samples are written."""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    def run(self):
+        """Write the buffered samples until the buffer is stopped."""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def flush(self):
+        """Write all the samples buffered in memory."""
+        while True:
+            with self._cond:
+                batch = self._pop(self.flush_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self.write(batch)
+        except Exception:
+            LOG.exception(_("Unable to store buffered samples"))
+        else:
+            self.written += len(batch)
+
+    def _pop(self, count):
+        batch = [self._pending.popleft()[1]
+                 for i in range(min(count, len(self._pending)))]
+        self._cond.notify_all()
+        return batch
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    age = time.time() - self._pending[0][0]
+                    if (not self.running or
+                            len(self._pending) >= self.flush_size or
+                            age >= self.flush_interval):
+                        return self._pop(self.flush_size)
+                    self._cond.wait(self.flush_interval - age)
+                    continue
+                spilled = self._unspill()
+                if spilled:
+                    return spilled
+                if not self.running:
+                    return None
+                self._cond.wait(self.flush_interval)
+
+    def _spill(self, samples):
+        self._spill_seq += 1
+        name = '%017.6f-%d-%09d' % (time.time(), os.getpid(),
+                                    self._spill_seq)
+        path = os.path.join(self.spill_dir, name)
+        try:
+            with open(path, 'wb') as f:
+                msgpack.dump(samples, f)
+            # only complete files are read back
+            os.rename(path, path + self.SPILL_SUFFIX)
+        except Exception:
+            LOG.exception(_("Unable to spill samples to %s"), path)
+            self.dropped += len(samples)
+        else:
+            self.spilled += len(samples)
+
+    def _unspill(self):
+        """Return the samples of the oldest spill file, or None."""
+        if self.overflow != 'spill':
+            return None
+        for name in sorted(os.listdir(self.spill_dir)):
+            if not name.endswith(self.SPILL_SUFFIX):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            # NOTE: the rename fails if another worker read the file first
+            claimed = '%s.%d' % (path, os.getpid())
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, 'rb') as f:
+                    return msgpack.load(f, encoding='utf-8')
+            except Exception:
+                LOG.exception(_("Unable to read spilled samples from %s"),
+                              claimed)
+            finally:
+                os.unlink(claimed)
+
 
 class CollectorService(os_service.Service):
     """Listener for the collector service."""
+
+    write_behind = None
+
     def start(self):
         """Bind the UDP socket and handle incoming data."""
         # ensure dispatcher is configured before starting other services
@@ -54,6 +275,18 @@ class CollectorService(os_service.Service):
         self.rpc_server = None
         super(CollectorService, self).start()
 
+        conf = cfg.CONF.collector
+        if conf.write_behind_size > 0:
+            self.write_behind = WriteBehindBuffer(
+                self._dispatch,
+                conf.write_behind_size,
+                conf.write_behind_flush_size,
+                conf.write_behind_flush_interval,
+                conf.write_behind_overflow,
+                conf.write_behind_spill_dir)
+            for i in range(conf.write_behind_workers):
+                self.tg.add_thread(self.write_behind.run)
+
         if cfg.CONF.collector.udp_address:
             self.tg.add_thread(self.start_udp)
 
@@ -68,38 +301,119 @@ class CollectorService(os_service.Service):
                 self.tg.add_timer(604800, lambda: None)
 
     def start_udp(self):
+        """Receive the samples sent over UDP and store them.
+
+        Each worker of the collector binds its own socket with SO_REUSEPORT
+        where available, so that the kernel balances the datagrams between
+        the workers. Datagrams are decoded by a receive loop and queued,
+        then dequeued in batches and handed to the dispatchers.
+        """
         udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if SO_REUSEPORT is not None:
+            try:
+                udp.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            except socket.error:
+                LOG.warn(_("UDP: SO_REUSEPORT is not supported, datagrams "
+                           "will not be balanced between workers"))
         udp.bind((cfg.CONF.collector.udp_address,
                   cfg.CONF.collector.udp_port))
 
+        self.udp_socket = udp
+        self.udp_queue = queue.LightQueue(cfg.CONF.collector.udp_queue_size)
+        self.udp_counters = dict.fromkeys(UDP_COUNTERS, 0)
         self.udp_run = True
+        if cfg.CONF.collector.udp_stats_interval > 0:
+            self.tg.add_timer(cfg.CONF.collector.udp_stats_interval,
+                              self._log_udp_counters)
+        self.tg.add_thread(self._udp_receive_loop)
+        self._udp_write_loop()
+
+    @staticmethod
+    def _decode_udp(data, source):
+        """Return the list of samples of a datagram, or None if invalid."""
+        try:
+            samples = msgpack.loads(data, encoding='utf-8')
+        except Exception:
+            LOG.warn(_("UDP: Cannot decode data sent by %s"), str(source))
+            return None
+        # NOTE: a datagram holds either a single sample or, when the
+        # publisher batches them, an array of samples.
+        if isinstance(samples, dict):
+            return [samples]
+        if (isinstance(samples, list) and
+                all(isinstance(s, dict) for s in samples)):
+            return samples
+        LOG.warn(_("UDP: Invalid data sent by %s"), str(source))
+        return None
+
+    def _udp_receive_loop(self):
         while self.udp_run:
             # NOTE(jd) Arbitrary limit of 64K because that ought to be
             # enough for anybody.
-            data, source = udp.recvfrom(64 * units.Ki)
+            data, source = self.udp_socket.recvfrom(64 * units.Ki)
+            self.udp_counters['received'] += 1
+            samples = self._decode_udp(data, source)
+            if samples is None:
+                continue
+            self.udp_counters['decoded'] += 1
             try:
-                sample = msgpack.loads(data, encoding='utf-8')
+                self.udp_queue.put_nowait(samples)
+            except queue.Full:
+                self.udp_counters['dropped'] += 1
+
+    def _udp_write_loop(self):
+        # NOTE: keep storing what has already been received once stopped
+        while self.udp_run or not self.udp_queue.empty():
+            try:
+                batch = [self.udp_queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(batch) < cfg.CONF.collector.udp_batch_size:
+                try:
+                    batch.append(self.udp_queue.get_nowait())
+                except queue.Empty:
+                    break
+            samples = [s for datagram in batch for s in datagram]
+            if self.write_behind:
+                # NOTE: they are only stored once the writers of the
+                # buffer have handed them to the dispatchers
+                self.write_behind.put(samples)
+                self.udp_counters['buffered'] += len(batch)
+                continue
+            LOG.debug(_("UDP: Storing %d samples"), len(samples))
+            try:
+                self._dispatch(samples)
             except Exception:
-                LOG.warn(_("UDP: Cannot decode data sent by %s"), str(source))
+                LOG.exception(_("UDP: Unable to store meter"))
             else:
-                try:
-                    LOG.debug(_("UDP: Storing %s"), str(sample))
-                    self.dispatcher_manager.map_method('record_metering_data',
-                                                       sample)
-                except Exception:
-                    LOG.exception(_("UDP: Unable to store meter"))
+                self.udp_counters['stored'] += len(batch)
+
+    def _log_udp_counters(self):
+        LOG.info(_("UDP: %(received)d datagrams received, %(decoded)d "
+                   "decoded, %(dropped)d dropped, %(buffered)d buffered, "
+                   "%(stored)d stored"), self.udp_counters)
 
     def stop(self):
         self.udp_run = False
         if self.rpc_server:
             self.rpc_server.stop()
+        if self.write_behind:
+            self.write_behind.stop()
+            self.write_behind.flush()
         super(CollectorService, self).stop()
 
+    def _dispatch(self, samples):
+        self.dispatcher_manager.map_method('record_metering_data', samples)
+
     def record_metering_data(self, context, data):
         """RPC endpoint for messages we send to ourselves.
 
         When the notification messages are re-published through the
         RPC publisher, this method receives them for processing.
         """
-        self.dispatcher_manager.map_method('record_metering_data', data=data)
+        if self.write_behind:
+            self.write_behind.put(data if isinstance(data, list) else [data])
+        else:
+            self.dispatcher_manager.map_method('record_metering_data',
+                                               data=data)
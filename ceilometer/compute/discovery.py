@@ -15,20 +15,225 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
+import hashlib
+
+from lxml import etree
 from oslo.config import cfg
+import oslo.messaging
 
+from ceilometer.compute.virt.libvirt import inspector as libvirt_inspector
+from ceilometer import messaging
 from ceilometer import nova_client
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+from ceilometer.openstack.common import timeutils
 from ceilometer import plugin
 
+OPTS = [
+    cfg.IntOpt('instance_discovery_ttl',
+               default=60,
+               help='Number of seconds the instances discovered on the host '
+               'are reused for before nova is queried again, so that the '
+               'polling tasks of a same polling cycle share a single query. '
+               '0 to query it for every polling task.'),
+    cfg.IntOpt('instance_full_refresh_interval',
+               default=3600,
+               help='Number of seconds after which all the instances of the '
+               'host are listed again, rather than only those changed '
+               'since the previous query of nova.'),
+    cfg.StrOpt('instance_discovery_notification_topic',
+               help='Topic of compute.instance.* notifications, nova is '
+               'queried again at the next polling cycle after one of them '
+               'is received about an instance of the host. Nova must also '
+               'send its notifications to this topic, which must not be '
+               'consumed by the notification agent.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+cfg.CONF.import_opt('host', 'ceilometer.service')
+
+LOG = log.getLogger(__name__)
+
+# Namespace of the metadata nova writes in the XML of its domains
+NOVA_NS = 'http://openstack.org/xmlns/libvirt/nova/1.0'
+
+# The status of the instances by libvirt domain state, the other states
+# being reported as active
+DOMAIN_STATUS = {
+    3: 'paused',     # VIR_DOMAIN_PAUSED
+    5: 'shutoff',    # VIR_DOMAIN_SHUTOFF
+    6: 'error',      # VIR_DOMAIN_CRASHED
+    7: 'suspended',  # VIR_DOMAIN_PMSUSPENDED
+}
+
 
 class InstanceDiscovery(plugin.DiscoveryBase):
+    """Discover the instances of the host through the nova API.
+
+    The instances are kept across the polling cycles of all the polling
+    tasks of the agent. Nova is queried at most every
+    instance_discovery_ttl seconds, and then only for the instances
+    changed since the previous query, deleted ones included. All the
+    instances of the host are listed every instance_full_refresh_interval
+    seconds, which also drops those migrated away.
+    """
+
     def __init__(self):
         super(InstanceDiscovery, self).__init__()
         self.nova_cli = nova_client.Client()
+        self.instances = {}
+        self.last_run = None
+        self.last_full_run = None
+        self.expires = None
+        self.listener = None
+
+    def discover(self, param=None):
+        """Discover resources to monitor.
+        """
+        self._listen()
+        now = timeutils.utcnow()
+        if self.expires is None or now >= self.expires:
+            self._refresh(now)
+        return list(self.instances.values())
+
+    def _refresh(self, now):
+        full = (self.last_full_run is None or
+                timeutils.delta_seconds(self.last_full_run, now) >=
+                cfg.CONF.instance_full_refresh_interval)
+        instances = self.nova_cli.instance_get_all_by_host(
+            cfg.CONF.host, None if full else self.last_run)
+        if full:
+            self.instances.clear()
+            self.last_full_run = now
+        for instance in instances:
+            state = getattr(instance, 'OS-EXT-STS:vm_state', None)
+            if state in ('error', 'deleted'):
+                self.instances.pop(instance.id, None)
+            else:
+                self.instances[instance.id] = instance
+        # now was taken before the query, so that no change made while
+        # it ran is missed by the next one
+        self.last_run = now
+        self.expires = now + datetime.timedelta(
+            seconds=cfg.CONF.instance_discovery_ttl)
+
+    def _listen(self):
+        topic = cfg.CONF.instance_discovery_notification_topic
+        if topic and self.listener is None:
+            self.listener = messaging.get_notification_listener(
+                messaging.get_transport(),
+                [oslo.messaging.Target(topic=topic)],
+                [self])
+            self.listener.start()
+
+    def info(self, ctxt, publisher_id, event_type, payload, metadata):
+        """Invalidate the instances on a compute.instance.* notification.
+        """
+        if not event_type.startswith('compute.instance.'):
+            return
+        instance_id = payload.get('instance_id')
+        if payload.get('host') == cfg.CONF.host:
+            LOG.debug(_('Instance %(id)s changed by %(event)s, querying '
+                        'nova at the next discovery'),
+                      {'id': instance_id, 'event': event_type})
+            self.expires = None
+        elif instance_id in self.instances:
+            # moved to another host
+            del self.instances[instance_id]
+
+
+class LocalInstance(object):
+    """Instance described from the nova metadata of its libvirt domain.
+
+    It has the attributes of the nova servers used by the compute
+    pollsters. The metadata does not hold the id of the flavor, so its
+    name is used instead, nor the user metadata of the instance.
+    """
+
+    def __init__(self, domain, metadata):
+        def text(path, default=None):
+            return metadata.findtext(path, default, namespaces=nsmap)
+
+        def attribute(path, name):
+            element = metadata.find(path, namespaces=nsmap)
+            return element.get(name) if element is not None else None
+
+        nsmap = {'nova': NOVA_NS}
+        self.id = domain.UUIDString()
+        self.name = text('nova:name')
+        setattr(self, 'OS-EXT-SRV-ATTR:instance_name', domain.name())
+        self.user_id = attribute('nova:owner/nova:user', 'uuid')
+        self.tenant_id = attribute('nova:owner/nova:project', 'uuid')
+        self.hostId = hashlib.sha224(
+            (self.tenant_id or '') + cfg.CONF.host).hexdigest()
+        flavor_name = attribute('nova:flavor', 'name')
+        self.flavor = {'id': flavor_name,
+                       'name': flavor_name,
+                       'vcpus': int(text('nova:flavor/nova:vcpus', 0)),
+                       'ram': int(text('nova:flavor/nova:memory', 0)),
+                       'disk': int(text('nova:flavor/nova:disk', 0)),
+                       'ephemeral': int(text('nova:flavor/nova:ephemeral',
+                                             0))}
+        if attribute('nova:root', 'type') == 'image':
+            self.image = {'id': attribute('nova:root', 'uuid')}
+        else:
+            self.image = None
+        self.metadata = {}
+        self.status = 'active'
+
+
+class LocalInstanceDiscovery(plugin.DiscoveryBase):
+    """Discover the instances of the host from its libvirt domains.
+
+    The instances are described from the metadata nova writes in the XML
+    of the domains, so the nova API is not queried. As with the nova API,
+    the instances whose domain is defined but inactive, such as shut off
+    ones, are discovered too. The XML of a domain is parsed again only
+    when its ID changes, that is when it is started or stopped; domains
+    without nova metadata or with an invalid XML are ignored.
+    """
+
+    def __init__(self):
+        super(LocalInstanceDiscovery, self).__init__()
+        self.inspector = libvirt_inspector.LibvirtInspector()
+        # (domain ID, instance or None) by domain UUID
+        self.instances = {}
+
+    @staticmethod
+    def _instance(domain):
+        tree = etree.fromstring(domain.XMLDesc(0))
+        metadata = tree.find('metadata/{%s}instance' % NOVA_NS)
+        if metadata is None:
+            LOG.debug(_('Ignoring domain %s without nova metadata'),
+                      domain.name())
+            return None
+        return LocalInstance(domain, metadata)
 
     def discover(self, param=None):
         """Discover resources to monitor.
         """
-        instances = self.nova_cli.instance_get_all_by_host(cfg.CONF.host)
-        return [i for i in instances
-                if getattr(i, 'OS-EXT-STS:vm_state', None) != 'error']
+        instances = {}
+        for domain_id, domain in self.inspector.list_domains(inactive=True):
+            uuid = domain.UUIDString()
+            cached = self.instances.get(uuid)
+            try:
+                if cached is None or cached[0] != domain_id:
+                    try:
+                        cached = (domain_id, self._instance(domain))
+                    except etree.XMLSyntaxError as err:
+                        LOG.warn(_('Ignoring domain %(name)s with invalid '
+                                   'XML: %(err)s'),
+                                 {'name': domain.name(), 'err': err})
+                        cached = (domain_id, None)
+                instance = cached[1]
+                if instance is not None:
+                    instance.status = DOMAIN_STATUS.get(domain.info()[0],
+                                                        'active')
+            except libvirt_inspector.libvirt.libvirtError:
+                # Domain was deleted while listing... ignore it
+                continue
+            instances[uuid] = cached
+        self.instances = instances
+        return [instance for domain_id, instance in instances.values()
+                if instance is not None]
@@ -15,19 +15,46 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from oslo.config import cfg
+
 from ceilometer import agent
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.openstack.common import log
 
+OPTS = [
+    cfg.StrOpt('instance_discovery',
+               default='local_instances',
+               help='Discovery extension listing the instances polled by '
+               'the compute agent, local_instances to query the nova API '
+               'or local_libvirt_instances to read the libvirt domains of '
+               'the host.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
 LOG = log.getLogger(__name__)
 
 
 class AgentManager(agent.AgentManager):
 
     def __init__(self):
-        super(AgentManager, self).__init__('compute', ['local_instances'])
+        super(AgentManager, self).__init__('compute',
+                                           [cfg.CONF.instance_discovery])
         self._inspector = virt_inspector.get_hypervisor_inspector()
 
     @property
     def inspector(self):
         return self._inspector
+
+    def interval_task(self, task):
+        # the pollsters of the cycle may all read from a single snapshot
+        # of the statistics of the instances, taken only if one of them
+        # reads from the inspector at all
+        if not any(getattr(pollster.obj, 'uses_inspector', True)
+                   for pollster in task.pollsters):
+            return super(AgentManager, self).interval_task(task)
+        self._inspector.begin_snapshot()
+        try:
+            super(AgentManager, self).interval_task(task)
+        finally:
+            self._inspector.end_snapshot()
@@ -29,6 +29,10 @@ class ComputePollster(plugin.PollsterBase):
     """Base class for plugins that support the polling API on the compute node.
     """
 
+    # Whether get_samples() reads the statistics of the instances from the
+    # hypervisor inspector of the manager
+    uses_inspector = True
+
     @abc.abstractmethod
     def get_samples(self, manager, cache, resources):
         """Return a sequence of Counter instances from polling the resources.
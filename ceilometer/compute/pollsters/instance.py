@@ -24,6 +24,8 @@ from ceilometer import sample
 
 class InstancePollster(plugin.ComputePollster):
 
+    uses_inspector = False
+
     @staticmethod
     def get_samples(manager, cache, resources):
         for instance in resources:
@@ -38,6 +40,8 @@ class InstancePollster(plugin.ComputePollster):
 
 class InstanceFlavorPollster(plugin.ComputePollster):
 
+    uses_inspector = False
+
     @staticmethod
     def get_samples(manager, cache, resources):
         for instance in resources:
@@ -146,6 +146,17 @@ class InstanceNotFoundException(InspectorException):
 #
 class Inspector(object):
 
+    def begin_snapshot(self):
+        """Gather the statistics of all the instances at once.
+
+        Until end_snapshot() is called, the inspect methods may answer from
+        this snapshot rather than query the hypervisor for each instance.
+        Inspectors without such a bulk mode do nothing.
+        """
+
+    def end_snapshot(self):
+        """Discard the snapshot gathered by begin_snapshot()."""
+
     def inspect_instances(self):
         """List the instances on the current host."""
         raise NotImplementedError()
@@ -16,6 +16,8 @@
 # under the License.
 """Implementation of Inspector abstraction for libvirt."""
 
+import collections
+
 from lxml import etree
 from oslo.config import cfg
 import six
@@ -37,11 +39,25 @@ libvirt_opts = [
                default='',
                help='Override the default libvirt URI '
                     '(which is dependent on libvirt_type).'),
+    cfg.BoolOpt('libvirt_bulk_stats',
+                default=False,
+                help='Gather the statistics of all the domains at once at '
+                     'each polling cycle, with a single getAllDomainStats '
+                     'call when libvirt provides it, rather than query each '
+                     'domain for each meter.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(libvirt_opts)
 
+# Interfaces and disks parsed from the XML of a domain with the given ID
+DomainDevices = collections.namedtuple('DomainDevices',
+                                       ['id', 'interfaces', 'disks'])
+
+# Statistics of a domain gathered in a snapshot
+DomainSnapshot = collections.namedtuple('DomainSnapshot',
+                                        ['cpus', 'vnics', 'disks'])
+
 
 class LibvirtInspector(virt_inspector.Inspector):
 
@@ -50,13 +66,22 @@ class LibvirtInspector(virt_inspector.Inspector):
     def __init__(self):
         self.uri = self._get_uri()
         self.connection = None
+        # DomainSnapshot by domain name, while a snapshot is used
+        self._snapshot = None
+        self._snapshot_users = 0
+        # DomainDevices by domain UUID, of the domains of the last snapshot
+        self._devices = {}
 
     def _get_uri(self):
         return CONF.libvirt_uri or self.per_type_uris.get(CONF.libvirt_type,
                                                           'qemu:///system')
 
     def _get_connection(self):
-        if not self.connection or not self._test_connection():
+        # the connection tested when the snapshot was taken is trusted
+        # while the snapshot is used, _snapshot is only set once it has
+        # been successfully taken
+        if (not self.connection or
+                (self._snapshot is None and not self._test_connection())):
             global libvirt
             if libvirt is None:
                 libvirt = __import__('libvirt')
@@ -92,33 +117,38 @@ class LibvirtInspector(virt_inspector.Inspector):
                                'ex': ex})
             raise virt_inspector.InstanceNotFoundException(msg)
 
-    def inspect_instances(self):
-        if self._get_connection().numOfDomains() > 0:
-            for domain_id in self._get_connection().listDomainsID():
+    def list_domains(self, connection=None, inactive=False):
+        """Yield the (ID, domain) pairs of the running domains.
+
+        :param inactive: also yield the defined but inactive domains, such
+                         as those of shut off instances, with an ID of -1
+        """
+        connection = connection or self._get_connection()
+        if connection.numOfDomains() > 0:
+            for domain_id in connection.listDomainsID():
                 try:
                     # We skip domains with ID 0 (hypervisors).
                     if domain_id != 0:
-                        domain = self._get_connection().lookupByID(domain_id)
-                        yield virt_inspector.Instance(name=domain.name(),
-                                                      UUID=domain.UUIDString())
+                        yield domain_id, connection.lookupByID(domain_id)
                 except libvirt.libvirtError:
                     # Instance was deleted while listing... ignore it
                     pass
+        if inactive:
+            for name in connection.listDefinedDomains():
+                try:
+                    yield -1, connection.lookupByName(name)
+                except libvirt.libvirtError:
+                    # Instance was undefined while listing... ignore it
+                    pass
 
-    def inspect_cpus(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        dom_info = domain.info()
-        return virt_inspector.CPUStats(number=dom_info[3], time=dom_info[4])
+    def inspect_instances(self):
+        for domain_id, domain in self.list_domains():
+            yield virt_inspector.Instance(name=domain.name(),
+                                          UUID=domain.UUIDString())
 
-    def inspect_vnics(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        state = domain.info()[0]
-        if state == libvirt.VIR_DOMAIN_SHUTOFF:
-            LOG.warn(_('Failed to inspect vnics of %(instance_name)s, '
-                       'domain is in state of SHUTOFF'),
-                     {'instance_name': instance_name})
-            return
-        tree = etree.fromstring(domain.XMLDesc(0))
+    @staticmethod
+    def _parse_interfaces(tree):
+        interfaces = []
         for iface in tree.findall('devices/interface'):
             target = iface.find('target')
             if target is not None:
@@ -136,9 +166,186 @@ class LibvirtInspector(virt_inspector.Inspector):
 
             params = dict((p.get('name').lower(), p.get('value'))
                           for p in iface.findall('filterref/parameter'))
-            interface = virt_inspector.Interface(name=name, mac=mac_address,
-                                                 fref=fref, parameters=params)
-            dom_stats = domain.interfaceStats(name)
+            interfaces.append(virt_inspector.Interface(name=name,
+                                                       mac=mac_address,
+                                                       fref=fref,
+                                                       parameters=params))
+        return interfaces
+
+    @staticmethod
+    def _parse_disks(tree):
+        return [virt_inspector.Disk(device=device)
+                for device in filter(
+                    bool,
+                    [target.get("dev")
+                     for target in tree.findall('devices/disk/target')])]
+
+    def _parse_devices(self, domain):
+        tree = etree.fromstring(domain.XMLDesc(0))
+        return DomainDevices(id=domain.ID(),
+                             interfaces=self._parse_interfaces(tree),
+                             disks=self._parse_disks(tree))
+
+    @staticmethod
+    def _domain_record(domain, devices):
+        """Return the statistics of a domain as getAllDomainStats does."""
+        dom_info = domain.info()
+        record = {'state.state': dom_info[0],
+                  'vcpu.current': dom_info[3],
+                  'cpu.time': dom_info[4],
+                  'net.count': len(devices.interfaces),
+                  'block.count': len(devices.disks)}
+        for i, interface in enumerate(devices.interfaces):
+            dom_stats = domain.interfaceStats(interface.name)
+            record.update({'net.%d.name' % i: interface.name,
+                           'net.%d.rx.bytes' % i: dom_stats[0],
+                           'net.%d.rx.pkts' % i: dom_stats[1],
+                           'net.%d.tx.bytes' % i: dom_stats[4],
+                           'net.%d.tx.pkts' % i: dom_stats[5]})
+        for i, disk in enumerate(devices.disks):
+            block_stats = domain.blockStats(disk.device)
+            record.update({'block.%d.name' % i: disk.device,
+                           'block.%d.rd.reqs' % i: block_stats[0],
+                           'block.%d.rd.bytes' % i: block_stats[1],
+                           'block.%d.wr.reqs' % i: block_stats[2],
+                           'block.%d.wr.bytes' % i: block_stats[3],
+                           'block.%d.errors' % i: block_stats[4]})
+        return record
+
+    @staticmethod
+    def _snapshot_domain(record, devices):
+        interfaces = dict((i.name, i) for i in devices.interfaces)
+        vnics = []
+        for i in range(record.get('net.count', 0)):
+            interface = interfaces.get(record.get('net.%d.name' % i))
+            if interface is None:
+                continue
+            stats = virt_inspector.InterfaceStats(
+                rx_bytes=record.get('net.%d.rx.bytes' % i, 0),
+                rx_packets=record.get('net.%d.rx.pkts' % i, 0),
+                tx_bytes=record.get('net.%d.tx.bytes' % i, 0),
+                tx_packets=record.get('net.%d.tx.pkts' % i, 0))
+            vnics.append((interface, stats))
+        disks = []
+        for i in range(record.get('block.count', 0)):
+            device = record.get('block.%d.name' % i)
+            if not device:
+                continue
+            stats = virt_inspector.DiskStats(
+                read_requests=record.get('block.%d.rd.reqs' % i, 0),
+                read_bytes=record.get('block.%d.rd.bytes' % i, 0),
+                write_requests=record.get('block.%d.wr.reqs' % i, 0),
+                write_bytes=record.get('block.%d.wr.bytes' % i, 0),
+                # getAllDomainStats has no error count, -1 is what
+                # blockStats reports when it does not know it either
+                errors=record.get('block.%d.errors' % i, -1))
+            disks.append((virt_inspector.Disk(device=device), stats))
+        cpus = virt_inspector.CPUStats(number=record.get('vcpu.current'),
+                                       time=record.get('cpu.time'))
+        return DomainSnapshot(cpus=cpus, vnics=vnics, disks=disks)
+
+    def _take_snapshot(self):
+        connection = self._get_connection()
+        snapshot = {}
+        devices_by_uuid = {}
+        if hasattr(connection, 'getAllDomainStats'):
+            records = connection.getAllDomainStats(
+                libvirt.VIR_DOMAIN_STATS_STATE |
+                libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                libvirt.VIR_DOMAIN_STATS_VCPU |
+                libvirt.VIR_DOMAIN_STATS_INTERFACE |
+                libvirt.VIR_DOMAIN_STATS_BLOCK,
+                libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+            for domain, record in records:
+                try:
+                    uuid = domain.UUIDString()
+                    devices = self._devices.get(uuid)
+                    names = set(record.get('net.%d.name' % i)
+                                for i in range(record.get('net.count', 0)))
+                    names.update(record.get('block.%d.name' % i)
+                                 for i in range(record.get('block.count', 0)))
+                    # the XML is parsed again when the domain is restarted
+                    # or a device is plugged
+                    if (devices is None or devices.id != domain.ID() or
+                            not names.issubset(
+                                [i.name for i in devices.interfaces] +
+                                [d.device for d in devices.disks])):
+                        devices = self._parse_devices(domain)
+                    devices_by_uuid[uuid] = devices
+                    snapshot[domain.name()] = self._snapshot_domain(record,
+                                                                    devices)
+                except libvirt.libvirtError:
+                    # Instance was deleted while inspecting... ignore it
+                    pass
+        else:
+            for domain_id, domain in self.list_domains(connection):
+                try:
+                    uuid = domain.UUIDString()
+                    devices = self._devices.get(uuid)
+                    # the XML is parsed again when the domain is restarted,
+                    # or once the stats of an unplugged device failed
+                    if devices is None or devices.id != domain_id:
+                        devices = self._parse_devices(domain)
+                    record = self._domain_record(domain, devices)
+                    devices_by_uuid[uuid] = devices
+                    snapshot[domain.name()] = self._snapshot_domain(record,
+                                                                    devices)
+                except libvirt.libvirtError:
+                    # Instance was deleted while inspecting... ignore it
+                    pass
+        self._devices = devices_by_uuid
+        return snapshot
+
+    def begin_snapshot(self):
+        if not CONF.libvirt_bulk_stats:
+            return
+        self._snapshot_users += 1
+        # only a snapshot successfully taken, over a connection tested at
+        # the time, may be used, never one left by a previous user
+        self._snapshot = None
+        try:
+            self._snapshot = self._take_snapshot()
+        except Exception as ex:
+            LOG.warn(_('Failed to take a snapshot of the domains, '
+                       'inspecting them one by one: %s'), ex)
+
+    def end_snapshot(self):
+        if not CONF.libvirt_bulk_stats:
+            return
+        self._snapshot_users -= 1
+        if not self._snapshot_users:
+            self._snapshot = None
+
+    def _from_snapshot(self, instance_name):
+        """Return the DomainSnapshot of an instance, None if not taken."""
+        if self._snapshot is None:
+            return None
+        return self._snapshot.get(instance_name)
+
+    def inspect_cpus(self, instance_name):
+        snapshot = self._from_snapshot(instance_name)
+        if snapshot is not None:
+            return snapshot.cpus
+        domain = self._lookup_by_name(instance_name)
+        dom_info = domain.info()
+        return virt_inspector.CPUStats(number=dom_info[3], time=dom_info[4])
+
+    def inspect_vnics(self, instance_name):
+        snapshot = self._from_snapshot(instance_name)
+        if snapshot is not None:
+            for vnic in snapshot.vnics:
+                yield vnic
+            return
+        domain = self._lookup_by_name(instance_name)
+        state = domain.info()[0]
+        if state == libvirt.VIR_DOMAIN_SHUTOFF:
+            LOG.warn(_('Failed to inspect vnics of %(instance_name)s, '
+                       'domain is in state of SHUTOFF'),
+                     {'instance_name': instance_name})
+            return
+        tree = etree.fromstring(domain.XMLDesc(0))
+        for interface in self._parse_interfaces(tree):
+            dom_stats = domain.interfaceStats(interface.name)
             stats = virt_inspector.InterfaceStats(rx_bytes=dom_stats[0],
                                                   rx_packets=dom_stats[1],
                                                   tx_bytes=dom_stats[4],
@@ -146,6 +353,11 @@ class LibvirtInspector(virt_inspector.Inspector):
             yield (interface, stats)
 
     def inspect_disks(self, instance_name):
+        snapshot = self._from_snapshot(instance_name)
+        if snapshot is not None:
+            for disk in snapshot.disks:
+                yield disk
+            return
         domain = self._lookup_by_name(instance_name)
         state = domain.info()[0]
         if state == libvirt.VIR_DOMAIN_SHUTOFF:
@@ -154,12 +366,8 @@ class LibvirtInspector(virt_inspector.Inspector):
                      {'instance_name': instance_name})
             return
         tree = etree.fromstring(domain.XMLDesc(0))
-        for device in filter(
-                bool,
-                [target.get("dev")
-                 for target in tree.findall('devices/disk/target')]):
-            disk = virt_inspector.Disk(device=device)
-            block_stats = domain.blockStats(device)
+        for disk in self._parse_disks(tree):
+            block_stats = domain.blockStats(disk.device)
             stats = virt_inspector.DiskStats(read_requests=block_stats[0],
                                              read_bytes=block_stats[1],
                                              write_requests=block_stats[2],
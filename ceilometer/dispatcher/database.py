@@ -45,6 +45,7 @@ class DatabaseDispatcher(dispatcher.Base):
         if not isinstance(data, list):
             data = [data]
 
+        samples = []
         for meter in data:
             LOG.debug(_(
                 'metering data %(counter_name)s '
@@ -63,15 +64,42 @@ class DatabaseDispatcher(dispatcher.Base):
                     if meter.get('timestamp'):
                         ts = timeutils.parse_isotime(meter['timestamp'])
                         meter['timestamp'] = timeutils.normalize_time(ts)
-                    self.storage_conn.record_metering_data(meter)
                 except Exception as err:
                     LOG.exception(_('Failed to record metering data: %s'),
                                   err)
+                else:
+                    samples.append(meter)
             else:
                 LOG.warning(_(
                     'message signature invalid, discarding message: %r'),
                     meter)
 
+        if not samples:
+            return
+
+        # NOTE: hand the whole payload over at once so that drivers
+        # can write it with as few round trips as possible.
+        try:
+            self.storage_conn.record_metering_data_batch(samples)
+        except Exception as err:
+            if not self.storage_conn.ATOMIC_BATCH:
+                # NOTE: part of the batch may have been written already,
+                # writing its samples again would store them twice.
+                LOG.exception(_('Failed to record metering data batch of '
+                                '%(count)d samples: %(err)s'),
+                              {'count': len(samples), 'err': err})
+                return
+            LOG.warning(_('Failed to record metering data batch, recording '
+                          'its %(count)d samples one by one: %(err)s'),
+                        {'count': len(samples), 'err': err})
+            # so that a bad sample only loses itself
+            for meter in samples:
+                try:
+                    self.storage_conn.record_metering_data(meter)
+                except Exception as err:
+                    LOG.exception(_('Failed to record metering data: %s'),
+                                  err)
+
     def record_events(self, events):
         if not isinstance(events, list):
             events = [events]
@@ -13,6 +13,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
 import functools
 
 import novaclient
@@ -20,11 +21,18 @@ from novaclient.v1_1 import client as nova_client
 from oslo.config import cfg
 
 from ceilometer.openstack.common import log
+from ceilometer.openstack.common import timeutils
+from ceilometer import utils
 
 cfg.CONF.import_group('service_credentials', 'ceilometer.service')
 
 LOG = log.getLogger(__name__)
 
+# The flavors and images are looked up again after an hour, and the
+# least recently used ones evicted beyond this number of each
+CACHE_SIZE = 1000
+CACHE_TTL = datetime.timedelta(hours=1)
+
 
 def logged(func):
 
@@ -56,26 +64,34 @@ class Client(object):
             cacert=conf.os_cacert,
             insecure=conf.insecure,
             no_cache=True)
+        self._flavor_cache = utils.LRUCache(CACHE_SIZE)
+        self._image_cache = utils.LRUCache(CACHE_SIZE)
 
     def _with_flavor_and_image(self, instances):
-        flavor_cache = {}
-        image_cache = {}
         for instance in instances:
-            self._with_flavor(instance, flavor_cache)
-            self._with_image(instance, image_cache)
+            self._with_flavor(instance)
+            self._with_image(instance)
 
         return instances
 
-    def _with_flavor(self, instance, cache):
-        fid = instance.flavor['id']
-        if fid in cache:
-            flavor = cache.get(fid)
-        else:
+    @staticmethod
+    def _cached(cache, key, get):
+        """Return the resource of key, None if it does not exist."""
+        now = timeutils.utcnow()
+        entry = cache.get(key)
+        if entry is None or entry[0] <= now:
             try:
-                flavor = self.nova_client.flavors.get(fid)
+                resource = get(key)
             except novaclient.exceptions.NotFound:
-                flavor = None
-            cache[fid] = flavor
+                resource = None
+            entry = (now + CACHE_TTL, resource)
+            cache[key] = entry
+        return entry[1]
+
+    def _with_flavor(self, instance):
+        fid = instance.flavor['id']
+        flavor = self._cached(self._flavor_cache, fid,
+                              self.nova_client.flavors.get)
 
         attr_defaults = [('name', 'unknown-id-%s' % fid),
                          ('vcpus', 0), ('ram', 0), ('disk', 0),
@@ -87,7 +103,7 @@ class Client(object):
                 continue
             instance.flavor[attr] = getattr(flavor, attr, default)
 
-    def _with_image(self, instance, cache):
+    def _with_image(self, instance):
         try:
             iid = instance.image['id']
         except TypeError:
@@ -96,14 +112,8 @@ class Client(object):
             instance.ramdisk_id = None
             return
 
-        if iid in cache:
-            image = cache.get(iid)
-        else:
-            try:
-                image = self.nova_client.images.get(iid)
-            except novaclient.exceptions.NotFound:
-                image = None
-            cache[iid] = image
+        image = self._cached(self._image_cache, iid,
+                             self.nova_client.images.get)
 
         attr_defaults = [('kernel_id', None),
                          ('ramdisk_id', None)]
@@ -117,9 +127,15 @@ class Client(object):
             setattr(instance, attr, ameta)
 
     @logged
-    def instance_get_all_by_host(self, hostname):
-        """Returns list of instances on particular host."""
+    def instance_get_all_by_host(self, hostname, since=None):
+        """Returns list of instances on particular host.
+
+        If since is given, only the instances changed since that time are
+        returned, deleted ones included.
+        """
         search_opts = {'host': hostname, 'all_tenants': True}
+        if since:
+            search_opts['changes-since'] = timeutils.isotime(since)
         return self._with_flavor_and_image(self.nova_client.servers.list(
             detailed=True,
             search_opts=search_opts))
@@ -18,9 +18,9 @@
 # under the License.
 
 import fnmatch
-import itertools
-import operator
+import logging
 import os
+import re
 
 from oslo.config import cfg
 import yaml
@@ -28,7 +28,9 @@ import yaml
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer import publisher
+from ceilometer.publisher import utils as publisher_utils
 from ceilometer import transformer as xformer
+from ceilometer import utils
 
 
 OPTS = [
@@ -42,6 +44,11 @@ cfg.CONF.register_opts(OPTS)
 
 LOG = log.getLogger(__name__)
 
+# Number of meter names whose matching decision and pipelines are cached
+METER_CACHE_SIZE = 1024
+
+GLOB_CHARS = re.compile(r'[*?[]')
+
 
 class PipelineException(Exception):
     def __init__(self, message, pipeline_cfg):
@@ -54,19 +61,24 @@ class PipelineException(Exception):
 
 class PublishContext(object):
 
-    def __init__(self, context, pipelines=None):
+    def __init__(self, context, pipelines=None, router=None):
         pipelines = pipelines or []
         self.pipelines = set(pipelines)
         self.context = context
+        self._router = router
 
     def add_pipelines(self, pipelines):
         self.pipelines.update(pipelines)
+        self._router = None
 
     def __enter__(self):
+        if self._router is None:
+            self._router = MeterRouter(self.pipelines)
+        router = self._router
+
         def p(samples):
-            for p in self.pipelines:
-                p.publish_samples(self.context,
-                                  samples)
+            for p, supported in router.route(samples):
+                p.publish_samples(self.context, supported)
         return p
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -74,6 +86,32 @@ class PublishContext(object):
             p.flush(self.context)
 
 
+class MeterRouter(object):
+    """Index of the pipelines supporting each meter name."""
+
+    def __init__(self, pipelines):
+        self.pipelines = list(pipelines)
+        self._routes = utils.LRUCache(METER_CACHE_SIZE)
+
+    def pipelines_for(self, meter_name):
+        pipelines = self._routes.get(meter_name)
+        if pipelines is None:
+            pipelines = [p for p in self.pipelines
+                         if p.support_meter(meter_name)]
+            self._routes[meter_name] = pipelines
+        return pipelines
+
+    def route(self, samples):
+        """Return the pipelines supporting some of the samples, each with
+        the list of the samples it supports.
+        """
+        routed = {}
+        for s in samples:
+            for p in self.pipelines_for(s.name):
+                routed.setdefault(p, []).append(s)
+        return [(p, routed[p]) for p in self.pipelines if p in routed]
+
+
 class Source(object):
     """Represents a source of samples, in effect a set of pollsters
     and/or notification handlers emitting samples for a set of matching
@@ -113,6 +151,7 @@ class Source(object):
             raise PipelineException("Discovery should be a list", cfg)
 
         self._check_meters()
+        self._compile_meters()
 
     def __str__(self):
         return self.name
@@ -152,26 +191,48 @@ class Source(object):
         else:
             return name
 
-    def support_meter(self, meter_name):
-        meter_name = self._variable_meter_name(meter_name)
+    @staticmethod
+    def _compile_patterns(patterns):
+        """Split meter patterns into a set of exact names and a regex
+        matching any of the wildcard ones.
+        """
+        exact = set(p for p in patterns if not GLOB_CHARS.search(p))
+        wildcards = [fnmatch.translate(p) for p in patterns
+                     if p not in exact]
+        return exact, re.compile('|'.join(wildcards)) if wildcards else None
 
+    def _compile_meters(self):
         # Special case: if we only have negation, we suppose the default is
         # allow
-        default = all(meter.startswith('!') for meter in self.meters)
+        self._default = all(meter.startswith('!') for meter in self.meters)
+        self._excluded = self._compile_patterns(
+            [meter[1:] for meter in self.meters if meter[0] == '!'])
+        self._included = self._compile_patterns(
+            [meter for meter in self.meters if meter[0] != '!'])
+        self._decisions = utils.LRUCache(METER_CACHE_SIZE)
 
-        # Support wildcard like storage.* and !disk.*
-        # Start with negation, we consider that the order is deny, allow
-        if any(fnmatch.fnmatch(meter_name, meter[1:])
-               for meter in self.meters
-               if meter[0] == '!'):
-            return False
+    @staticmethod
+    def _match(meter_name, patterns):
+        exact, wildcards = patterns
+        return meter_name in exact or bool(wildcards and
+                                           wildcards.match(meter_name))
 
-        if any(fnmatch.fnmatch(meter_name, meter)
-               for meter in self.meters
-               if meter[0] != '!'):
-            return True
+    def support_meter(self, meter_name):
+        decision = self._decisions.get(meter_name)
+        if decision is not None:
+            return decision
 
-        return default
+        name = self._variable_meter_name(meter_name)
+        # Support wildcard like storage.* and !disk.*
+        # Start with negation, we consider that the order is deny, allow
+        if self._match(name, self._excluded):
+            decision = False
+        elif self._match(name, self._included):
+            decision = True
+        else:
+            decision = self._default
+        self._decisions[meter_name] = decision
+        return decision
 
     def check_sinks(self, sinks):
         if not self.sinks:
@@ -266,10 +327,12 @@ class Sink(object):
             for transformer in self.transformers[start:]:
                 sample = transformer.handle_sample(ctxt, sample)
                 if not sample:
-                    LOG.debug(_(
-                        "Pipeline %(pipeline)s: Sample dropped by "
-                        "transformer %(trans)s") % ({'pipeline': self,
-                                                     'trans': transformer}))
+                    if LOG.isEnabledFor(logging.DEBUG):
+                        LOG.debug(_(
+                            "Pipeline %(pipeline)s: Sample dropped by "
+                            "transformer %(trans)s") % (
+                                {'pipeline': self,
+                                 'trans': transformer}))
                     return
             return sample
         except Exception as err:
@@ -283,6 +346,11 @@ class Sink(object):
     def _publish_samples(self, start, ctxt, samples):
         """Push samples into pipeline for publishing.
 
+        Every sample is run through the transformers, then each publisher
+        is called once with all the samples they emitted. The metering
+        messages of those samples are signed once for all the publishers
+        that publish messages.
+
         :param start: The first transformer that the sample will be injected.
                       This is mainly for flush() invocation that transformer
                       may emit samples.
@@ -291,21 +359,37 @@ class Sink(object):
 
         """
 
-        transformed_samples = []
-        for sample in samples:
-            LOG.debug(_(
-                "Pipeline %(pipeline)s: Transform sample "
-                "%(smp)s from %(trans)s transformer") % ({'pipeline': self,
-                                                          'smp': sample,
-                                                          'trans': start}))
-            sample = self._transform_sample(start, ctxt, sample)
-            if sample:
-                transformed_samples.append(sample)
+        if start < len(self.transformers):
+            debug = LOG.isEnabledFor(logging.DEBUG)
+            transformed_samples = []
+            for sample in samples:
+                if debug:
+                    LOG.debug(_(
+                        "Pipeline %(pipeline)s: Transform sample "
+                        "%(smp)s from %(trans)s transformer") % (
+                            {'pipeline': self,
+                             'smp': sample,
+                             'trans': start}))
+                sample = self._transform_sample(start, ctxt, sample)
+                if sample:
+                    transformed_samples.append(sample)
+        else:
+            transformed_samples = list(samples)
 
         if transformed_samples:
+            messages = None
             for p in self.publishers:
                 try:
-                    p.publish_samples(ctxt, transformed_samples)
+                    if isinstance(p, publisher.MessagePublisherBase):
+                        if messages is None:
+                            secret = cfg.CONF.publisher.metering_secret
+                            messages = [
+                                publisher_utils.meter_message_from_counter(
+                                    sample, secret)
+                                for sample in transformed_samples]
+                        p.publish_messages(ctxt, messages)
+                    else:
+                        p.publish_samples(ctxt, transformed_samples)
                 except Exception:
                     LOG.exception(_(
                         "Pipeline %(pipeline)s: Continue after error "
@@ -313,10 +397,7 @@ class Sink(object):
                                                       'pub': p}))
 
     def publish_samples(self, ctxt, samples):
-        for meter_name, samples in itertools.groupby(
-                sorted(samples, key=operator.attrgetter('name')),
-                operator.attrgetter('name')):
-            self._publish_samples(0, ctxt, samples)
+        self._publish_samples(0, ctxt, samples)
 
     def flush(self, ctxt):
         """Flush data after all samples have been injected to pipeline."""
@@ -502,13 +583,21 @@ class PipelineManager(object):
                 source = Source(pipedef)
                 sink = Sink(pipedef, transformer_manager)
                 self.pipelines.append(Pipeline(source, sink))
+        self.router = MeterRouter(self.pipelines)
+
+    def pipelines_for(self, meter_name):
+        """Return the pipelines supporting a meter.
+
+        :param meter_name: The name of the meter.
+        """
+        return self.router.pipelines_for(meter_name)
 
     def publisher(self, context):
         """Build a new Publisher for these manager pipelines.
 
         :param context: The context.
         """
-        return PublishContext(context, self.pipelines)
+        return PublishContext(context, self.pipelines, self.router)
 
 
 def setup_pipeline(transformer_manager=None):
@@ -19,10 +19,12 @@
 
 import abc
 
+from oslo.config import cfg
 import six
 from stevedore import driver
 
 from ceilometer.openstack.common import network_utils
+from ceilometer.publisher import utils
 
 
 def get_publisher(url, namespace='ceilometer.publisher'):
@@ -46,3 +48,23 @@ class PublisherBase(object):
     @abc.abstractmethod
     def publish_samples(self, context, samples):
         "Publish samples into final conduit."
+
+
+@six.add_metaclass(abc.ABCMeta)
+class MessagePublisherBase(PublisherBase):
+    """Base class for plugins that publish signed metering messages.
+
+    The pipeline builds and signs the messages of a batch of samples once,
+    and passes them to every such publisher of its sink.
+    """
+
+    def publish_samples(self, context, samples):
+        "Sign the samples, then publish their metering messages."
+        secret = cfg.CONF.publisher.metering_secret
+        self.publish_messages(context, [
+            utils.meter_message_from_counter(sample, secret)
+            for sample in samples])
+
+    @abc.abstractmethod
+    def publish_messages(self, context, messages):
+        "Publish signed metering messages into final conduit."
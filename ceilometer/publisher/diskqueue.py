@@ -0,0 +1,199 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Persistent FIFO queue stored in segment files.
+"""
+
+import os
+import struct
+import threading
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import jsonutils
+from ceilometer.openstack.common import log
+from ceilometer.openstack.common import units
+
+LOG = log.getLogger(__name__)
+
+# Every entry is prefixed by the length of its JSON payload
+HEADER = struct.Struct('>I')
+
+SEGMENT_SUFFIX = '.seg'
+HEAD_FILE = 'head'
+
+
+class SegmentQueue(object):
+    """FIFO queue of JSON serializable entries persisted in a directory.
+
+    Entries are appended to segment files of about segment_size bytes.
+    Entries are read with peek() and removed from the queue with commit();
+    the position of the first entry not committed is saved, so that the
+    queue is resumed from it after a restart. Segments are deleted once all
+    their entries have been committed.
+
+    When the segments take more than max_bytes, the oldest ones are
+    dropped, so at most max_bytes plus one segment is used on disk. At most
+    the entries returned by peek() are held in memory. Entries may be
+    appended between a peek() and its commit(); if that drops some of the
+    peeked entries, commit() only removes those still queued.
+    """
+
+    def __init__(self, path, max_bytes, segment_size=units.Mi):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._segments = sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                                for name in os.listdir(path)
+                                if name.endswith(SEGMENT_SUFFIX))
+        self._sizes = dict((seq, os.path.getsize(self._segment_path(seq)))
+                           for seq in self._segments)
+        self._head_offset = self._read_head()
+        self._writer = None
+        # (segment, offset) following each entry returned by peek()
+        self._peeked = []
+        # number of entries returned by peek() dropped since then
+        self._peeked_dropped = 0
+        self._lock = threading.Lock()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, '%020d%s' % (seq, SEGMENT_SUFFIX))
+
+    def _read_head(self):
+        try:
+            with open(os.path.join(self.path, HEAD_FILE)) as f:
+                seq, offset = [int(v) for v in f.read().split()]
+        except (IOError, ValueError):
+            return 0
+        if self._segments and self._segments[0] == seq:
+            return offset
+        return 0
+
+    def _write_head(self):
+        path = os.path.join(self.path, HEAD_FILE)
+        seq = self._segments[0] if self._segments else 0
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % (seq, self._head_offset))
+        os.rename(path + '.tmp', path)
+
+    @property
+    def size(self):
+        """Number of bytes used by the segments."""
+        return sum(self._sizes.itervalues())
+
+    def empty(self):
+        return (not self._segments or
+                (len(self._segments) == 1 and
+                 self._head_offset >= self._sizes[self._segments[0]]))
+
+    def append(self, entry):
+        data = jsonutils.dumps(entry)
+        with self._lock:
+            self._append(data)
+
+    def _append(self, data):
+        if (self._writer is None or
+                self._sizes[self._segments[-1]] >= self.segment_size):
+            self._roll()
+        self._writer.write(HEADER.pack(len(data)))
+        self._writer.write(data)
+        self._writer.flush()
+        self._sizes[self._segments[-1]] += HEADER.size + len(data)
+        self._enforce_budget()
+
+    def _roll(self):
+        """Start a new segment; segments of a previous run may be truncated
+        so they are never appended to.
+        """
+        if self._writer is not None:
+            self._writer.close()
+        seq = self._segments[-1] + 1 if self._segments else 0
+        self._writer = open(self._segment_path(seq), 'ab')
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+
+    def _drop_head_segment(self):
+        seq = self._segments.pop(0)
+        os.unlink(self._segment_path(seq))
+        del self._sizes[seq]
+        self._head_offset = 0
+
+    def _enforce_budget(self):
+        dropped = 0
+        while self.size > self.max_bytes and len(self._segments) > 1:
+            dropped += self._sizes[self._segments[0]] - self._head_offset
+            self._drop_head_segment()
+        if dropped:
+            # forget the peeked entries of the dropped segments
+            peeked = [(seq, offset) for seq, offset in self._peeked
+                      if seq in self._sizes]
+            self._peeked_dropped += len(self._peeked) - len(peeked)
+            self._peeked = peeked
+            LOG.warn(_("Disk queue %(path)s exceeds %(max)d bytes, dropping "
+                       "%(dropped)d bytes of oldest entries"),
+                     {'path': self.path, 'max': self.max_bytes,
+                      'dropped': dropped})
+            self._write_head()
+
+    def peek(self, count):
+        """Return up to count entries from the head of the queue."""
+        with self._lock:
+            return self._peek(count)
+
+    def _peek(self, count):
+        entries = []
+        self._peeked = []
+        self._peeked_dropped = 0
+        offset = self._head_offset
+        for seq in list(self._segments):
+            if len(entries) >= count:
+                break
+            with open(self._segment_path(seq), 'rb') as f:
+                f.seek(offset)
+                while len(entries) < count:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    length, = HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length:
+                        # truncated by a crash while it was written
+                        break
+                    try:
+                        entries.append(jsonutils.loads(data))
+                    except ValueError:
+                        LOG.warn(_("Skipping corrupted entry of %s"),
+                                 self._segment_path(seq))
+                        continue
+                    finally:
+                        offset = f.tell()
+                    self._peeked.append((seq, offset))
+            offset = 0
+        return entries
+
+    def commit(self, count):
+        """Remove the first count entries returned by peek()."""
+        with self._lock:
+            # the entries already dropped to enforce max_bytes are skipped
+            count = min(count - self._peeked_dropped, len(self._peeked))
+            self._peeked_dropped = 0
+            if count <= 0:
+                return
+            seq, offset = self._peeked[count - 1]
+            del self._peeked[:count]
+            while self._segments[0] != seq:
+                self._drop_head_segment()
+            self._head_offset = offset
+            if len(self._segments) > 1 and offset >= self._sizes[seq]:
+                self._drop_head_segment()
+            self._write_head()
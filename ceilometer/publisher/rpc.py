@@ -20,6 +20,7 @@
 
 import itertools
 import operator
+import threading
 
 from oslo.config import cfg
 import oslo.messaging
@@ -27,10 +28,12 @@ import oslo.messaging._drivers.common
 from six.moves.urllib import parse as urlparse
 
 from ceilometer import messaging
+from ceilometer.openstack.common import context as req_context
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
+from ceilometer.openstack.common import units
 from ceilometer import publisher
-from ceilometer.publisher import utils
+from ceilometer.publisher import diskqueue
 
 
 LOG = log.getLogger(__name__)
@@ -44,6 +47,19 @@ METER_PUBLISH_OPTS = [
 ]
 
 
+# Maximum number of samples sent in a single cast when replaying queues
+REPLAY_BATCH_SIZE = 1000
+
+# Number of queued entries read at once from the disk queue
+REPLAY_READ_SIZE = 100
+
+# Arguments of RequestContext that are saved with the entries of the disk
+# queue, credentials such as the auth token are never written to disk
+CONTEXT_ARGS = ('user', 'tenant', 'domain', 'user_domain', 'project_domain',
+                'is_admin', 'read_only', 'show_deleted', 'request_id',
+                'instance_uuid')
+
+
 def register_opts(config):
     """Register the options for publishing metering messages.
     """
@@ -77,7 +93,7 @@ def override_backend_retry_config(value):
             cfg.CONF.set_override('rabbit_max_retries', value)
 
 
-class RPCPublisher(publisher.PublisherBase):
+class RPCPublisher(publisher.MessagePublisherBase):
 
     def __init__(self, parsed_url):
         options = urlparse.parse_qs(parsed_url.query)
@@ -95,6 +111,16 @@ class RPCPublisher(publisher.PublisherBase):
 
         self.local_queue = []
 
+        # NOTE: with the queue policy, unsent samples can be kept on disk
+        # rather than in memory, so that they survive a restart
+        self.disk_queue = None
+        queue_path = options.get('queue_path', [None])[-1]
+        if self.policy == 'queue' and queue_path:
+            self.disk_queue = diskqueue.SegmentQueue(
+                queue_path,
+                int(options.get('max_queue_bytes', [64 * units.Mi])[-1]))
+        self._replay_lock = threading.Lock()
+
         if self.policy in ['queue', 'drop']:
             LOG.info(_('Publishing policy set to %s, '
                        'override backend retry config to 1') % self.policy)
@@ -109,21 +135,15 @@ class RPCPublisher(publisher.PublisherBase):
         transport = messaging.get_transport()
         self.rpc_client = messaging.get_rpc_client(transport, version='1.0')
 
-    def publish_samples(self, context, samples):
-        """Publish samples on RPC.
+    def publish_messages(self, context, meters):
+        """Publish metering messages on RPC.
 
         :param context: Execution context from the service or RPC call.
-        :param samples: Samples from pipeline after transformation.
+        :param meters: Signed metering messages of the samples from
+                       pipeline after transformation.
 
         """
 
-        meters = [
-            utils.meter_message_from_counter(
-                sample,
-                cfg.CONF.publisher.metering_secret)
-            for sample in samples
-        ]
-
         topic = cfg.CONF.publisher_rpc.metering_topic
         self.local_queue.append((context, topic, meters))
 
@@ -148,11 +168,103 @@ class RPCPublisher(publisher.PublisherBase):
         # something in the self.local_queue
         queue = self.local_queue
         self.local_queue = []
-        self.local_queue = self._process_queue(queue, self.policy) + \
+        if self.disk_queue is not None:
+            self._flush_to_disk_queue(queue)
+            return
+        self.local_queue = self._process_queue(self._merge(queue),
+                                               self.policy) + \
             self.local_queue
         if self.policy == 'queue':
             self._check_queue_length()
 
+    @staticmethod
+    def _entry_to_record(entry):
+        context, topic, meters = entry
+        if hasattr(context, 'to_dict'):
+            context = context.to_dict()
+        if isinstance(context, dict):
+            context = dict((k, context.get(k)) for k in CONTEXT_ARGS)
+        else:
+            context = None
+        return [context, topic, meters]
+
+    @staticmethod
+    def _record_to_entry(record):
+        context, topic, meters = record
+        return req_context.RequestContext(**(context or {})), topic, meters
+
+    def _flush_to_disk_queue(self, queue):
+        """Send the entries, keeping those that can not be sent on disk.
+
+        Entries are only written to disk when the broker is unreachable, or
+        to keep them ordered after the entries already on disk.
+        """
+        if not self._replay_lock.acquire(False):
+            # another thread is sending the queued entries
+            for entry in queue:
+                self.disk_queue.append(self._entry_to_record(entry))
+            return
+        try:
+            if not self.disk_queue.empty():
+                for entry in queue:
+                    self.disk_queue.append(self._entry_to_record(entry))
+                queue = []
+                if not self._replay_disk_queue():
+                    return
+            for entry in self._process_queue(self._merge(queue),
+                                             self.policy):
+                self.disk_queue.append(self._entry_to_record(entry))
+        finally:
+            self._replay_lock.release()
+
+    def _replay_disk_queue(self):
+        """Send the entries of the disk queue, oldest first.
+
+        Return whether the queue could be emptied.
+        """
+        while True:
+            records = self.disk_queue.peek(REPLAY_READ_SIZE)
+            if not records:
+                return True
+            sent = 0
+            for count, entry in self._coalesce(
+                    [self._record_to_entry(r) for r in records]):
+                if self._process_queue([entry], self.policy):
+                    self.disk_queue.commit(sent)
+                    return False
+                sent += count
+            self.disk_queue.commit(sent)
+
+    @staticmethod
+    def _coalesce(queue):
+        """Merge consecutive entries with the same context and topic.
+
+        Yield (number of merged entries, entry) pairs, the entries holding
+        at most REPLAY_BATCH_SIZE samples unless a single entry has more.
+        """
+        merged = None
+        count = 0
+        for context, topic, meters in queue:
+            if (merged is not None and merged[1] == topic and
+                    (merged[0] is context or
+                     (hasattr(context, 'to_dict') and
+                      merged[0].to_dict() == context.to_dict())) and
+                    len(merged[2]) + len(meters) <= REPLAY_BATCH_SIZE):
+                merged[2].extend(meters)
+                count += 1
+                continue
+            if merged is not None:
+                yield count, tuple(merged)
+            merged = [context, topic, list(meters)]
+            count = 1
+        if merged is not None:
+            yield count, tuple(merged)
+
+    @classmethod
+    def _merge(cls, queue):
+        """Return the entries of queue merged by _coalesce()."""
+        return [entry for count, entry in cls._coalesce(queue)]
+
     def _check_queue_length(self):
         queue_length = len(self.local_queue)
         if queue_length > self.max_queue_length > 0:
@@ -172,12 +284,12 @@ class RPCPublisher(publisher.PublisherBase):
         # the default policy just respect the rabbitmq configuration
         # nothing special is done if rabbit_max_retries <= 0
         # and exception is reraised if rabbit_max_retries > 0
-        while queue:
-            context, topic, meters = queue[0]
+        for i, (context, topic, meters) in enumerate(queue):
             try:
                 self.rpc_client.prepare(topic=topic).cast(
                     context, self.target, data=meters)
             except oslo.messaging._drivers.common.RPCException:
+                queue = queue[i:]
                 samples = sum([len(m) for __, __, m in queue])
                 if policy == 'queue':
                     LOG.warn(_("Failed to publish %d samples, queue them"),
@@ -189,6 +301,4 @@ class RPCPublisher(publisher.PublisherBase):
                     return []
                 # default, occur only if rabbit_max_retries > 0
                 raise
-            else:
-                queue.pop(0)
         return []
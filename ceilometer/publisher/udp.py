@@ -22,46 +22,94 @@ import socket
 
 import msgpack
 from oslo.config import cfg
+from six.moves.urllib import parse as urlparse
 
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import network_utils
+from ceilometer.openstack.common import units
 from ceilometer import publisher
-from ceilometer.publisher import utils
 
 cfg.CONF.import_opt('udp_port', 'ceilometer.collector',
                     group='collector')
 
 LOG = log.getLogger(__name__)
 
+# Leave some room under the 64K buffer the collector receives datagrams in
+DEFAULT_MAX_DATAGRAM_SIZE = 60 * units.Ki
+
+# Size of the largest msgpack array header
+ARRAY_HEADER_SIZE = 5
+
+
+class UDPPublisher(publisher.MessagePublisherBase):
+    """Publish samples over UDP.
+
+    The publisher can be configured with the following URL options:
+
+    - batch: if set to 1, the samples are packed into msgpack arrays
+      holding as many samples as fit in a datagram, rather than sent one
+      per datagram. The collectors must be able to decode arrays.
+    - max_datagram_size: the maximum size in bytes of a batched datagram.
+
+    For example: udp://collector:4952?batch=1&max_datagram_size=61440
+    """
 
-class UDPPublisher(publisher.PublisherBase):
     def __init__(self, parsed_url):
         self.host, self.port = network_utils.parse_host_port(
             parsed_url.netloc,
             default_port=cfg.CONF.collector.udp_port)
+        options = urlparse.parse_qs(parsed_url.query)
+        # the values of the option is a list of url params values
+        # only take care of the latest one if the option
+        # is provided more than once
+        self.batch = bool(int(options.get('batch', [0])[-1]))
+        self.max_datagram_size = int(options.get(
+            'max_datagram_size', [DEFAULT_MAX_DATAGRAM_SIZE])[-1])
+        self.packer = msgpack.Packer()
         self.socket = socket.socket(socket.AF_INET,
                                     socket.SOCK_DGRAM)
 
-    def publish_samples(self, context, samples):
-        """Send a metering message for publishing
+    def _pack(self, batch):
+        return self.packer.pack_array_header(len(batch)) + ''.join(batch)
+
+    def _make_datagrams(self, messages):
+        """Pack the encoded messages into arrays fitting in a datagram.
+
+        A message too large to share a datagram is sent in an array of its
+        own.
+        """
+        batch = []
+        size = ARRAY_HEADER_SIZE
+        for msg in messages:
+            if batch and size + len(msg) > self.max_datagram_size:
+                yield self._pack(batch)
+                batch = []
+                size = ARRAY_HEADER_SIZE
+            batch.append(msg)
+            size += len(msg)
+        if batch:
+            yield self._pack(batch)
+
+    def publish_messages(self, context, messages):
+        """Send metering messages for publishing
 
         :param context: Execution context from the service or RPC call
-        :param samples: Samples from pipeline after transformation
+        :param messages: Signed metering messages of the samples from
+                         pipeline after transformation
         """
 
-        for sample in samples:
-            msg = utils.meter_message_from_counter(
-                sample,
-                cfg.CONF.publisher.metering_secret)
-            host = self.host
-            port = self.port
-            LOG.debug(_("Publishing sample %(msg)s over UDP to "
-                        "%(host)s:%(port)d") % {'msg': msg, 'host': host,
-                                                'port': port})
+        messages = [msgpack.dumps(message) for message in messages]
+        datagrams = (self._make_datagrams(messages) if self.batch
+                     else messages)
+
+        LOG.debug(_("Publishing %(count)d samples over UDP to "
+                    "%(host)s:%(port)d"), {'count': len(messages),
+                                           'host': self.host,
+                                           'port': self.port})
+        for datagram in datagrams:
             try:
-                self.socket.sendto(msgpack.dumps(msg),
-                                   (self.host, self.port))
+                self.socket.sendto(datagram, (self.host, self.port))
             except Exception as e:
                 LOG.warn(_("Unable to send sample over UDP"))
                 LOG.exception(e)
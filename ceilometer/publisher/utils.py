@@ -24,6 +24,7 @@ import hmac
 from oslo.config import cfg
 import six
 
+from ceilometer.openstack.common import jsonutils
 from ceilometer import utils
 
 METER_PUBLISH_OPTS = [
@@ -48,10 +49,46 @@ def register_opts(config):
 register_opts(cfg.CONF)
 
 
+# Prefix of the signatures computed over the canonical JSON serialization
+# of the message, signatures without it use the legacy key pairs scheme.
+SIGNATURE_VERSION = 'v2'
+SIGNATURE_PREFIX = SIGNATURE_VERSION + ':'
+
+# Keyed HMAC objects, copied for each message rather than rebuilt
+_HMACS = {}
+
+
+def _hmac(secret):
+    try:
+        return _HMACS[secret].copy()
+    except KeyError:
+        digest_maker = _HMACS[secret] = hmac.new(secret, '', hashlib.sha256)
+        return digest_maker.copy()
+
+
+def _canonical(message):
+    """Return the JSON serialization of the message the signature covers.
+    """
+    if 'message_signature' in message:
+        # Skip any existing signature value, which would not have
+        # been part of the original message.
+        message = dict(message)
+        del message['message_signature']
+    return jsonutils.dumps(message, sort_keys=True, separators=(',', ':'))
+
+
 def compute_signature(message, secret):
     """Return the signature for a message dictionary.
     """
-    digest_maker = hmac.new(secret, '', hashlib.sha256)
+    digest_maker = _hmac(secret)
+    digest_maker.update(_canonical(message))
+    return SIGNATURE_PREFIX + digest_maker.hexdigest()
+
+
+def compute_legacy_signature(message, secret):
+    """Return the unversioned signature of older publishers.
+    """
+    digest_maker = _hmac(secret)
     for name, value in utils.recursive_keypairs(message):
         if name == 'message_signature':
             # Skip any existing signature value, which would not have
@@ -65,9 +102,16 @@ def compute_signature(message, secret):
 def verify_signature(message, secret):
     """Check the signature in the message against the value computed
     from the rest of the contents.
+
+    Signatures of both the current and the legacy scheme are accepted.
     """
     old_sig = message.get('message_signature')
-    new_sig = compute_signature(message, secret)
+    if not isinstance(old_sig, six.string_types):
+        return False
+    if old_sig.startswith(SIGNATURE_PREFIX):
+        new_sig = compute_signature(message, secret)
+    else:
+        new_sig = compute_legacy_signature(message, secret)
     return new_sig == old_sig
 
 
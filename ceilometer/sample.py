@@ -38,6 +38,17 @@ OPTS = [
 
 cfg.CONF.register_opts(OPTS)
 
+# The sample_source option, read once when the first sample without a
+# source is built rather than for each of them
+_default_source = None
+
+
+def _get_default_source():
+    global _default_source
+    if _default_source is None:
+        _default_source = cfg.CONF.sample_source
+    return _default_source
+
 
 # Fields explanation:
 #
@@ -54,8 +65,20 @@ cfg.CONF.register_opts(OPTS)
 # Resource ID: the resource ID
 # Timestamp: when the sample has been read
 # Resource metadata: various metadata
+# Attributes of a sample, as seen through Sample.as_dict()
+FIELDS = ('name', 'type', 'unit', 'volume', 'user_id', 'project_id',
+          'resource_id', 'timestamp', 'resource_metadata', 'source', 'id')
+
+
 class Sample(object):
 
+    # Samples are created by the million in the agents and transformers,
+    # keep them compact. The id is only generated when it is first read,
+    # as most intermediate samples of the transformers never need one.
+    __slots__ = ('name', 'type', 'unit', 'volume', 'user_id', 'project_id',
+                 'resource_id', 'timestamp', 'resource_metadata', 'source',
+                 '_id')
+
     def __init__(self, name, type, unit, volume, user_id, project_id,
                  resource_id, timestamp, resource_metadata, source=None):
         self.name = name
@@ -67,11 +90,21 @@ class Sample(object):
         self.resource_id = resource_id
         self.timestamp = timestamp
         self.resource_metadata = resource_metadata
-        self.source = source or cfg.CONF.sample_source
-        self.id = str(uuid.uuid1())
+        self.source = source or _get_default_source()
+        self._id = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = str(uuid.uuid1())
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        self._id = value
 
     def as_dict(self):
-        return copy.copy(self.__dict__)
+        return dict((f, getattr(self, f)) for f in FIELDS)
 
     @classmethod
     def from_notification(cls, name, type, volume, unit,
@@ -91,6 +124,7 @@ class Sample(object):
                    resource_metadata=metadata,
                    source=source)
 
+
 TYPE_GAUGE = 'gauge'
 TYPE_DELTA = 'delta'
 TYPE_CUMULATIVE = 'cumulative'
@@ -46,6 +46,14 @@ STORAGE_OPTS = [
                default=-1,
                help="Number of seconds that samples are kept "
                "in the database for (<= 0 means forever)."),
+    cfg.IntOpt('expirer_chunk_size',
+               default=10000,
+               help="Number of expired samples deleted per transaction "
+               "by ceilometer-expirer."),
+    cfg.FloatOpt('expirer_throttle',
+                 default=0,
+                 help="Number of seconds ceilometer-expirer sleeps between "
+                 "two chunks of expired samples."),
 ]
 
 cfg.CONF.register_opts(STORAGE_OPTS, group='database')
@@ -174,9 +174,15 @@ class Connection(object):
     }
 
     STORAGE_CAPABILITIES = {
-        'storage': {'production_ready': False},
+        'storage': {'production_ready': False,
+                    'rollups': False},
     }
 
+    """Whether record_metering_data_batch() writes either all the samples
+    of a batch or none of them, so that a failed batch may be written again.
+    """
+    ATOMIC_BATCH = False
+
     def __init__(self, url):
         """Constructor."""
         pass
@@ -196,12 +202,28 @@ class Connection(object):
         """
         raise NotImplementedError('Projects not implemented')
 
+    def record_metering_data_batch(self, samples):
+        """Write a list of samples to the backend storage system.
+
+        Drivers able to write several samples in fewer round trips than
+        one per sample should override this; the default simply records
+        each sample in turn.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        for sample in samples:
+            self.record_metering_data(sample)
+
     @staticmethod
-    def clear_expired_metering_data(ttl):
+    def clear_expired_metering_data(ttl, chunk_size=None, throttle=0):
         """Clear expired data from the backend storage system according to the
         time-to-live.
 
         :param ttl: Number of seconds to keep records for.
+        :param chunk_size: Maximum number of records deleted per transaction,
+                           None for no limit.
+        :param throttle: Number of seconds to sleep between two chunks.
 
         """
         raise NotImplementedError('Clearing samples not implemented')
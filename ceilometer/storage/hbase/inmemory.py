@@ -64,6 +64,9 @@ class MTable(object):
     def delete(self, key):
         del self._rows_with_ts[key]
 
+    def batch(self, timestamp=None, batch_size=None, transaction=False):
+        return MBatch(self, timestamp)
+
     def _get_latest_dict(self, row):
         # The idea here is to return latest versions of columns.
         # In _rows_with_ts we store {row: {ts_1: {data}, ts_2: {data}}}.
@@ -226,6 +229,33 @@ class MTable(object):
         return r
 
 
+class MBatch(object):
+    """HappyBase.Batch mock
+    """
+    def __init__(self, table, timestamp=None):
+        self.table = table
+        self.timestamp = timestamp
+        self._mutations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+    def put(self, key, data, wal=None):
+        self._mutations.append((self.table.put, (key, data, self.timestamp)))
+
+    def delete(self, key, columns=None, wal=None):
+        self._mutations.append((self.table.delete, (key,)))
+
+    def send(self):
+        for method, args in self._mutations:
+            method(*args)
+        self._mutations = []
+
+
 class MConnectionPool(object):
     def __init__(self):
         self.conn = MConnection()
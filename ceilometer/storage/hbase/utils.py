@@ -298,6 +298,16 @@ def format_meter_reference(c_name, c_type, c_unit, rts, source):
     return "%s+%s+%s!%s!%s" % (rts, source, c_name, c_type, c_unit)
 
 
+def timestamp_from_meter_rowkey(row):
+    """Return the timestamp encoded in a meter table row key, as a count of
+    microseconds since start of epoch.
+
+    Meter row keys are formatted as counter_name_rts_hash, the counter name
+    may itself contain underscores.
+    """
+    return 0x7fffffffffffffff - int(row.rsplit('_', 2)[1])
+
+
 def timestamp_from_record_tuple(record):
     """Extract timestamp from HBase tuple record
     """
@@ -22,9 +22,8 @@
 
 from __future__ import division
 import copy
-import datetime
 import itertools
-import sys
+import operator
 
 import bson.code
 import bson.objectid
@@ -48,7 +47,14 @@ AVAILABLE_CAPABILITIES = {
     'statistics': {'groupby': True,
                    'query': {'simple': True,
                              'metadata': True},
-                   'aggregation': {'standard': True}}
+                   'aggregation': {'standard': True,
+                                   'selectable': {'max': True,
+                                                  'min': True,
+                                                  'sum': True,
+                                                  'avg': True,
+                                                  'count': True,
+                                                  'stddev': True,
+                                                  'cardinality': True}}}
 }
 
 
@@ -74,27 +80,8 @@ class Connection(pymongo_base.Connection):
                                        AVAILABLE_CAPABILITIES)
     CONNECTION_POOL = pymongo_utils.ConnectionPool()
 
-    GROUP = {'_id': '$counter_name',
-             'unit': {'$min': '$counter_unit'},
-             'min': {'$min': '$counter_volume'},
-             'max': {'$max': '$counter_volume'},
-             'sum': {'$sum': '$counter_volume'},
-             'count': {'$sum': 1},
-             'duration_start': {'$min': '$timestamp'},
-             'duration_end': {'$max': '$timestamp'},
-             }
-
-    PROJECT = {'_id': 0, 'unit': 1,
-               'min': 1, 'max': 1, 'sum': 1, 'count': 1,
-               'avg': {'$divide': ['$sum', '$count']},
-               'duration_start': 1,
-               'duration_end': 1,
-               }
-
     SORT_OPERATION_MAP = {'desc': pymongo.DESCENDING, 'asc': pymongo.ASCENDING}
 
-    SECONDS_IN_A_DAY = 86400
-
     def __init__(self, url):
 
         # Since we are using pymongo, even though we are connecting to DB2
@@ -118,6 +105,12 @@ class Connection(pymongo_base.Connection):
         if self._using_mongodb and server_info.get('versionArray') < [2, 2]:
             raise storage.StorageBadVersion("Need at least MongoDB 2.2")
 
+        # NOTE: statistics are only computed by the server with the
+        # aggregation pipeline when the MongoDB used for tests supports date
+        # arithmetic in it, otherwise the driver folds the samples.
+        self.aggregation_pipeline = (self._using_mongodb and
+                                     server_info['versionArray'] >= [2, 6])
+
         connection_options = pymongo.uri_parser.parse_uri(url)
         self.db = getattr(self.conn, connection_options['database'])
         if connection_options.get('username'):
@@ -205,33 +198,61 @@ class Connection(pymongo_base.Connection):
         :param data: a dictionary such as returned by
                      ceilometer.meter.meter_message_from_counter
         """
+        self.record_metering_data_batch([data])
+
+    def record_metering_data_batch(self, samples):
+        """Write a list of samples to the backend storage system.
+
+        The resource collection is upserted once per distinct resource of
+        the batch and the raw samples are written with a single bulk
+        insert.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        if not samples:
+            return
+        resources = {}
+        for data in samples:
+            resource = resources.setdefault(data['resource_id'],
+                                            {'data': data, 'meters': []})
+            resource['data'] = data
+            meter = {'counter_name': data['counter_name'],
+                     'counter_type': data['counter_type'],
+                     'counter_unit': data['counter_unit'],
+                     }
+            if meter not in resource['meters']:
+                resource['meters'].append(meter)
+
         # Record the updated resource metadata
-        self.db.resource.update(
-            {'_id': data['resource_id']},
-            {'$set': {'project_id': data['project_id'],
-                      'user_id': data['user_id'] or 'null',
-                      'metadata': data['resource_metadata'],
-                      'source': data['source'],
-                      },
-             '$addToSet': {'meter': {'counter_name': data['counter_name'],
-                                     'counter_type': data['counter_type'],
-                                     'counter_unit': data['counter_unit'],
-                                     },
-                           },
-             },
-            upsert=True,
-        )
+        for resource_id, resource in resources.iteritems():
+            data = resource['data']
+            self.db.resource.update(
+                {'_id': resource_id},
+                {'$set': {'project_id': data['project_id'],
+                          'user_id': data['user_id'] or 'null',
+                          'metadata': data['resource_metadata'],
+                          'source': data['source'],
+                          },
+                 '$addToSet': {'meter': {'$each': resource['meters']}},
+                 },
+                upsert=True,
+            )
 
         # Record the raw data for the meter. Use a copy so we do not
         # modify a data structure owned by our caller (the driver adds
         # a new key '_id').
-        record = copy.copy(data)
-        record['recorded_at'] = timeutils.utcnow()
-        # Make sure that the data does have field _id which db2 wont add
-        # automatically.
-        if record.get('_id') is None:
-            record['_id'] = str(bson.objectid.ObjectId())
-        self.db.meter.insert(record)
+        recorded_at = timeutils.utcnow()
+        records = []
+        for data in samples:
+            record = copy.copy(data)
+            record['recorded_at'] = recorded_at
+            # Make sure that the data does have field _id which db2 wont add
+            # automatically.
+            if record.get('_id') is None:
+                record['_id'] = str(bson.objectid.ObjectId())
+            records.append(record)
+        self.db.meter.insert(records)
 
     def get_resources(self, user=None, project=None, source=None,
                       start_timestamp=None, start_timestamp_op=None,
@@ -314,79 +335,95 @@ class Connection(pymongo_base.Connection):
                                     'resource_id', 'source'])):
             raise NotImplementedError("Unable to group by these fields")
 
-        if aggregate:
-            raise NotImplementedError('Selectable aggregates not implemented')
-
         q = pymongo_utils.make_query_from_filter(sample_filter)
 
+        period_start = None
         if period:
             if sample_filter.start:
                 period_start = sample_filter.start
             else:
-                period_start = self.db.meter.find(
-                    limit=1, sort=[('timestamp',
-                                    pymongo.ASCENDING)])[0]['timestamp']
-
-        if groupby:
-            sort_keys = ['counter_name'] + groupby + ['timestamp']
+                first = list(self.db.meter.find(
+                    q, fields=['timestamp'], limit=1,
+                    sort=[('timestamp', pymongo.ASCENDING)]))
+                if not first:
+                    return []
+                period_start = first[0]['timestamp']
+
+        if self.aggregation_pipeline:
+            results = self._get_meter_statistics_pipeline(
+                q, period, period_start, groupby, aggregate)
         else:
-            sort_keys = ['counter_name', 'timestamp']
+            results = self._get_meter_statistics_folded(
+                q, period, period_start, groupby, aggregate)
+        return sorted(
+            (self._stats_result_to_model(r, groupby, aggregate)
+             for r in results),
+            key=operator.attrgetter('period_start'))
+
+    def _get_meter_statistics_folded(self, q, period, period_start,
+                                     groupby, aggregate):
+        """Compute the statistics by folding the samples in the driver.
+
+        DB2 has no date arithmetic in its aggregation pipeline, so the
+        samples matching the query are streamed back in natural order and
+        folded into one document per period and group, shaped as the
+        $group stage of the pipeline would output it. Only the folded
+        documents are held in memory, not the samples.
+
+        :return: an iterable of dicts such as taken by _stats_result_to_model
+        """
+        accumulators, functions = self._pipeline_aggregates(aggregate)
+        distinct = [param for key, func, param in functions
+                    if func == 'cardinality']
 
-        sort_instructions = self._build_sort_instructions(sort_keys=sort_keys,
-                                                          sort_dir='asc')
-        meters = self.db.meter.find(q, sort=sort_instructions)
+        fields = set(['counter_unit', 'counter_volume', 'timestamp'])
+        fields.update(groupby or [])
+        fields.update(distinct)
+
+        if period:
+            # NOTE: whole seconds, as the aggregation pipeline
+            period_start = period_start.replace(microsecond=0)
+            period_ms = period * 1000
 
-        def _group_key(meter):
-            # the method to define a key for groupby call
-            key = {}
-            for y in sort_keys:
-                if y == 'timestamp' and period:
-                    key[y] = (timeutils.delta_seconds(period_start,
-                                                      meter[y]) // period)
-                elif y != 'timestamp':
-                    key[y] = meter[y]
-            return key
-
-        def _to_offset(periods):
-            return {'days': (periods * period) // self.SECONDS_IN_A_DAY,
-                    'seconds': (periods * period) % self.SECONDS_IN_A_DAY}
-
-        for key, grouped_meters in itertools.groupby(meters, key=_group_key):
-            stat = models.Statistics(unit=None,
-                                     min=sys.maxint, max=-sys.maxint,
-                                     avg=0, sum=0, count=0,
-                                     period=0, period_start=0, period_end=0,
-                                     duration=0, duration_start=0,
-                                     duration_end=0, groupby=None)
-
-            for meter in grouped_meters:
-                stat.unit = meter.get('counter_unit', '')
-                m_volume = meter.get('counter_volume')
-                if stat.min > m_volume:
-                    stat.min = m_volume
-                if stat.max < m_volume:
-                    stat.max = m_volume
-                stat.sum += m_volume
-                stat.count += 1
-                if stat.duration_start == 0:
-                    stat.duration_start = meter['timestamp']
-                stat.duration_end = meter['timestamp']
-                if groupby and not stat.groupby:
-                    stat.groupby = {}
-                    for group_key in groupby:
-                        stat.groupby[group_key] = meter[group_key]
-
-            stat.duration = timeutils.delta_seconds(stat.duration_start,
-                                                    stat.duration_end)
-            stat.avg = stat.sum / stat.count
+        groups = {}
+        for sample in self.db.meter.find(q, fields=list(fields)):
+            key = tuple(sample.get(g) for g in groupby or [])
             if period:
-                stat.period = period
-                periods = key.get('timestamp')
-                stat.period_start = period_start + \
-                    datetime.timedelta(**(_to_offset(periods)))
-                stat.period_end = period_start + \
-                    datetime.timedelta(**(_to_offset(periods + 1)))
-            else:
-                stat.period_start = stat.duration_start
-                stat.period_end = stat.duration_end
-            yield stat
+                offset = int(timeutils.delta_seconds(
+                    period_start, sample['timestamp']) * 1000)
+                key += (offset - offset % period_ms,)
+            volume = sample['counter_volume']
+            timestamp = sample['timestamp']
+            group = groups.get(key)
+            if group is None:
+                group_key = dict(zip(groupby or [], key))
+                if period:
+                    group_key['period_offset'] = key[-1]
+                group = groups[key] = {
+                    '_id': group_key or None,
+                    'unit': sample['counter_unit'],
+                    'duration_start': timestamp,
+                    'duration_end': timestamp,
+                    'count': 0, 'sum': 0, 'sdsquares': 0,
+                    'min': volume, 'max': volume}
+                for param in distinct:
+                    group['distinct_%s' % param] = set()
+            group['unit'] = min(group['unit'], sample['counter_unit'])
+            group['duration_start'] = min(group['duration_start'], timestamp)
+            group['duration_end'] = max(group['duration_end'], timestamp)
+            group['count'] += 1
+            group['sum'] += volume
+            group['sdsquares'] += volume * volume
+            group['min'] = min(group['min'], volume)
+            group['max'] = max(group['max'], volume)
+            for param in distinct:
+                group['distinct_%s' % param].add(sample.get(param))
+
+        for group in groups.itervalues():
+            group['avg'] = group['sum'] / group['count']
+            group['sdcount'] = group['count']
+            group['sdsum'] = group['sum']
+
+        return self._pipeline_results(groups.itervalues(), functions,
+                                      period, period_start, groupby,
+                                      aggregate)
@@ -12,8 +12,10 @@
 # under the License.
 """HBase storage backend
 """
+import array
 import datetime
 import hashlib
+import math
 import operator
 import os
 import time
@@ -26,6 +28,7 @@ from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import network_utils
 from ceilometer.openstack.common import timeutils
+from ceilometer import storage
 from ceilometer.storage import base
 from ceilometer.storage.hbase import inmemory as hbase_inmemory
 from ceilometer.storage.hbase import utils as hbase_utils
@@ -42,9 +45,19 @@ AVAILABLE_CAPABILITIES = {
                             'metadata': True}},
     'samples': {'query': {'simple': True,
                           'metadata': True}},
-    'statistics': {'query': {'simple': True,
+    'statistics': {'groupby': True,
+                   'query': {'simple': True,
                              'metadata': True},
-                   'aggregation': {'standard': True}},
+                   'aggregation': {'standard': True,
+                                   'selectable': {
+                                       'max': True,
+                                       'min': True,
+                                       'sum': True,
+                                       'avg': True,
+                                       'count': True,
+                                       'stddev': True,
+                                       'cardinality': True}}
+                   },
     'events': {'query': {'simple': True}},
     'alarms': {'query': {'simple': True,
                          'complex': False},
@@ -53,6 +66,19 @@ AVAILABLE_CAPABILITIES = {
 }
 
 
+STANDARD_AGGREGATES = ('avg', 'sum', 'min', 'max', 'count')
+
+UNPARAMETERIZED_AGGREGATES = ('stddev',)
+
+PARAMETERIZED_AGGREGATES = {
+    'cardinality': ('resource_id', 'user_id', 'project_id'),
+}
+
+GROUPBY_FIELDS = ('resource_id', 'user_id', 'project_id')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
 AVAILABLE_STORAGE_CAPABILITIES = {
     'storage': {'production_ready': True},
 }
@@ -322,43 +348,77 @@ class Connection(base.Connection):
         :param data: a dictionary such as returned by
           ceilometer.meter.meter_message_from_counter
         """
+        self.record_metering_data_batch([data])
+
+    def record_metering_data_batch(self, samples):
+        """Write a list of samples to the backend storage system.
+
+        Resource rows are merged so that each resource of the batch is put
+        only once, and the sample rows are sent with a single Table.batch().
+
+        :param samples: a list of dictionaries such as returned by
+          ceilometer.meter.meter_message_from_counter
+        """
+        if not samples:
+            return
+        resources = {}
+        recorded_at = timeutils.utcnow()
         with self.conn_pool.connection() as conn:
             resource_table = conn.table(self.RESOURCE_TABLE)
             meter_table = conn.table(self.METER_TABLE)
 
-            resource_metadata = data.get('resource_metadata', {})
-            # Determine the name of new meter
-            rts = hbase_utils.timestamp(data['timestamp'])
-            new_meter = hbase_utils.format_meter_reference(
-                data['counter_name'], data['counter_type'],
-                data['counter_unit'], rts, data['source'])
-
-            # TODO(nprivalova): try not to store resource_id
-            resource = hbase_utils.serialize_entry(**{
-                'source': data['source'],
-                'meter': {new_meter: data['timestamp']},
-                'resource_metadata': resource_metadata,
-                'resource_id': data['resource_id'],
-                'project_id': data['project_id'], 'user_id': data['user_id']})
+            with meter_table.batch() as meter_batch:
+                for data in sorted(samples,
+                                   key=operator.itemgetter('timestamp')):
+                    resource_metadata = data.get('resource_metadata', {})
+                    # Determine the name of new meter
+                    rts = hbase_utils.timestamp(data['timestamp'])
+                    new_meter = hbase_utils.format_meter_reference(
+                        data['counter_name'], data['counter_type'],
+                        data['counter_unit'], rts, data['source'])
+
+                    # TODO(nprivalova): try not to store resource_id
+                    resource = hbase_utils.serialize_entry(**{
+                        'source': data['source'],
+                        'meter': {new_meter: data['timestamp']},
+                        'resource_metadata': resource_metadata,
+                        'resource_id': data['resource_id'],
+                        'project_id': data['project_id'],
+                        'user_id': data['user_id']})
+                    # Samples are iterated in timestamp order, so the
+                    # columns of the newest sample of each resource win.
+                    # Meter and source columns have distinct names and are
+                    # all kept.
+                    ts = int(time.mktime(data['timestamp'].timetuple()) *
+                             1000)
+                    merged = resources.setdefault(data['resource_id'],
+                                                  [ts, {}])
+                    merged[0] = ts
+                    merged[1].update(resource)
+
+                    # TODO(nprivalova): improve uniqueness
+                    # Rowkey consists of reversed timestamp, meter and an
+                    # md5 of user+resource+project for purposes of
+                    # uniqueness
+                    m = hashlib.md5()
+                    m.update("%s%s%s" % (data['user_id'],
+                                         data['resource_id'],
+                                         data['project_id']))
+                    row = "%s_%d_%s" % (data['counter_name'], rts,
+                                        m.hexdigest())
+                    record = hbase_utils.serialize_entry(
+                        data, **{'source': data['source'], 'rts': rts,
+                                 'message': data,
+                                 'recorded_at': recorded_at})
+                    meter_batch.put(row, record)
+
             # Here we put entry in HBase with our own timestamp. This is needed
             # when samples arrive out-of-order
             # If we use timestamp=data['timestamp'] the newest data will be
             # automatically 'on the top'. It is needed to keep metadata
             # up-to-date: metadata from newest samples is considered as actual.
-            ts = int(time.mktime(data['timestamp'].timetuple()) * 1000)
-            resource_table.put(data['resource_id'], resource, ts)
-
-            # TODO(nprivalova): improve uniqueness
-            # Rowkey consists of reversed timestamp, meter and an md5 of
-            # user+resource+project for purposes of uniqueness
-            m = hashlib.md5()
-            m.update("%s%s%s" % (data['user_id'], data['resource_id'],
-                                 data['project_id']))
-            row = "%s_%d_%s" % (data['counter_name'], rts, m.hexdigest())
-            record = hbase_utils.serialize_entry(
-                data, **{'source': data['source'], 'rts': rts,
-                         'message': data, 'recorded_at': timeutils.utcnow()})
-            meter_table.put(row, record)
+            for resource_id, (ts, resource) in resources.iteritems():
+                resource_table.put(resource_id, resource, ts)
 
     def get_resources(self, user=None, project=None, source=None,
                       start_timestamp=None, start_timestamp_op=None,
@@ -489,28 +549,71 @@ class Connection(base.Connection):
                 yield models.Sample(**d_meter['message'])
 
     @staticmethod
-    def _update_meter_stats(stat, meter):
-        """Do the stats calculation on a requested time bucket in stats dict
-
-        :param stats: dict where aggregated stats are kept
-        :param index: time bucket index in stats
-        :param meter: meter record as returned from HBase
-        :param start_time: query start time
-        :param period: length of the time bucket
+    def _get_aggregate_functions(aggregate):
+        """Return the (key, function, parameter) of the aggregates to compute.
+
+        :param aggregate: the selectable aggregates requested, if any
         """
-        vol = meter['counter_volume']
-        ts = meter['timestamp']
-        stat.unit = meter['counter_unit']
-        stat.min = min(vol, stat.min or vol)
-        stat.max = max(vol, stat.max)
-        stat.sum = vol + (stat.sum or 0)
-        stat.count += 1
-        stat.avg = (stat.sum / float(stat.count))
-        stat.duration_start = min(ts, stat.duration_start or ts)
-        stat.duration_end = max(ts, stat.duration_end or ts)
-        stat.duration = \
-            timeutils.delta_seconds(stat.duration_start,
-                                    stat.duration_end)
+        if not aggregate:
+            return [(a, a, None) for a in STANDARD_AGGREGATES]
+
+        functions = []
+        for a in aggregate:
+            if (a.func in STANDARD_AGGREGATES or
+                    a.func in UNPARAMETERIZED_AGGREGATES):
+                functions.append((a.func, a.func, None))
+            elif a.func in PARAMETERIZED_AGGREGATES:
+                if a.param not in PARAMETERIZED_AGGREGATES[a.func]:
+                    raise storage.StorageBadAggregate('Bad aggregate: %s.%s'
+                                                      % (a.func, a.param))
+                functions.append(('%s/%s' % (a.func, a.param),
+                                  a.func, a.param))
+            else:
+                raise NotImplementedError('Selectable aggregate function %s'
+                                          ' is not supported' % a.func)
+        return functions
+
+    @staticmethod
+    def _scan_statistics_columns(meter_table, sample_filter, fields):
+        """Load the columns needed by statistics into compact arrays.
+
+        Only the volume and the fields are decoded, each distinct raw value
+        of the unit and of the fields once; timestamps are read from the
+        row keys.
+
+        :param meter_table: the meter table
+        :param sample_filter: the filter of the samples to scan
+        :param fields: the names of the fields needed besides the unit
+        :return: a tuple of the timestamps (microseconds since epoch) and
+          volumes arrays, and a dict of (values, codes array) per field
+          plus 'counter_unit'
+        """
+        q, start, stop, columns = \
+            hbase_utils.make_sample_query_from_filter(sample_filter)
+        # the whole sample message is not needed
+        columns = [c for c in columns if c != 'f:message']
+        columns.extend(['f:counter_volume', 'f:counter_unit'])
+        columns.extend('f:%s' % f for f in fields)
+
+        timestamps = array.array('d')
+        volumes = array.array('d')
+        codes = dict((f, ({}, array.array('i')))
+                     for f in ['counter_unit'] + list(fields))
+        for row, entry in meter_table.scan(filter=q, row_start=start,
+                                           row_stop=stop, columns=columns):
+            timestamps.append(hbase_utils.timestamp_from_meter_rowkey(row))
+            volumes.append(hbase_utils.load(entry['f:counter_volume']))
+            for f, (interned, values) in codes.iteritems():
+                raw = entry.get('f:%s' % f, 'null')
+                values.append(interned.setdefault(raw, len(interned)))
+
+        decoded = {}
+        for f, (interned, values) in codes.iteritems():
+            names = [None] * len(interned)
+            for raw, code in interned.iteritems():
+                names[code] = hbase_utils.load(raw)
+            decoded[f] = (names, values)
+        return timestamps, volumes, decoded
 
     def get_meter_statistics(self, sample_filter, period=None, groupby=None,
                              aggregate=None):
@@ -523,79 +626,120 @@ class Connection(base.Connection):
 
           Due to HBase limitations the aggregations are implemented
           in the driver itself, therefore this method will be quite slow
-          because of all the Thrift traffic it is going to create.
+          because of all the Thrift traffic it is going to create. Only the
+          columns needed are fetched and decoded though, and the statistics
+          of all the periods and groups are computed in a single pass.
 
         """
-        if groupby:
-            raise NotImplementedError("Group by not implemented.")
+        groupby = groupby or []
+        for group in groupby:
+            if group not in GROUPBY_FIELDS:
+                raise NotImplementedError('Unable to group by these fields')
 
-        if aggregate:
-            raise NotImplementedError('Selectable aggregates not implemented')
+        functions = self._get_aggregate_functions(aggregate)
+        fields = list(groupby)
+        for key, func, param in functions:
+            if param and param not in fields:
+                fields.append(param)
 
         with self.conn_pool.connection() as conn:
             meter_table = conn.table(self.METER_TABLE)
-            q, start, stop, columns = \
-                hbase_utils.make_sample_query_from_filter(sample_filter)
-            # These fields are used in statistics' calculating
-            columns.extend(['f:timestamp', 'f:counter_volume',
-                            'f:counter_unit'])
-            meters = map(hbase_utils.deserialize_entry,
-                         list(meter for (ignored, meter) in
-                              meter_table.scan(
-                                  filter=q, row_start=start,
-                                  row_stop=stop, columns=columns)))
+            timestamps, volumes, codes = self._scan_statistics_columns(
+                meter_table, sample_filter, fields)
+
+        if not timestamps:
+            return []
+
+        def to_datetime(ts):
+            return EPOCH + datetime.timedelta(microseconds=ts)
 
         if sample_filter.start:
             start_time = sample_filter.start
-        elif meters:
-            start_time = meters[-1][0]['timestamp']
         else:
-            start_time = None
-
+            start_time = to_datetime(min(timestamps))
         if sample_filter.end:
             end_time = sample_filter.end
-        elif meters:
-            end_time = meters[0][0]['timestamp']
         else:
-            end_time = None
+            end_time = to_datetime(max(timestamps))
+        start_ts = hbase_utils.timestamp(start_time, reverse=False)
+        period_us = (period or 0) * 1000000
+
+        units, unit_codes = codes['counter_unit']
+        group_codes = [codes[g][1] for g in groupby]
+        cardinality = [(key, codes[param][1])
+                       for key, func, param in functions
+                       if func == 'cardinality']
+
+        # count, sum, sum of squares, min, max, first and last timestamps,
+        # unit code and sets of distinct values per bucket and group
+        buckets = {}
+        for i, ts in enumerate(timestamps):
+            vol = volumes[i]
+            bucket = (int((ts - start_ts) // period_us) if period_us else 0,
+                      tuple(c[i] for c in group_codes))
+            acc = buckets.get(bucket)
+            if acc is None:
+                buckets[bucket] = [1, vol, vol * vol, vol, vol, ts, ts,
+                                   unit_codes[i],
+                                   [set([c[i]]) for k, c in cardinality]]
+                continue
+            acc[0] += 1
+            acc[1] += vol
+            acc[2] += vol * vol
+            if vol < acc[3]:
+                acc[3] = vol
+            if vol > acc[4]:
+                acc[4] = vol
+            if ts < acc[5]:
+                acc[5] = ts
+            if ts >= acc[6]:
+                acc[6] = ts
+                acc[7] = unit_codes[i]
+            for distinct, (k, c) in zip(acc[8], cardinality):
+                distinct.add(c[i])
 
         results = []
-
-        if not period:
-            period = 0
-            period_start = start_time
-            period_end = end_time
-
-        # As our HBase meters are stored as newest-first, we need to iterate
-        # in the reverse order
-        for meter in meters[::-1]:
-            ts = meter[0]['timestamp']
+        for (index, group) in sorted(buckets):
+            count, total, squares, vmin, vmax, tsmin, tsmax, unit, distinct = \
+                buckets[(index, group)]
+            values = {'count': count, 'sum': total, 'min': vmin, 'max': vmax,
+                      'avg': total / float(count),
+                      'stddev': math.sqrt(max(
+                          0, squares / count - (total / count) ** 2))}
+            values.update((k, len(d))
+                          for (k, c), d in zip(cardinality, distinct))
+            if aggregate:
+                data = dict((func, values[func])
+                            for key, func, param in functions
+                            if func in STANDARD_AGGREGATES)
+                data['aggregate'] = dict((key, values[key])
+                                         for key, func, param in functions)
+            else:
+                data = dict((func, values[func])
+                            for key, func, param in functions)
             if period:
-                offset = int(timeutils.delta_seconds(
-                    start_time, ts) / period) * period
-                period_start = start_time + datetime.timedelta(0, offset)
-
-            if not results or not results[-1].period_start == \
-                    period_start:
-                if period:
-                    period_end = period_start + datetime.timedelta(
-                        0, period)
-                results.append(
-                    models.Statistics(unit='',
-                                      count=0,
-                                      min=0,
-                                      max=0,
-                                      avg=0,
-                                      sum=0,
-                                      period=period,
-                                      period_start=period_start,
-                                      period_end=period_end,
-                                      duration=None,
-                                      duration_start=None,
-                                      duration_end=None,
-                                      groupby=None)
-                )
-            self._update_meter_stats(results[-1], meter[0])
+                period_start = start_time + datetime.timedelta(
+                    seconds=index * period)
+                period_end = period_start + datetime.timedelta(
+                    seconds=period)
+            else:
+                period_start = start_time
+                period_end = end_time
+            duration_start = to_datetime(tsmin)
+            duration_end = to_datetime(tsmax)
+            results.append(models.Statistics(
+                unit=units[unit],
+                period=period or 0,
+                period_start=period_start,
+                period_end=period_end,
+                duration=timeutils.delta_seconds(duration_start,
+                                                 duration_end),
+                duration_start=duration_start,
+                duration_end=duration_end,
+                groupby=(dict((g, codes[g][0][c])
+                              for g, c in zip(groupby, group))
+                         if groupby else None),
+                **data))
         return results
 
     def record_events(self, event_models):
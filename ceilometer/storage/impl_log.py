@@ -46,11 +46,14 @@ class Connection(base.Connection):
                      'resource_id': data['resource_id'],
                      'counter_volume': data['counter_volume']}))
 
-    def clear_expired_metering_data(self, ttl):
+    def clear_expired_metering_data(self, ttl, chunk_size=None, throttle=0):
         """Clear expired data from the backend storage system according to the
         time-to-live.
 
         :param ttl: Number of seconds to keep records for.
+        :param chunk_size: Maximum number of records deleted per transaction,
+                           None for no limit.
+        :param throttle: Number of seconds to sleep between two chunks.
 
         """
         LOG.info(_("Dropping data with TTL %d"), ttl)
@@ -25,10 +25,12 @@ import copy
 import datetime
 import json
 import operator
+import time
 import uuid
 
 import bson.code
 import bson.objectid
+import bson.son
 import pymongo
 
 from oslo.config import cfg
@@ -87,13 +89,6 @@ class Connection(pymongo_base.Connection):
                                        AVAILABLE_CAPABILITIES)
     CONNECTION_POOL = pymongo_utils.ConnectionPool()
 
-    REDUCE_GROUP_CLEAN = bson.code.Code("""
-    function ( curr, result ) {
-        if (result.resources.indexOf(curr.resource_id) < 0)
-            result.resources.push(curr.resource_id);
-    }
-    """)
-
     STANDARD_AGGREGATES = dict(
         emit_initial=dict(
             sum='',
@@ -394,9 +389,15 @@ class Connection(pymongo_base.Connection):
         self.conn = self.CONNECTION_POOL.connect(url)
 
         # Require MongoDB 2.4 to use $setOnInsert
-        if self.conn.server_info()['versionArray'] < [2, 4]:
+        version = self.conn.server_info()['versionArray']
+        if version < [2, 4]:
             raise storage.StorageBadVersion("Need at least MongoDB 2.4")
 
+        # NOTE: the aggregation pipeline is used instead of map-reduce for
+        # statistics and resources when the server supports date arithmetic
+        # in it, map-reduce runs JavaScript single-threaded in mongod
+        self.aggregation_pipeline = version >= [2, 6]
+
         connection_options = pymongo.uri_parser.parse_uri(url)
         self.db = getattr(self.conn, connection_options['database'])
         if connection_options.get('username'):
@@ -479,25 +480,40 @@ class Connection(pymongo_base.Connection):
         :param data: a dictionary such as returned by
                      ceilometer.meter.meter_message_from_counter
         """
+        self.record_metering_data_batch([data])
+
+    def _update_resource(self, resource_id, samples):
+        """Record the updated resource metadata for a set of samples.
+
+        :param resource_id: the resource the samples belong to
+        :param samples: list of samples for that resource, sorted by
+                        timestamp
+        """
+        first, last = samples[0], samples[-1]
+        meters = []
+        for data in samples:
+            meter = {'counter_name': data['counter_name'],
+                     'counter_type': data['counter_type'],
+                     'counter_unit': data['counter_unit'],
+                     }
+            if meter not in meters:
+                meters.append(meter)
+
         # Record the updated resource metadata - we use $setOnInsert to
         # unconditionally insert sample timestamps and resource metadata
         # (in the update case, this must be conditional on the sample not
         # being out-of-order)
         resource = self.db.resource.find_and_modify(
-            {'_id': data['resource_id']},
-            {'$set': {'project_id': data['project_id'],
-                      'user_id': data['user_id'],
-                      'source': data['source'],
+            {'_id': resource_id},
+            {'$set': {'project_id': last['project_id'],
+                      'user_id': last['user_id'],
+                      'source': last['source'],
                       },
-             '$setOnInsert': {'metadata': data['resource_metadata'],
-                              'first_sample_timestamp': data['timestamp'],
-                              'last_sample_timestamp': data['timestamp'],
+             '$setOnInsert': {'metadata': last['resource_metadata'],
+                              'first_sample_timestamp': first['timestamp'],
+                              'last_sample_timestamp': last['timestamp'],
                               },
-             '$addToSet': {'meter': {'counter_name': data['counter_name'],
-                                     'counter_type': data['counter_type'],
-                                     'counter_unit': data['counter_unit'],
-                                     },
-                           },
+             '$addToSet': {'meter': {'$each': meters}},
              },
             upsert=True,
             new=True,
@@ -507,11 +523,11 @@ class Connection(pymongo_base.Connection):
         # in-order case)
         last_sample_timestamp = resource.get('last_sample_timestamp')
         if (last_sample_timestamp is None or
-                last_sample_timestamp <= data['timestamp']):
+                last_sample_timestamp <= last['timestamp']):
             self.db.resource.update(
-                {'_id': data['resource_id']},
-                {'$set': {'metadata': data['resource_metadata'],
-                          'last_sample_timestamp': data['timestamp']}}
+                {'_id': resource_id},
+                {'$set': {'metadata': last['resource_metadata'],
+                          'last_sample_timestamp': last['timestamp']}}
             )
 
         # only update first sample timestamp if actually earlier (the unusual
@@ -521,36 +537,72 @@ class Connection(pymongo_base.Connection):
         # recording these timestamps in the resource collection
         first_sample_timestamp = resource.get('first_sample_timestamp')
         if (first_sample_timestamp is not None and
-                first_sample_timestamp > data['timestamp']):
+                first_sample_timestamp > first['timestamp']):
             self.db.resource.update(
-                {'_id': data['resource_id']},
-                {'$set': {'first_sample_timestamp': data['timestamp']}}
+                {'_id': resource_id},
+                {'$set': {'first_sample_timestamp': first['timestamp']}}
             )
 
+    def record_metering_data_batch(self, samples):
+        """Write a list of samples to the backend storage system.
+
+        The resource collection is updated once per distinct resource of
+        the batch and the raw samples are written with a single bulk
+        insert.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        if not samples:
+            return
+        by_resource = {}
+        for data in sorted(samples, key=operator.itemgetter('timestamp')):
+            by_resource.setdefault(data['resource_id'], []).append(data)
+        for resource_id, resource_samples in by_resource.iteritems():
+            self._update_resource(resource_id, resource_samples)
+
         # Record the raw data for the meter. Use a copy so we do not
         # modify a data structure owned by our caller (the driver adds
         # a new key '_id').
-        record = copy.copy(data)
-        record['recorded_at'] = timeutils.utcnow()
-        self.db.meter.insert(record)
-
-    def clear_expired_metering_data(self, ttl):
+        recorded_at = timeutils.utcnow()
+        records = []
+        for data in samples:
+            record = copy.copy(data)
+            record['recorded_at'] = recorded_at
+            records.append(record)
+        self.db.meter.insert(records)
+
+    def clear_expired_metering_data(self, ttl, chunk_size=None, throttle=0):
         """Clear expired data from the backend storage system according to the
         time-to-live.
 
+        Samples are expired by the MongoDB TTL index, this only removes the
+        resources that have no sample left.  Resources whose last sample is
+        older than the TTL are checked by chunks of chunk_size.
+
         :param ttl: Number of seconds to keep records for.
+        :param chunk_size: Maximum number of resources checked per chunk,
+                           None for no limit.
+        :param throttle: Number of seconds to sleep between two chunks.
 
         """
-        results = self.db.meter.group(
-            key={},
-            condition={},
-            reduce=self.REDUCE_GROUP_CLEAN,
-            initial={
-                'resources': [],
-            }
-        )[0]
-
-        self.db.resource.remove({'_id': {'$nin': results['resources']}})
+        end = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
+        q = {'last_sample_timestamp': {'$lt': end}}
+        while True:
+            candidates = [r['_id'] for r in self.db.resource.find(
+                q, fields=['_id'], sort=[('_id', pymongo.ASCENDING)],
+                limit=chunk_size or 0)]
+            if not candidates:
+                break
+            alive = set(self.db.meter.find(
+                {'resource_id': {'$in': candidates}}).distinct('resource_id'))
+            self.db.resource.remove(
+                {'_id': {'$in': [r for r in candidates if r not in alive]}})
+            if not chunk_size or len(candidates) < chunk_size:
+                break
+            q['_id'] = {'$gt': candidates[-1]}
+            if throttle:
+                time.sleep(throttle)
 
     @staticmethod
     def _get_marker(db_collection, marker_pairs):
@@ -719,6 +771,52 @@ class Connection(pymongo_base.Connection):
         sort_keys = base._handle_sort_key('resource')
         sort_instructions = self._build_sort_instructions(sort_keys)[0]
 
+        if self.aggregation_pipeline:
+            return self._get_time_constrained_resources_pipeline(
+                query, sort_instructions)
+        return self._get_time_constrained_resources_map_reduce(
+            query, sort_instructions)
+
+    def _get_time_constrained_resources_pipeline(self, query,
+                                                 sort_instructions):
+        """Return an iterable of models.Resource instances, merging the
+        samples of each resource with the aggregation pipeline.
+
+        :param query: the samples query
+        :param sort_instructions: the sort instructions of the resources
+        """
+        sort_instructions = [('last_timestamp' if k == 'timestamp' else k, d)
+                             for k, d in sort_instructions]
+        pipeline = [
+            {'$match': query},
+            {'$sort': {'timestamp': pymongo.ASCENDING}},
+            {'$group': {'_id': '$resource_id',
+                        'user_id': {'$first': '$user_id'},
+                        'project_id': {'$first': '$project_id'},
+                        'source': {'$first': '$source'},
+                        'first_timestamp': {'$first': '$timestamp'},
+                        'last_timestamp': {'$last': '$timestamp'},
+                        'metadata': {'$last': '$resource_metadata'}}},
+            {'$sort': bson.son.SON(sort_instructions)},
+        ]
+        for r in self._aggregate(pipeline):
+            yield models.Resource(
+                resource_id=r['_id'],
+                user_id=r['user_id'],
+                project_id=r['project_id'],
+                first_sample_timestamp=r['first_timestamp'],
+                last_sample_timestamp=r['last_timestamp'],
+                source=r['source'],
+                metadata=r['metadata'])
+
+    def _get_time_constrained_resources_map_reduce(self, query,
+                                                   sort_instructions):
+        """Return an iterable of models.Resource instances, merging the
+        samples of each resource with map-reduce.
+
+        :param query: the samples query
+        :param sort_instructions: the sort instructions of the resources
+        """
         # use a unique collection name for the results collection,
         # as result post-sorting (as oppposed to reduce pre-sorting)
         # is not possible on an inline M-R
@@ -858,6 +956,7 @@ class Connection(pymongo_base.Connection):
 
         q = pymongo_utils.make_query_from_filter(sample_filter)
 
+        period_start = None
         if period:
             if sample_filter.start:
                 period_start = sample_filter.start
@@ -865,6 +964,28 @@ class Connection(pymongo_base.Connection):
                 period_start = self.db.meter.find(
                     limit=1, sort=[('timestamp',
                                     pymongo.ASCENDING)])[0]['timestamp']
+
+        if self.aggregation_pipeline:
+            results = self._get_meter_statistics_pipeline(
+                q, period, period_start, groupby, aggregate)
+        else:
+            results = self._get_meter_statistics_map_reduce(
+                q, period, period_start, groupby, aggregate)
+
+        # FIXME(terriyu) Fix get_meter_statistics() so we don't use sorted()
+        # to return the results
+        return sorted(
+            (self._stats_result_to_model(r, groupby, aggregate)
+             for r in results),
+            key=operator.attrgetter('period_start'))
+
+    def _get_meter_statistics_map_reduce(self, q, period, period_start,
+                                         groupby, aggregate):
+        """Compute the statistics with map-reduce.
+
+        :return: an iterable of dicts such as taken by _stats_result_to_model
+        """
+        if period:
             period_start = int(calendar.timegm(period_start.utctimetuple()))
             map_params = {'period': period,
                           'period_first': period_start,
@@ -905,41 +1026,4 @@ class Connection(pymongo_base.Connection):
             finalize=finalize_stats,
             query=q,
         )
-
-        # FIXME(terriyu) Fix get_meter_statistics() so we don't use sorted()
-        # to return the results
-        return sorted(
-            (self._stats_result_to_model(r['value'], groupby, aggregate)
-             for r in results['results']),
-            key=operator.attrgetter('period_start'))
-
-    @staticmethod
-    def _stats_result_aggregates(result, aggregate):
-        stats_args = {}
-        for attr in ['count', 'min', 'max', 'sum', 'avg']:
-            if attr in result:
-                stats_args[attr] = result[attr]
-
-        if aggregate:
-            stats_args['aggregate'] = {}
-            for a in aggregate:
-                ak = '%s%s' % (a.func, '/%s' % a.param if a.param else '')
-                if ak in result:
-                    stats_args['aggregate'][ak] = result[ak]
-                elif 'aggregate' in result:
-                    stats_args['aggregate'][ak] = result['aggregate'].get(ak)
-        return stats_args
-
-    @staticmethod
-    def _stats_result_to_model(result, groupby, aggregate):
-        stats_args = Connection._stats_result_aggregates(result, aggregate)
-        stats_args['unit'] = result['unit']
-        stats_args['duration'] = result['duration']
-        stats_args['duration_start'] = result['duration_start']
-        stats_args['duration_end'] = result['duration_end']
-        stats_args['period'] = result['period']
-        stats_args['period_start'] = result['period_start']
-        stats_args['period_end'] = result['period_end']
-        stats_args['groupby'] = (dict(
-            (g, result['groupby'][g]) for g in groupby) if groupby else None)
-        return models.Statistics(**stats_args)
+        return (r['value'] for r in results['results'])
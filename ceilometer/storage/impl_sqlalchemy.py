@@ -17,25 +17,37 @@
 """SQLAlchemy storage backend."""
 
 from __future__ import absolute_import
+import calendar
 import datetime
+import math
 import operator
 import os
+import time
 import types
 
 from oslo.config import cfg
 from sqlalchemy import and_
 from sqlalchemy import asc
+from sqlalchemy import case
+from sqlalchemy import cast
 from sqlalchemy import desc
 from sqlalchemy import distinct
+from sqlalchemy import extract
+from sqlalchemy import Float
 from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import literal
 from sqlalchemy import not_
+from sqlalchemy import Numeric
 from sqlalchemy import or_
+from sqlalchemy import type_coerce
 from sqlalchemy.orm import aliased
 
 from ceilometer.alarm.storage import models as alarm_api_models
 from ceilometer.openstack.common.db import exception as dbexc
 from ceilometer.openstack.common.db.sqlalchemy import migration
 import ceilometer.openstack.common.db.sqlalchemy.session as sqlalchemy_session
+from ceilometer.openstack.common.db.sqlalchemy import utils as sqlalchemyutils
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
@@ -47,6 +59,23 @@ from ceilometer import utils
 
 LOG = log.getLogger(__name__)
 
+OPTS = [
+    cfg.IntOpt('meter_cache_size',
+               default=1024,
+               help='Maximum number of meter definitions whose id is cached '
+                    'by the SQLAlchemy driver to avoid looking them up for '
+                    'every recorded sample (0 disables the cache).'),
+    cfg.BoolOpt('statistics_rollups',
+                default=False,
+                help='Maintain per-minute, per-hour and per-day aggregates '
+                     'of the samples as they are recorded, and compute the '
+                     'period statistics from them when possible. Only the '
+                     'samples recorded while this is enabled are part of '
+                     'the aggregates, older ones are read from the raw '
+                     'samples.'),
+]
+
+cfg.CONF.register_opts(OPTS, group='database')
 
 META_TYPE_MAP = {bool: models.MetaBool,
                  str: models.MetaText,
@@ -79,10 +108,36 @@ PARAMETERIZED_AGGREGATES = dict(
     )
 )
 
+# Granularities of the rollups in seconds, coarsest first
+ROLLUP_GRANULARITIES = (24 * 3600, 3600, 60)
+
+ROLLUP_AGGREGATES = dict(
+    avg=(func.sum(models.MeterRollup.volume_sum) /
+         func.sum(models.MeterRollup.sample_count)).label('avg'),
+    sum=func.sum(models.MeterRollup.volume_sum).label('sum'),
+    min=func.min(models.MeterRollup.volume_min).label('min'),
+    max=func.max(models.MeterRollup.volume_max).label('max'),
+    count=cast(func.sum(models.MeterRollup.sample_count),
+               Integer).label('count')
+)
+
+
+def _least(column, value):
+    # NOTE: least() is not available on SQLite
+    return case([(column > value, literal(value, column.type))],
+                else_=column)
+
+
+def _greatest(column, value):
+    return case([(column < value, literal(value, column.type))],
+                else_=column)
+
+
 AVAILABLE_CAPABILITIES = {
     'meters': {'query': {'simple': True,
                          'metadata': True}},
-    'resources': {'query': {'simple': True,
+    'resources': {'pagination': True,
+                  'query': {'simple': True,
                             'metadata': True}},
     'samples': {'pagination': True,
                 'groupby': True,
@@ -115,6 +170,84 @@ AVAILABLE_STORAGE_CAPABILITIES = {
 }
 
 
+def _mysql_period_bucket(column, start, period):
+    # PreciseTimestamp is stored as a decimal unix time on MySQL
+    return func.floor((type_coerce(column, Numeric(20, 6)) -
+                       utils.dt_to_decimal(start)) / period)
+
+
+def _postgresql_period_bucket(column, start, period):
+    return func.floor((extract('epoch', column) -
+                       float(utils.dt_to_decimal(start))) / period)
+
+
+def _sqlite_period_bucket(column, start, period):
+    # julianday() is not precise enough to compute period boundaries, so
+    # use the whole seconds of the timestamp plus its milliseconds.
+    fraction = func.strftime('%f', column)
+    epoch = (cast(func.strftime('%s', column), Integer) +
+             cast(fraction, Float) - cast(fraction, Integer))
+    # SQLite has no floor(), but the samples are never older than start so
+    # truncating is enough
+    return cast((epoch - float(utils.dt_to_decimal(start))) / period,
+                Integer)
+
+
+# Functions returning, per SQL dialect, the expression of the index of the
+# period a sample falls into: floor((epoch(timestamp) - start) / period)
+PERIOD_BUCKETS = {
+    'mysql': _mysql_period_bucket,
+    'postgresql': _postgresql_period_bucket,
+    'sqlite': _sqlite_period_bucket,
+}
+
+
+class MeterCache(object):
+    """Bounded, process-local cache of meter definition ids.
+
+    Maps a (name, type, unit) triple to the id of the matching row of the
+    meter table, evicting the least recently used entries first. Rows of
+    the meter table are never updated, so the cache only has to be dropped
+    when the database is cleared.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self._ids = utils.LRUCache(max(size, 0))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, key):
+        """Return the cached id for key, or None."""
+        meter_id = self._ids.get(key)
+        if meter_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return meter_id
+
+    def set(self, key, meter_id):
+        if self.size > 0:
+            self._ids[key] = meter_id
+
+    def load(self, rows):
+        """Fill the cache from (id, name, type, unit) rows."""
+        for meter_id, name, type, unit in rows:
+            if len(self._ids) >= self.size:
+                break
+            self._ids[(name, type, unit)] = meter_id
+        self.loaded = True
+
+    def invalidate(self):
+        """Drop the whole cache."""
+        self._ids.clear()
+        self.loaded = False
+
+
 def apply_metaquery_filter(session, query, metaquery):
     """Apply provided metaquery filter to existing query.
 
@@ -218,6 +351,34 @@ class Connection(base.Connection):
               message_signature: message signature
               message_id: message uuid
               }
+        - resource
+          - summary of the samples of a resource
+          - { id: resource summary id
+              resource_id: resource uuid
+              user_id: user uuid
+              project_id: project uuid
+              source_id: source id
+              resource_metadata: metadata of the latest sample
+              first_sample_timestamp: datetime
+              last_sample_timestamp: datetime
+              }
+        - meter_rollup
+          - aggregates of the samples of a meter and resource over a period
+          - { id: rollup id
+              granularity: length of the period in seconds
+              meter_id: meter id            (->meter.id)
+              resource_id: resource uuid
+              user_id: user uuid
+              project_id: project uuid
+              source_id: source id
+              period_start: datetime, aligned on the granularity
+              sample_count: number of samples
+              volume_sum: sum of the sample volumes
+              volume_min: minimum of the sample volumes
+              volume_max: maximum of the sample volumes
+              first_sample_timestamp: datetime
+              last_sample_timestamp: datetime
+              }
     """
     CAPABILITIES = utils.update_nested(base.Connection.CAPABILITIES,
                                        AVAILABLE_CAPABILITIES)
@@ -226,11 +387,24 @@ class Connection(base.Connection):
         AVAILABLE_STORAGE_CAPABILITIES,
     )
 
+    ATOMIC_BATCH = True
+
+    @classmethod
+    def get_storage_capabilities(cls):
+        """Return a dictionary representing the performance capabilities.
+
+        Rollups are only available if they are enabled in the configuration.
+        """
+        return utils.update_nested(
+            cls.STORAGE_CAPABILITIES,
+            {'storage': {'rollups': cfg.CONF.database.statistics_rollups}})
+
     def __init__(self, url):
         self._engine_facade = sqlalchemy_session.EngineFacade.from_config(
             url,
             cfg.CONF  # TODO(Alexei_987) Remove access to global CONF object
         )
+        self.meter_cache = MeterCache(cfg.CONF.database.meter_cache_size)
 
     def upgrade(self):
         path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
@@ -243,9 +417,9 @@ class Connection(base.Connection):
             engine.execute(table.delete())
         self._engine_facade._session_maker.close_all()
         engine.dispose()
+        self.meter_cache.invalidate()
 
-    @staticmethod
-    def _create_meter(session, name, type, unit):
+    def _create_meter(self, session, name, type, unit):
         try:
             nested = session.connection().dialect.name != 'sqlite'
             with session.begin(nested=nested,
@@ -259,65 +433,348 @@ class Connection(base.Connection):
                     session.add(obj)
         except dbexc.DBDuplicateEntry:
             # retry function to pick up duplicate committed object
-            obj = Connection._create_meter(session, name, type, unit)
+            obj = self._create_meter(session, name, type, unit)
 
         return obj
 
+    def _get_meter_id(self, session, name, type, unit, created):
+        """Resolve a meter definition to its id, creating it if needed.
+
+        Ids of meters missing from the cache are added to created; they are
+        only cached once the enclosing transaction has been committed.
+        """
+        key = (name, type, unit)
+        meter_id = self.meter_cache.get(key)
+        if meter_id is None:
+            meter_id = created.get(key)
+            if meter_id is None:
+                meter_id = self._create_meter(session, name, type, unit).id
+                created[key] = meter_id
+        return meter_id
+
+    @staticmethod
+    def _make_sample(meter_id, data):
+        return models.Sample(meter_id=meter_id,
+                             resource_id=data['resource_id'],
+                             project_id=data['project_id'],
+                             user_id=data['user_id'],
+                             timestamp=data['timestamp'],
+                             resource_metadata=data['resource_metadata'],
+                             volume=data['counter_volume'],
+                             message_signature=data['message_signature'],
+                             message_id=data['message_id'],
+                             source_id=data['source'])
+
+    @staticmethod
+    def _make_metadata_rows(sample_id, rmetadata, rows):
+        """Append the metadata rows of a sample to the rows dictionary.
+
+        :param sample_id: id of the sample the metadata belongs to
+        :param rmetadata: resource metadata of the sample
+        :param rows: dictionary mapping metadata models to lists of rows
+        """
+        if not rmetadata or not isinstance(rmetadata, dict):
+            return
+        for key, v in utils.dict_to_keyval(rmetadata):
+            try:
+                _model = META_TYPE_MAP[type(v)]
+            except KeyError:
+                LOG.warn(_("Unknown metadata type. Key (%s) will "
+                           "not be queryable."), key)
+            else:
+                rows.setdefault(_model, []).append(
+                    {'id': sample_id, 'meta_key': key, 'value': v})
+
+    @staticmethod
+    def _insert_metadata_rows(session, rows):
+        # NOTE: one executemany() per metadata table rather than one
+        # INSERT per metadata key.
+        for _model, values in rows.iteritems():
+            session.execute(_model.__table__.insert(), values)
+
+    @staticmethod
+    def _update_resources(session, samples):
+        """Maintain the resource summary table for a batch of samples.
+
+        :param session: session of the transaction recording the samples
+        :param samples: the samples being recorded
+        """
+        batch = {}
+        for data in samples:
+            key = (data['resource_id'], data['user_id'],
+                   data['project_id'], data['source'])
+            first, last = batch.get(key, (data, data))
+            if data['timestamp'] < first['timestamp']:
+                first = data
+            if data['timestamp'] >= last['timestamp']:
+                last = data
+            batch[key] = (first, last)
+
+        query = session.query(models.Resource.resource_id,
+                              models.Resource.user_id,
+                              models.Resource.project_id,
+                              models.Resource.source_id).filter(
+            models.Resource.resource_id.in_(set(k[0] for k in batch)))
+        existing = set(tuple(r) for r in query.all())
+
+        nested = session.connection().dialect.name != 'sqlite'
+        for key, (first, last) in batch.iteritems():
+            resource_id, user_id, project_id, source_id = key
+            if key not in existing:
+                try:
+                    with session.begin(nested=nested,
+                                       subtransactions=not nested):
+                        session.add(models.Resource(
+                            resource_id=resource_id,
+                            user_id=user_id,
+                            project_id=project_id,
+                            source_id=source_id,
+                            resource_metadata=last['resource_metadata'],
+                            first_sample_timestamp=first['timestamp'],
+                            last_sample_timestamp=last['timestamp']))
+                    continue
+                except dbexc.DBDuplicateEntry:
+                    # another writer created the summary concurrently
+                    pass
+            # NOTE: the summary is updated in place and only ever moved
+            # forward, so that concurrent writers can not make its
+            # timestamps or metadata regress
+            query = session.query(models.Resource).filter(
+                models.Resource.resource_id == resource_id,
+                models.Resource.user_id == user_id,
+                models.Resource.project_id == project_id,
+                models.Resource.source_id == source_id)
+            query.filter(
+                models.Resource.first_sample_timestamp > first['timestamp']
+            ).update({'first_sample_timestamp': first['timestamp']},
+                     synchronize_session=False)
+            # metadata of the latest sample is considered as actual
+            query.filter(
+                models.Resource.last_sample_timestamp <= last['timestamp']
+            ).update({'last_sample_timestamp': last['timestamp'],
+                      'resource_metadata': last['resource_metadata']},
+                     synchronize_session=False)
+
+    @staticmethod
+    def _add_to_rollups(rollups, meter_id, data):
+        """Account a sample in the rollups of a batch.
+
+        :param rollups: dictionary mapping (granularity, meter id, resource,
+                        user, project, source, period start) keys to
+                        [count, sum, min, max, first, last] lists
+        :param meter_id: id of the meter of the sample
+        :param data: the sample being recorded
+        """
+        volume = data['counter_volume']
+        if volume is None:
+            return
+        timestamp = data['timestamp']
+        epoch = calendar.timegm(timestamp.utctimetuple())
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, meter_id, data['resource_id'],
+                   data['user_id'], data['project_id'], data['source'],
+                   epoch - epoch % granularity)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = [1, volume, volume, volume,
+                                timestamp, timestamp]
+                continue
+            rollup[0] += 1
+            rollup[1] += volume
+            rollup[2] = min(rollup[2], volume)
+            rollup[3] = max(rollup[3], volume)
+            rollup[4] = min(rollup[4], timestamp)
+            rollup[5] = max(rollup[5], timestamp)
+
+    @staticmethod
+    def _update_rollups(session, rollups):
+        """Merge the rollups of a batch of samples into the rollup table.
+
+        :param session: session of the transaction recording the samples
+        :param rollups: rollups of the batch, as built by _add_to_rollups
+        """
+        if not rollups:
+            return
+        period_starts = dict((k[6], datetime.datetime.utcfromtimestamp(k[6]))
+                             for k in rollups)
+        rollup = models.MeterRollup.__table__.c
+        nested = session.connection().dialect.name != 'sqlite'
+        for key, (count, total, vmin, vmax, first, last) in \
+                rollups.iteritems():
+            (granularity, meter_id, resource_id, user_id, project_id,
+             source_id, period_start) = key
+            query = session.query(models.MeterRollup).filter(
+                rollup.granularity == granularity,
+                rollup.meter_id == meter_id,
+                rollup.resource_id == resource_id,
+                rollup.user_id == user_id,
+                rollup.project_id == project_id,
+                rollup.source_id == source_id,
+                rollup.period_start == period_starts[period_start])
+            # NOTE: the rollup is merged in place by a single UPDATE, so
+            # that no sample recorded by a concurrent writer gets lost
+            values = {
+                rollup.sample_count: rollup.sample_count + count,
+                rollup.volume_sum: rollup.volume_sum + total,
+                rollup.volume_min: _least(rollup.volume_min, vmin),
+                rollup.volume_max: _greatest(rollup.volume_max, vmax),
+                rollup.first_sample_timestamp: _least(
+                    rollup.first_sample_timestamp, first),
+                rollup.last_sample_timestamp: _greatest(
+                    rollup.last_sample_timestamp, last),
+            }
+            if query.update(values, synchronize_session=False):
+                continue
+            try:
+                with session.begin(nested=nested,
+                                   subtransactions=not nested):
+                    session.add(models.MeterRollup(
+                        granularity=granularity,
+                        meter_id=meter_id,
+                        resource_id=resource_id,
+                        user_id=user_id,
+                        project_id=project_id,
+                        source_id=source_id,
+                        period_start=period_starts[period_start],
+                        sample_count=count,
+                        volume_sum=total,
+                        volume_min=vmin,
+                        volume_max=vmax,
+                        first_sample_timestamp=first,
+                        last_sample_timestamp=last))
+            except dbexc.DBDuplicateEntry:
+                # another writer created the rollup concurrently
+                query.update(values, synchronize_session=False)
+
     def record_metering_data(self, data):
         """Write the data to the backend storage system.
 
         :param data: a dictionary such as returned by
                      ceilometer.meter.meter_message_from_counter
         """
+        self.record_metering_data_batch([data])
+
+    def record_metering_data_batch(self, samples):
+        """Write a list of samples to the backend storage system.
+
+        All the samples are written in a single transaction: meter
+        definitions are resolved once per distinct (name, type, unit),
+        the samples are flushed together and the metadata rows are
+        inserted with one multi-row INSERT per metadata table.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        if not samples:
+            return
         session = self._engine_facade.get_session()
+        if not self.meter_cache.loaded and self.meter_cache.size > 0:
+            self.meter_cache.load(session.query(
+                models.Meter.id, models.Meter.name, models.Meter.type,
+                models.Meter.unit).limit(self.meter_cache.size))
+        created = {}
+        rollups = {}
+        with_rollups = cfg.CONF.database.statistics_rollups
         with session.begin():
-            # Record the raw data for the sample.
-            rmetadata = data['resource_metadata']
-            meter = self._create_meter(session,
-                                       data['counter_name'],
-                                       data['counter_type'],
-                                       data['counter_unit'])
-            sample = models.Sample(meter_id=meter.id)
-            session.add(sample)
-            sample.resource_id = data['resource_id']
-            sample.project_id = data['project_id']
-            sample.user_id = data['user_id']
-            sample.timestamp = data['timestamp']
-            sample.resource_metadata = rmetadata
-            sample.volume = data['counter_volume']
-            sample.message_signature = data['message_signature']
-            sample.message_id = data['message_id']
-            sample.source_id = data['source']
+            rows = []
+            for data in samples:
+                meter_id = self._get_meter_id(session,
+                                              data['counter_name'],
+                                              data['counter_type'],
+                                              data['counter_unit'],
+                                              created)
+                sample = self._make_sample(meter_id, data)
+                session.add(sample)
+                rows.append((sample, data['resource_metadata']))
+                if with_rollups:
+                    self._add_to_rollups(rollups, meter_id, data)
             session.flush()
 
-            if rmetadata:
-                if isinstance(rmetadata, dict):
-                    for key, v in utils.dict_to_keyval(rmetadata):
-                        try:
-                            _model = META_TYPE_MAP[type(v)]
-                        except KeyError:
-                            LOG.warn(_("Unknown metadata type. Key (%s) will "
-                                       "not be queryable."), key)
-                        else:
-                            session.add(_model(id=sample.id,
-                                               meta_key=key,
-                                               value=v))
-
-    def clear_expired_metering_data(self, ttl):
+            metadata_rows = {}
+            for sample, rmetadata in rows:
+                self._make_metadata_rows(sample.id, rmetadata, metadata_rows)
+            self._insert_metadata_rows(session, metadata_rows)
+            self._update_resources(session, samples)
+            self._update_rollups(session, rollups)
+
+        for key, meter_id in created.iteritems():
+            self.meter_cache.set(key, meter_id)
+
+    def clear_expired_metering_data(self, ttl, chunk_size=None, throttle=0):
         """Clear expired data from the backend storage system according to the
         time-to-live.
 
+        Expired samples and their metadata are deleted with set-based
+        DELETE statements, by ranges of at most chunk_size sample ids, each
+        range in its own transaction. When statistics rollups are enabled,
+        the samples are kept until the end of the day they expire in.
+
         :param ttl: Number of seconds to keep records for.
+        :param chunk_size: Maximum number of samples deleted per transaction,
+                           None for no limit.
+        :param throttle: Number of seconds to sleep between two chunks.
 
         """
 
         session = self._engine_facade.get_session()
+        end = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
+        if cfg.CONF.database.statistics_rollups:
+            # NOTE: samples expire by whole periods of the coarsest rollups,
+            # so that no rollup is left with the statistics of deleted ones
+            epoch = calendar.timegm(end.utctimetuple())
+            end = datetime.datetime.utcfromtimestamp(
+                epoch - epoch % ROLLUP_GRANULARITIES[0])
+        while True:
+            with session.begin():
+                criteria = [models.Sample.timestamp < end]
+                last = None
+                if chunk_size:
+                    # the last id of the chunk bounds the range deleted
+                    last = session.query(models.Sample.id)\
+                        .filter(*criteria)\
+                        .order_by(models.Sample.id)\
+                        .offset(chunk_size - 1).limit(1).scalar()
+                    if last is not None:
+                        criteria.append(models.Sample.id <= last)
+                ids = session.query(models.Sample.id).filter(*criteria)
+                for table in set(META_TYPE_MAP.values()):
+                    session.query(table)\
+                        .filter(table.id.in_(ids.subquery()))\
+                        .delete(synchronize_session=False)
+                deleted = session.query(models.Sample)\
+                    .filter(*criteria)\
+                    .delete(synchronize_session=False)
+            LOG.debug(_("%d expired samples deleted"), deleted)
+            if last is None:
+                break
+            if throttle:
+                time.sleep(throttle)
+
         with session.begin():
-            end = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
-            sample_query = session.query(models.Sample)\
-                .filter(models.Sample.timestamp < end)
-            for sample_obj in sample_query.all():
-                session.delete(sample_obj)
+            # rollups are dropped once all of their period has expired
+            for granularity in ROLLUP_GRANULARITIES:
+                session.query(models.MeterRollup)\
+                    .filter(models.MeterRollup.granularity == granularity)\
+                    .filter(models.MeterRollup.period_start <=
+                            end - datetime.timedelta(seconds=granularity))\
+                    .delete(synchronize_session=False)
+
+            # maintain the resource summary: resources with no sample left
+            # go away and the others get their first sample recomputed
+            session.query(models.Resource)\
+                .filter(models.Resource.last_sample_timestamp < end)\
+                .delete(synchronize_session=False)
+            first_q = session.query(func.min(models.Sample.timestamp))
+            for key in ('resource_id', 'user_id', 'project_id', 'source_id'):
+                column = getattr(models.Sample, key)
+                value = getattr(models.Resource, key)
+                first_q = first_q.filter(or_(
+                    column == value, and_(column.is_(None), value.is_(None))))
+            first_q = first_q.correlate(models.Resource).as_scalar()
+            session.query(models.Resource)\
+                .filter(models.Resource.first_sample_timestamp < end)\
+                .update({'first_sample_timestamp': first_q},
+                        synchronize_session=False)
 
     def get_resources(self, user=None, project=None, source=None,
                       start_timestamp=None, start_timestamp_op=None,
@@ -336,9 +793,109 @@ class Connection(base.Connection):
         :param resource: Optional resource filter.
         :param pagination: Optional pagination query.
         """
+        if not (start_timestamp or end_timestamp or metaquery):
+            return self._get_summarized_resources(user, project, source,
+                                                  resource, pagination)
+
+        # NOTE: the resource table only summarizes all the samples of a
+        # resource, so the samples have to be looked at when they are
+        # filtered on timestamp or metadata.
+        resources = self._get_resources_from_samples(
+            user, project, source, start_timestamp, start_timestamp_op,
+            end_timestamp, end_timestamp_op, metaquery, resource)
         if pagination:
-            raise NotImplementedError('Pagination not implemented')
+            resources = self._paginate_resources(resources, pagination)
+        return resources
+
+    @staticmethod
+    def _paginate_resources(resources, pagination):
+        """Return a page of resources, sorted as by paginate_query()."""
+        sort_keys = [{'timestamp': 'last_sample_timestamp'}.get(k, k)
+                     for k in pagination.sort_keys]
+        sort_keys.append('resource_id')
+        resources = sorted(
+            resources,
+            key=lambda r: [getattr(r, k) for k in sort_keys],
+            reverse=pagination.primary_sort_dir == 'desc')
+        if pagination.marker_value:
+            for i, r in enumerate(resources):
+                if r.resource_id == pagination.marker_value:
+                    resources = resources[i + 1:]
+                    break
+            else:
+                raise base.NoResultFound
+        if pagination.limit:
+            resources = resources[:pagination.limit]
+        return resources
+
+    def _get_summarized_resources(self, user, project, source, resource,
+                                  pagination):
+        """Return an iterable of api_models.Resource from the resource table.
+
+        The rows of a resource are merged: the first and last sample
+        timestamps span all of them, and the other fields come from the row
+        holding the latest sample.
+        """
+        def _apply_filters(query):
+            for column, value in [(models.Resource.resource_id, resource),
+                                  (models.Resource.user_id, user),
+                                  (models.Resource.project_id, project),
+                                  (models.Resource.source_id, source)]:
+                if value:
+                    query = query.filter(column == value)
+            return query
+
+        session = self._engine_facade.get_session()
+        summary = _apply_filters(session.query(
+            models.Resource.resource_id,
+            func.min(models.Resource.first_sample_timestamp).label('first'),
+            func.max(models.Resource.last_sample_timestamp).label('last'))
+        ).group_by(models.Resource.resource_id).subquery()
+        # the most recently inserted row holding the latest sample
+        latest = _apply_filters(session.query(
+            func.max(models.Resource.id).label('id'))
+            .join(summary, and_(
+                models.Resource.resource_id == summary.c.resource_id,
+                models.Resource.last_sample_timestamp == summary.c.last))
+        ).group_by(models.Resource.resource_id).subquery()
+        query = session.query(models.Resource, summary.c.first)\
+            .join(latest, models.Resource.id == latest.c.id)\
+            .join(summary,
+                  models.Resource.resource_id == summary.c.resource_id)
+
+        if pagination:
+            marker = None
+            if pagination.marker_value:
+                row = query.filter(models.Resource.resource_id ==
+                                   pagination.marker_value).first()
+                if row is None:
+                    raise base.NoResultFound
+                marker = row[0]
+            sort_keys = [{'timestamp': 'last_sample_timestamp',
+                          'source': 'source_id'}.get(k, k)
+                         for k in pagination.sort_keys]
+            # NOTE: resource_id is unique among the merged rows, and so is
+            # id which is only there to please paginate_query()
+            sort_keys.extend(['resource_id', 'id'])
+            query = sqlalchemyutils.paginate_query(
+                query, models.Resource, pagination.limit, sort_keys,
+                marker=marker, sort_dir=pagination.primary_sort_dir)
+
+        for row, first_sample_timestamp in query.all():
+            yield api_models.Resource(
+                resource_id=row.resource_id,
+                project_id=row.project_id,
+                first_sample_timestamp=first_sample_timestamp,
+                last_sample_timestamp=row.last_sample_timestamp,
+                source=row.source_id,
+                user_id=row.user_id,
+                metadata=row.resource_metadata
+            )
 
+    def _get_resources_from_samples(self, user, project, source,
+                                    start_timestamp, start_timestamp_op,
+                                    end_timestamp, end_timestamp_op,
+                                    metaquery, resource):
         metaquery = metaquery or {}
 
         def _apply_filters(query):
@@ -639,16 +1196,198 @@ class Connection(base.Connection):
                 # sample has found with sample filter(s).
                 return
 
+        start = sample_filter.start or res.tsmin
+        end = sample_filter.end or res.tsmax
+        dialect = self._engine_facade.get_engine().dialect.name
+        period_bucket = PERIOD_BUCKETS.get(dialect)
+        if period_bucket is not None and cfg.CONF.database.statistics_rollups:
+            stats = self._get_rollup_statistics(
+                sample_filter, period_bucket, period, groupby, aggregate)
+            if stats is not None:
+                for stat in stats:
+                    yield stat
+                return
+
         query = self._make_stats_query(sample_filter, groupby, aggregate)
+        if period_bucket is None:
+            stats = self._get_period_statistics_per_query(
+                query, start, end, period, groupby, aggregate)
+        else:
+            stats = self._get_period_statistics(
+                query, period_bucket, start, end, period, groupby, aggregate)
+        for stat in stats:
+            yield stat
+
+    def _get_period_statistics(self, query, period_bucket, start, end, period,
+                               groupby, aggregate):
+        """Compute the statistics of every period in a single query.
+
+        The samples are grouped by the index of the period they fall into,
+        as computed by the dialect specific period_bucket expression.
+        """
+        periods = int(math.ceil(timeutils.delta_seconds(start, end) /
+                                float(period)))
+        if periods <= 0:
+            return
+        # Only consider the samples of the periods that base.iter_period()
+        # would have returned.
+        last_period_end = start + datetime.timedelta(seconds=period * periods)
+        bucket = period_bucket(models.Sample.timestamp, start,
+                               period).label('period_bucket')
+        query = query.add_columns(bucket)
+        query = query.filter(models.Sample.timestamp >= start)
+        query = query.filter(models.Sample.timestamp < last_period_end)
+        query = query.group_by(bucket).order_by(bucket)
+        for r in query.all():
+            if r.count:
+                period_start = start + datetime.timedelta(
+                    seconds=period * int(r.period_bucket))
+                yield self._stats_result_to_model(
+                    result=r,
+                    period=int(period),
+                    period_start=period_start,
+                    period_end=period_start + datetime.timedelta(
+                        seconds=period),
+                    groupby=groupby,
+                    aggregate=aggregate
+                )
+
+    @staticmethod
+    def _get_rollup_granularity(sample_filter, period):
+        """Return the coarsest rollup granularity the period statistics of
+        the filter can be computed from, or None.
+
+        The granularity has to divide the period and both ends of the
+        filter must be aligned on it, so that no rollup straddles the
+        boundary of a period.
+        """
+        if (sample_filter.metaquery or sample_filter.message_id or
+                not sample_filter.start or not sample_filter.end or
+                sample_filter.start_timestamp_op == 'gt' or
+                sample_filter.end_timestamp_op == 'le'):
+            return None
+        bounds = [sample_filter.start, sample_filter.end]
+        if any(ts.microsecond for ts in bounds):
+            return None
+        bounds = [calendar.timegm(ts.utctimetuple()) for ts in bounds]
+        for granularity in ROLLUP_GRANULARITIES:
+            if (period % granularity == 0 and
+                    not any(ts % granularity for ts in bounds)):
+                return granularity
+
+    @staticmethod
+    def _get_rollup_aggregate_functions(aggregate):
+        """Return the aggregate functions computed over the rollups, or None
+        if some aggregate can only be computed from the raw samples.
+        """
+        if not aggregate:
+            return [f for f in ROLLUP_AGGREGATES.values()]
+
+        functions = []
+        for a in aggregate:
+            if a.func in ROLLUP_AGGREGATES:
+                functions.append(ROLLUP_AGGREGATES[a.func])
+            elif (a.func == 'cardinality' and
+                    PARAMETERIZED_AGGREGATES['validate'][a.func](a.param)):
+                functions.append(func.count(
+                    distinct(getattr(models.MeterRollup, a.param))
+                ).label('cardinality/%s' % a.param))
+            else:
+                return None
+        return functions
+
+    def _get_rollup_statistics(self, sample_filter, period_bucket, period,
+                               groupby, aggregate):
+        """Compute the period statistics from the rollups.
+
+        Return None when the statistics have to be computed from the raw
+        samples instead: the filter or the aggregates can not be answered
+        from the rollups, or some samples matching the filter are older
+        than the rollups.
+        """
+        granularity = self._get_rollup_granularity(sample_filter, period)
+        if granularity is None:
+            return None
+        functions = self._get_rollup_aggregate_functions(aggregate)
+        if functions is None:
+            return None
+
+        session = self._engine_facade.get_session()
+        start = sample_filter.start
+        end = sample_filter.end
+
+        def _apply_filters(query):
+            query = query.filter(models.Meter.id ==
+                                 models.MeterRollup.meter_id)
+            query = query.filter(models.Meter.name == sample_filter.meter)
+            query = query.filter(models.MeterRollup.granularity ==
+                                 granularity)
+            query = query.filter(models.MeterRollup.period_start >= start)
+            query = query.filter(models.MeterRollup.period_start < end)
+            for attr, value in (('source_id', sample_filter.source),
+                                ('user_id', sample_filter.user),
+                                ('project_id', sample_filter.project),
+                                ('resource_id', sample_filter.resource)):
+                if value:
+                    query = query.filter(
+                        getattr(models.MeterRollup, attr) == value)
+            return query
+
+        first = _apply_filters(session.query(
+            func.min(models.MeterRollup.first_sample_timestamp))).scalar()
+        if first is None:
+            return None
+        older = make_query_from_filter(
+            session,
+            session.query(models.Sample.id).filter(
+                models.Meter.id == models.Sample.meter_id),
+            sample_filter).filter(models.Sample.timestamp < first)
+        if older.first() is not None:
+            return None
+
+        select = [
+            models.Meter.unit,
+            func.min(models.MeterRollup.first_sample_timestamp).label(
+                'tsmin'),
+            func.max(models.MeterRollup.last_sample_timestamp).label('tsmax'),
+        ]
+        select.extend(functions)
+        group_attributes = [getattr(models.MeterRollup, g)
+                            for g in groupby or []]
+        select.extend(group_attributes)
+        bucket = period_bucket(models.MeterRollup.period_start, start,
+                               period).label('period_bucket')
+        select.append(bucket)
+
+        query = _apply_filters(session.query(*select))
+        query = query.group_by(models.Meter.unit, bucket, *group_attributes)
+        query = query.order_by(bucket)
+
+        stats = []
+        for r in query.all():
+            if r.count:
+                period_start = start + datetime.timedelta(
+                    seconds=period * int(r.period_bucket))
+                stats.append(self._stats_result_to_model(
+                    result=r,
+                    period=int(period),
+                    period_start=period_start,
+                    period_end=period_start + datetime.timedelta(
+                        seconds=period),
+                    groupby=groupby,
+                    aggregate=aggregate
+                ))
+        return stats
+
+    def _get_period_statistics_per_query(self, query, start, end, period,
+                                         groupby, aggregate):
         # HACK(jd) This is an awful method to compute stats by period, but
         # since we're trying to be SQL agnostic we have to write portable
         # code, so here it is, admire! We're going to do one request to get
         # stats by period. We would like to use GROUP BY, but there's no
         # portable way to manipulate timestamp in SQL, so we can't.
-        for period_start, period_end in base.iter_period(
-                sample_filter.start or res.tsmin,
-                sample_filter.end or res.tsmax,
-                period):
+        # NOTE: this is only used for dialects missing from PERIOD_BUCKETS.
+        for period_start, period_end in base.iter_period(start, end, period):
             q = query.filter(models.Sample.timestamp >= period_start)
             q = q.filter(models.Sample.timestamp < period_end)
             for r in q.all():
@@ -18,11 +18,15 @@
 """Common functions for MongoDB and DB2 backends
 """
 
+import datetime
+import math
 
 import pymongo
 
 from ceilometer.alarm.storage import models as alarm_models
 from ceilometer.openstack.common import log
+from ceilometer.openstack.common import timeutils
+from ceilometer import storage
 from ceilometer.storage import base
 from ceilometer.storage import models
 from ceilometer.storage.mongo import utils as pymongo_utils
@@ -60,6 +64,28 @@ class Connection(base.Connection):
         AVAILABLE_STORAGE_CAPABILITIES,
     )
 
+    # $group accumulators of the aggregation pipeline, per aggregate
+    # function; stddev and cardinality are completed in the driver
+    PIPELINE_AGGREGATES = dict(
+        sum=lambda p: {'sum': {'$sum': '$counter_volume'}},
+        count=lambda p: {'count': {'$sum': 1}},
+        avg=lambda p: {'avg': {'$avg': '$counter_volume'}},
+        min=lambda p: {'min': {'$min': '$counter_volume'}},
+        max=lambda p: {'max': {'$max': '$counter_volume'}},
+        stddev=lambda p: {
+            'sdcount': {'$sum': 1},
+            'sdsum': {'$sum': '$counter_volume'},
+            'sdsquares': {'$sum': {'$multiply': ['$counter_volume',
+                                                 '$counter_volume']}}},
+        cardinality=lambda p: {'distinct_%s' % p: {'$addToSet': '$%s' % p}},
+    )
+
+    PIPELINE_STANDARD_AGGREGATES = ('sum', 'count', 'avg', 'min', 'max')
+
+    PIPELINE_PARAMETERIZED_AGGREGATES = dict(
+        cardinality=('resource_id', 'user_id', 'project_id', 'source'),
+    )
+
     def get_meters(self, user=None, project=None, resource=None, source=None,
                    metaquery=None, pagination=None):
         """Return an iterable of models.Meter instances
@@ -379,3 +405,143 @@ class Connection(base.Connection):
         """Ensures the alarm has a time constraints field."""
         if 'time_constraints' not in alarm:
             alarm['time_constraints'] = []
+
+    def _pipeline_aggregates(self, aggregate):
+        """Return the $group accumulators and the (key, function, parameter)
+        of the requested aggregates.
+        """
+        if not aggregate:
+            functions = [(f, f, None)
+                         for f in self.PIPELINE_STANDARD_AGGREGATES]
+        else:
+            functions = []
+            for a in aggregate:
+                if a.func in self.PIPELINE_PARAMETERIZED_AGGREGATES:
+                    params = self.PIPELINE_PARAMETERIZED_AGGREGATES[a.func]
+                    if a.param not in params:
+                        raise storage.StorageBadAggregate(
+                            'Bad aggregate: %s.%s' % (a.func, a.param))
+                    functions.append(('%s/%s' % (a.func, a.param),
+                                      a.func, a.param))
+                elif a.func in self.PIPELINE_AGGREGATES:
+                    functions.append((a.func, a.func, None))
+                else:
+                    raise NotImplementedError('Selectable aggregate function '
+                                              '%s is not supported' % a.func)
+        accumulators = {}
+        for key, func, param in functions:
+            accumulators.update(self.PIPELINE_AGGREGATES[func](param))
+        return accumulators, functions
+
+    def _aggregate(self, pipeline):
+        """Return a cursor over the results of an aggregation pipeline.
+
+        The results are fetched by batches rather than returned in a single
+        document limited to 16MB, and the stages may use temporary files
+        rather than fail when they need more than 100MB of memory.
+        """
+        return self.db.meter.aggregate(pipeline, cursor={}, allowDiskUse=True)
+
+    def _get_meter_statistics_pipeline(self, q, period, period_start,
+                                       groupby, aggregate):
+        """Compute the statistics with the aggregation pipeline.
+
+        Samples are grouped on the groupby fields and on the offset of
+        their period, computed by date arithmetic from period_start, so that
+        only one document per period and group is returned by the server.
+
+        :return: an iterable of dicts such as taken by _stats_result_to_model
+        """
+        accumulators, functions = self._pipeline_aggregates(aggregate)
+
+        key = dict((g, '$%s' % g) for g in groupby or [])
+        if period:
+            # NOTE: whole seconds, as the map-reduce implementation
+            period_start = period_start.replace(microsecond=0)
+            offset = {'$subtract': ['$timestamp', period_start]}
+            key['period_offset'] = {'$subtract': [
+                offset, {'$mod': [offset, period * 1000]}]}
+
+        group = {'_id': key or None,
+                 'unit': {'$min': '$counter_unit'},
+                 'duration_start': {'$min': '$timestamp'},
+                 'duration_end': {'$max': '$timestamp'}}
+        group.update(accumulators)
+        pipeline = [{'$match': q}, {'$group': group}]
+
+        return self._pipeline_results(self._aggregate(pipeline), functions,
+                                      period, period_start, groupby,
+                                      aggregate)
+
+    def _pipeline_results(self, groups, functions, period, period_start,
+                          groupby, aggregate):
+        """Convert the documents output by the $group stage to results.
+
+        :return: an iterable of dicts such as taken by _stats_result_to_model
+        """
+        standard = self.PIPELINE_STANDARD_AGGREGATES
+        for r in groups:
+            group_key = r['_id'] or {}
+            result = dict((k, r[k]) for k in ['unit', 'duration_start',
+                                              'duration_end'])
+            result['duration'] = timeutils.delta_seconds(r['duration_start'],
+                                                         r['duration_end'])
+            if period:
+                result['period'] = period
+                result['period_start'] = period_start + datetime.timedelta(
+                    milliseconds=group_key['period_offset'])
+                result['period_end'] = result['period_start'] + \
+                    datetime.timedelta(seconds=period)
+            else:
+                result['period'] = 0
+                result['period_start'] = r['duration_start']
+                result['period_end'] = r['duration_end']
+            result['groupby'] = dict((g, group_key.get(g))
+                                     for g in groupby or [])
+
+            values = {}
+            for key, func, param in functions:
+                if func == 'stddev':
+                    mean = r['sdsum'] / float(r['sdcount'])
+                    values[key] = math.sqrt(max(
+                        0, r['sdsquares'] / float(r['sdcount']) - mean ** 2))
+                elif func == 'cardinality':
+                    values[key] = len(r['distinct_%s' % param])
+                else:
+                    values[key] = r[func]
+            result.update((k, v) for k, v in values.iteritems()
+                          if k in standard)
+            if aggregate:
+                result['aggregate'] = values
+            yield result
+
+    @staticmethod
+    def _stats_result_aggregates(result, aggregate):
+        stats_args = {}
+        for attr in ['count', 'min', 'max', 'sum', 'avg']:
+            if attr in result:
+                stats_args[attr] = result[attr]
+
+        if aggregate:
+            stats_args['aggregate'] = {}
+            for a in aggregate:
+                ak = '%s%s' % (a.func, '/%s' % a.param if a.param else '')
+                if ak in result:
+                    stats_args['aggregate'][ak] = result[ak]
+                elif 'aggregate' in result:
+                    stats_args['aggregate'][ak] = result['aggregate'].get(ak)
+        return stats_args
+
+    @staticmethod
+    def _stats_result_to_model(result, groupby, aggregate):
+        stats_args = Connection._stats_result_aggregates(result, aggregate)
+        stats_args['unit'] = result['unit']
+        stats_args['duration'] = result['duration']
+        stats_args['duration_start'] = result['duration_start']
+        stats_args['duration_end'] = result['duration_end']
+        stats_args['period'] = result['period']
+        stats_args['period_start'] = result['period_start']
+        stats_args['period_end'] = result['period_end']
+        stats_args['groupby'] = (dict(
+            (g, result['groupby'][g]) for g in groupby) if groupby else None)
+        return models.Statistics(**stats_args)
@@ -0,0 +1,77 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sqlalchemy as sa
+
+from ceilometer.storage.sqlalchemy import models
+
+
+KEYS = ['resource_id', 'user_id', 'project_id', 'source_id']
+
+
+def _same(left, right):
+    return sa.or_(left == right, sa.and_(left.is_(None), right.is_(None)))
+
+
+def upgrade(migrate_engine):
+    meta = sa.MetaData(bind=migrate_engine)
+    resource = sa.Table(
+        'resource', meta,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('resource_id', sa.String(255)),
+        sa.Column('user_id', sa.String(255)),
+        sa.Column('project_id', sa.String(255)),
+        sa.Column('source_id', sa.String(255)),
+        sa.Column('resource_metadata', models.JSONEncodedDict()),
+        sa.Column('first_sample_timestamp', models.PreciseTimestamp()),
+        sa.Column('last_sample_timestamp', models.PreciseTimestamp()),
+        sa.Index('ix_resource_resource_id', 'resource_id'),
+        sa.Index('ix_resource_user_id', 'user_id'),
+        sa.Index('ix_resource_project_id', 'project_id'),
+        sa.UniqueConstraint(*KEYS, name='resource_unique'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    resource.create()
+
+    # backfill the summary from the existing samples
+    sample = sa.Table('sample', meta, autoload=True)
+    q = sa.select([sample.c[k] for k in KEYS] +
+                  [sa.func.min(sample.c.timestamp),
+                   sa.func.max(sample.c.timestamp)])\
+        .group_by(*[sample.c[k] for k in KEYS])
+    # NOTE(sileht): workaround for
+    # https://bitbucket.org/zzzeek/sqlalchemy/
+    # issue/3044/insert-from-select-union_all
+    q.select = lambda: q
+    sql_ins = resource.insert().from_select(
+        [resource.c[k] for k in KEYS] +
+        [resource.c.first_sample_timestamp,
+         resource.c.last_sample_timestamp], q)
+    try:
+        migrate_engine.execute(sql_ins)
+    except TypeError:
+        # from select is empty
+        pass
+
+    latest_metadata = sa.select([sample.c.resource_metadata])\
+        .where(sa.and_(*[_same(sample.c[k], resource.c[k]) for k in KEYS]))\
+        .where(sample.c.timestamp == resource.c.last_sample_timestamp)\
+        .order_by(sample.c.id.desc()).limit(1).as_scalar()
+    resource.update().values(resource_metadata=latest_metadata).execute()
+
+
+def downgrade(migrate_engine):
+    meta = sa.MetaData(bind=migrate_engine)
+    resource = sa.Table('resource', meta, autoload=True)
+    resource.drop()
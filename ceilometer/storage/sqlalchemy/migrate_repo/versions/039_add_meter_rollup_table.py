@@ -0,0 +1,53 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sqlalchemy as sa
+
+from ceilometer.storage.sqlalchemy import models
+
+
+def upgrade(migrate_engine):
+    meta = sa.MetaData(bind=migrate_engine)
+    sa.Table('meter', meta, autoload=True)
+    meter_rollup = sa.Table(
+        'meter_rollup', meta,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('granularity', sa.Integer, nullable=False),
+        sa.Column('meter_id', sa.Integer, sa.ForeignKey('meter.id')),
+        sa.Column('resource_id', sa.String(255)),
+        sa.Column('user_id', sa.String(255)),
+        sa.Column('project_id', sa.String(255)),
+        sa.Column('source_id', sa.String(255)),
+        sa.Column('period_start', models.PreciseTimestamp()),
+        sa.Column('sample_count', sa.Integer),
+        sa.Column('volume_sum', sa.Float(53)),
+        sa.Column('volume_min', sa.Float(53)),
+        sa.Column('volume_max', sa.Float(53)),
+        sa.Column('first_sample_timestamp', models.PreciseTimestamp()),
+        sa.Column('last_sample_timestamp', models.PreciseTimestamp()),
+        sa.Index('ix_meter_rollup_period', 'granularity', 'meter_id',
+                 'period_start'),
+        sa.Index('ix_meter_rollup_resource_id', 'resource_id'),
+        sa.UniqueConstraint('granularity', 'meter_id', 'resource_id',
+                            'user_id', 'project_id', 'source_id',
+                            'period_start', name='rollup_unique'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    meter_rollup.create()
+
+
+def downgrade(migrate_engine):
+    meta = sa.MetaData(bind=migrate_engine)
+    meter_rollup = sa.Table('meter_rollup', meta, autoload=True)
+    meter_rollup.drop()
@@ -193,6 +193,66 @@ class Sample(Base):
                              cascade="all, delete-orphan")
 
 
+class Resource(Base):
+    """Summary of the samples of a resource.
+
+    There is one row per resource and (user, project, source) the samples of
+    the resource were recorded with. Rows are maintained when samples are
+    recorded or expired.
+    """
+
+    __tablename__ = 'resource'
+    __table_args__ = (
+        Index('ix_resource_resource_id', 'resource_id'),
+        Index('ix_resource_user_id', 'user_id'),
+        Index('ix_resource_project_id', 'project_id'),
+        UniqueConstraint('resource_id', 'user_id', 'project_id',
+                         'source_id', name='resource_unique'),
+    )
+    id = Column(Integer, primary_key=True)
+    resource_id = Column(String(255))
+    user_id = Column(String(255))
+    project_id = Column(String(255))
+    source_id = Column(String(255))
+    resource_metadata = Column(JSONEncodedDict())
+    first_sample_timestamp = Column(PreciseTimestamp())
+    last_sample_timestamp = Column(PreciseTimestamp())
+
+
+class MeterRollup(Base):
+    """Aggregates of the samples of a meter and resource over a period.
+
+    There is one row per granularity, meter, resource, (user, project,
+    source) and period of granularity seconds, aligned on the epoch. Rows
+    are maintained when samples are recorded, if statistics rollups are
+    enabled.
+    """
+
+    __tablename__ = 'meter_rollup'
+    __table_args__ = (
+        Index('ix_meter_rollup_period', 'granularity', 'meter_id',
+              'period_start'),
+        Index('ix_meter_rollup_resource_id', 'resource_id'),
+        UniqueConstraint('granularity', 'meter_id', 'resource_id', 'user_id',
+                         'project_id', 'source_id', 'period_start',
+                         name='rollup_unique'),
+    )
+    id = Column(Integer, primary_key=True)
+    granularity = Column(Integer, nullable=False)
+    meter_id = Column(Integer, ForeignKey('meter.id'))
+    resource_id = Column(String(255))
+    user_id = Column(String(255))
+    project_id = Column(String(255))
+    source_id = Column(String(255))
+    period_start = Column(PreciseTimestamp())
+    sample_count = Column(Integer)
+    volume_sum = Column(Float(53))
+    volume_min = Column(Float(53))
+    volume_max = Column(Float(53))
+    first_sample_timestamp = Column(PreciseTimestamp())
+    last_sample_timestamp = Column(PreciseTimestamp())
+
+
 class MeterSample(Base):
     """Helper model as many of the filters work against Sample data
     joined with Meter data.
@@ -24,10 +24,12 @@ import abc
 import copy
 import datetime
 
+import eventlet
 import mock
 import six
 from stevedore import extension
 
+from ceilometer import agent
 from ceilometer.openstack.common.fixture import config
 from ceilometer.openstack.common.fixture import mockpatch
 from ceilometer import pipeline
@@ -48,7 +50,7 @@ class TestSample(sample.Sample):
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return self.as_dict() == other.as_dict()
         return False
 
     def __ne__(self, other):
@@ -80,6 +82,13 @@ class TestPollster(plugin.PollsterBase):
         return [c]
 
 
+class TestPollsterSlow(TestPollster):
+    def get_samples(self, manager, cache, resources=None):
+        eventlet.sleep(1)
+        return super(TestPollsterSlow, self).get_samples(manager, cache,
+                                                         resources)
+
+
 class TestPollsterException(TestPollster):
     def get_samples(self, manager, cache, resources=None):
         resources = resources or []
@@ -122,6 +131,11 @@ class BaseAgentManagerTestCase(base.BaseTestCase):
             timestamp=default_test_data.timestamp,
             resource_metadata=default_test_data.resource_metadata)
 
+    class PollsterSlow(TestPollsterSlow):
+        samples = []
+        resources = []
+        test_data = default_test_data
+
     class PollsterException(TestPollsterException):
         samples = []
         resources = []
@@ -360,7 +374,27 @@ class BaseAgentManagerTestCase(base.BaseTestCase):
         mgr.create_polling_task = mock.MagicMock()
         mgr.tg = mock.MagicMock()
         mgr.start()
-        self.assertTrue(mgr.tg.add_timer.called)
+        self.assertTrue(mgr.tg.add_dynamic_timer.called)
+
+    def test_scheduled_task(self):
+        polling_tasks = self.mgr.setup_polling_tasks()
+        with mock.patch('ceilometer.agent.time') as fake_time:
+            fake_time.time.return_value = 0
+            schedule = agent.PollingSchedule(60, 'host', stagger=False)
+            schedule.delay(0)
+            fake_time.time.return_value = 10
+            delay = self.mgr.scheduled_task(polling_tasks[60], schedule)
+        pub = self.mgr.pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(1, len(pub.samples))
+        self.assertEqual(50, delay)
+
+    def test_scheduled_task_exception(self):
+        polling_tasks = self.mgr.setup_polling_tasks()
+        schedule = agent.PollingSchedule(60, 'host', stagger=False)
+        with mock.patch.object(self.mgr, 'interval_task',
+                               side_effect=Exception()):
+            delay = self.mgr.scheduled_task(polling_tasks[60], schedule)
+        self.assertTrue(0 < delay <= 60)
 
     def test_manager_exception_persistency(self):
         self.pipeline_cfg.append({
@@ -487,3 +521,56 @@ class BaseAgentManagerTestCase(base.BaseTestCase):
             published = pipe_line.publishers[0].samples[0]
             self.assertEqual(amalgamated_resources,
                              set(published.resource_metadata['resources']))
+
+    def _setup_two_pollsters(self):
+        self.pipeline_cfg[0]['counters'] = ['test', 'testanother']
+        self.setup_pipeline()
+        return self.mgr.setup_polling_tasks()[60]
+
+    def test_polling_concurrency(self):
+        self.CONF.set_override('polling_concurrency', 2)
+        task = self._setup_two_pollsters()
+        self.mgr.interval_task(task)
+        pub = self.mgr.pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(set(['test', 'testanother']),
+                         set(s.name for s in pub.samples))
+        self.assertEqual(1, len(self.Pollster.samples))
+        self.assertEqual(1, len(self.PollsterAnother.samples))
+
+    def test_polling_concurrency_shared_cache(self):
+        self.CONF.set_override('polling_concurrency', 2)
+        task = self._setup_two_pollsters()
+        caches = []
+        for pollster in task.pollsters:
+            get_samples = pollster.obj.get_samples
+
+            def record_cache(manager, cache, resources=None,
+                             get_samples=get_samples):
+                caches.append(cache)
+                return get_samples(manager, cache, resources)
+            pollster.obj.get_samples = record_cache
+        self.mgr.interval_task(task)
+        self.assertEqual(2, len(caches))
+        self.assertIs(caches[0], caches[1])
+
+    def test_pollster_timeout(self):
+        self.CONF.set_override('polling_concurrency', 2)
+        self.CONF.set_override('pollster_timeout', 0.01)
+        self.mgr.pollster_manager = (
+            extension.ExtensionManager.make_test_instance([
+                extension.Extension('test', None, None, self.Pollster()),
+                extension.Extension('testanother', None, None,
+                                    self.PollsterSlow())]))
+        task = self._setup_two_pollsters()
+        self.mgr.interval_task(task)
+        pub = self.mgr.pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(['test'], [s.name for s in pub.samples])
+
+    def test_pollster_durations(self):
+        task = self._setup_two_pollsters()
+        self.mgr.interval_task(task)
+        self.mgr.interval_task(task)
+        self.assertEqual(set(['test', 'testanother']), set(task.durations))
+        for counts in task.durations.values():
+            self.assertEqual(2, counts[0])
+            self.assertEqual(2, sum(counts))
@@ -0,0 +1,295 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Tests for ceilometer/compute/discovery.py
+"""
+import datetime
+
+import mock
+
+from ceilometer.compute import discovery
+from ceilometer.compute.virt.libvirt import inspector as libvirt_inspector
+from ceilometer.openstack.common.fixture import config
+from ceilometer.openstack.common.fixture import mockpatch
+from ceilometer.openstack.common import test
+from ceilometer.openstack.common import timeutils
+
+
+DOMAIN_XML = """
+<domain type='kvm'>
+  <name>%(name)s</name>
+  <uuid>%(uuid)s</uuid>
+  <metadata>
+    <nova:instance xmlns:nova="http://openstack.org/xmlns/libvirt/nova/1.0">
+      <nova:package version="2014.2"/>
+      <nova:name>%(display_name)s</nova:name>
+      <nova:creationTime>2014-01-01 00:00:00</nova:creationTime>
+      <nova:flavor name="m1.small">
+        <nova:memory>2048</nova:memory>
+        <nova:disk>20</nova:disk>
+        <nova:swap>0</nova:swap>
+        <nova:ephemeral>0</nova:ephemeral>
+        <nova:vcpus>1</nova:vcpus>
+      </nova:flavor>
+      <nova:owner>
+        <nova:user uuid="user-1">admin</nova:user>
+        <nova:project uuid="project-1">demo</nova:project>
+      </nova:owner>
+      <nova:root type="image" uuid="image-1"/>
+    </nova:instance>
+  </metadata>
+</domain>
+"""
+
+
+class FakeDomain(object):
+    def __init__(self, name, uuid, display_name=None, state=1):
+        self._name = name
+        self._uuid = uuid
+        self.state = state
+        self.xml_calls = 0
+        if display_name:
+            self.xml = DOMAIN_XML % {'name': name, 'uuid': uuid,
+                                     'display_name': display_name}
+        else:
+            self.xml = "<domain type='kvm'><name>%s</name></domain>" % name
+
+    def name(self):
+        return self._name
+
+    def UUIDString(self):
+        return self._uuid
+
+    def XMLDesc(self, flags):
+        self.xml_calls += 1
+        return self.xml
+
+    def info(self):
+        return [self.state, 2097152, 2097152, 1, 999999]
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.domains = {}
+        self.defined = []
+
+    def getCapabilities(self):
+        return '<capabilities/>'
+
+    def numOfDomains(self):
+        return len(self.domains)
+
+    def listDomainsID(self):
+        return list(self.domains)
+
+    def lookupByID(self, domain_id):
+        return self.domains[domain_id]
+
+    def listDefinedDomains(self):
+        return [d.name() for d in self.defined]
+
+    def lookupByName(self, name):
+        return dict((d.name(), d) for d in self.defined)[name]
+
+
+class TestLocalInstanceDiscovery(test.BaseTestCase):
+
+    def setUp(self):
+        super(TestLocalInstanceDiscovery, self).setUp()
+        self.CONF = self.useFixture(config.Config()).conf
+        self.CONF.set_override('host', 'compute-1')
+        self.useFixture(mockpatch.PatchObject(libvirt_inspector, 'libvirt',
+                                              mock.Mock()))
+        self.discovery = discovery.LocalInstanceDiscovery()
+        self.connection = FakeConnection()
+        self.discovery.inspector.connection = self.connection
+
+    def test_discover(self):
+        domain = FakeDomain('instance-00000001', 'uuid-1', 'vm-1')
+        self.connection.domains = {1: domain}
+        instances = self.discovery.discover()
+        self.assertEqual(1, len(instances))
+        instance = instances[0]
+        self.assertEqual('uuid-1', instance.id)
+        self.assertEqual('vm-1', instance.name)
+        self.assertEqual('instance-00000001',
+                         getattr(instance, 'OS-EXT-SRV-ATTR:instance_name'))
+        self.assertEqual('user-1', instance.user_id)
+        self.assertEqual('project-1', instance.tenant_id)
+        self.assertEqual({'id': 'm1.small', 'name': 'm1.small', 'vcpus': 1,
+                          'ram': 2048, 'disk': 20, 'ephemeral': 0},
+                         instance.flavor)
+        self.assertEqual({'id': 'image-1'}, instance.image)
+        self.assertEqual({}, instance.metadata)
+        self.assertEqual('active', instance.status)
+        self.assertEqual(56, len(instance.hostId))
+
+    def test_discover_not_nova(self):
+        self.connection.domains = {1: FakeDomain('other', 'uuid-1'),
+                                   2: FakeDomain('instance-00000002',
+                                                 'uuid-2', 'vm-2')}
+        self.assertEqual(['uuid-2'],
+                         [i.id for i in self.discovery.discover()])
+        self.discovery.discover()
+        self.assertEqual(1, self.connection.domains[1].xml_calls)
+
+    def test_discover_cached(self):
+        domain = FakeDomain('instance-00000001', 'uuid-1', 'vm-1')
+        self.connection.domains = {1: domain}
+        instance = self.discovery.discover()[0]
+        domain.state = 3
+        self.assertIs(instance, self.discovery.discover()[0])
+        self.assertEqual('paused', instance.status)
+        self.assertEqual(1, domain.xml_calls)
+
+    def test_discover_domain_restarted(self):
+        domain = FakeDomain('instance-00000001', 'uuid-1', 'vm-1')
+        self.connection.domains = {1: domain}
+        self.discovery.discover()
+        self.connection.domains = {2: domain}
+        self.discovery.discover()
+        self.assertEqual(2, domain.xml_calls)
+
+    def test_discover_inactive(self):
+        domain = FakeDomain('instance-00000001', 'uuid-1', 'vm-1', state=5)
+        self.connection.defined = [domain]
+        instances = self.discovery.discover()
+        self.assertEqual(['uuid-1'], [i.id for i in instances])
+        self.assertEqual('shutoff', instances[0].status)
+        domain.state = 1
+        self.connection.defined = []
+        self.connection.domains = {1: domain}
+        self.assertEqual('active', self.discovery.discover()[0].status)
+        self.assertEqual(2, domain.xml_calls)
+
+    def test_discover_invalid_xml(self):
+        invalid = FakeDomain('instance-00000001', 'uuid-1', 'vm-1')
+        invalid.xml = '<domain type='
+        self.connection.domains = {1: invalid,
+                                   2: FakeDomain('instance-00000002',
+                                                 'uuid-2', 'vm-2')}
+        self.assertEqual(['uuid-2'],
+                         [i.id for i in self.discovery.discover()])
+        self.discovery.discover()
+        self.assertEqual(1, invalid.xml_calls)
+
+    def test_discover_domain_gone(self):
+        self.connection.domains = {1: FakeDomain('instance-00000001',
+                                                 'uuid-1', 'vm-1')}
+        self.discovery.discover()
+        self.connection.domains = {}
+        self.assertEqual([], self.discovery.discover())
+        self.assertEqual({}, self.discovery.instances)
+
+
+class TestInstanceDiscovery(test.BaseTestCase):
+
+    def setUp(self):
+        super(TestInstanceDiscovery, self).setUp()
+        self.CONF = self.useFixture(config.Config()).conf
+        self.CONF.set_override('host', 'compute-1')
+        with mock.patch('ceilometer.nova_client.Client'):
+            self.discovery = discovery.InstanceDiscovery()
+        self.nova_cli = self.discovery.nova_cli
+        self.instances = []
+        self.nova_cli.instance_get_all_by_host.side_effect = (
+            lambda host, since: self.instances)
+        self.now = datetime.datetime(2014, 1, 1)
+        timeutils.set_time_override(self.now)
+        self.addCleanup(timeutils.clear_time_override)
+
+    @staticmethod
+    def _instance(instance_id, state='active'):
+        instance = mock.MagicMock()
+        instance.id = instance_id
+        setattr(instance, 'OS-EXT-STS:vm_state', state)
+        return instance
+
+    def test_discover(self):
+        self.instances = [self._instance('a'), self._instance('b', 'error')]
+        self.assertEqual(['a'], [i.id for i in self.discovery.discover()])
+        self.nova_cli.instance_get_all_by_host.assert_called_once_with(
+            'compute-1', None)
+
+    def test_discover_incremental(self):
+        self.instances = [self._instance('a'), self._instance('b')]
+        self.discovery.discover()
+        timeutils.advance_time_seconds(60)
+        self.instances = [self._instance('b', 'deleted'),
+                          self._instance('c')]
+        self.assertEqual(['a', 'c'],
+                         sorted(i.id for i in self.discovery.discover()))
+        self.nova_cli.instance_get_all_by_host.assert_called_with(
+            'compute-1', self.now)
+
+    def test_discover_full_refresh(self):
+        self.CONF.set_override('instance_full_refresh_interval', 600)
+        self.instances = [self._instance('a'), self._instance('b')]
+        self.discovery.discover()
+        timeutils.advance_time_seconds(600)
+        self.instances = [self._instance('b')]
+        self.assertEqual(['b'], [i.id for i in self.discovery.discover()])
+        self.nova_cli.instance_get_all_by_host.assert_called_with(
+            'compute-1', None)
+
+    def test_discover_ttl(self):
+        self.instances = [self._instance('a')]
+        self.discovery.discover()
+        timeutils.advance_time_seconds(30)
+        self.assertEqual(['a'], [i.id for i in self.discovery.discover()])
+        self.assertEqual(1, self.nova_cli.instance_get_all_by_host.call_count)
+        timeutils.advance_time_seconds(30)
+        self.discovery.discover()
+        self.assertEqual(2, self.nova_cli.instance_get_all_by_host.call_count)
+
+    def test_discover_no_ttl(self):
+        self.CONF.set_override('instance_discovery_ttl', 0)
+        self.instances = [self._instance('a')]
+        self.discovery.discover()
+        self.discovery.discover()
+        self.assertEqual(2, self.nova_cli.instance_get_all_by_host.call_count)
+
+    def test_notification_invalidates(self):
+        self.instances = [self._instance('a')]
+        self.discovery.discover()
+        self.discovery.info({}, 'compute.compute-1',
+                            'compute.instance.create.end',
+                            {'instance_id': 'b', 'host': 'compute-1'}, {})
+        self.instances = [self._instance('b')]
+        self.assertEqual(['a', 'b'],
+                         sorted(i.id for i in self.discovery.discover()))
+        self.assertEqual(2, self.nova_cli.instance_get_all_by_host.call_count)
+
+    def test_notification_other_host(self):
+        self.instances = [self._instance('a'), self._instance('b')]
+        self.discovery.discover()
+        self.discovery.info({}, 'compute.compute-2',
+                            'compute.instance.finish_resize.end',
+                            {'instance_id': 'a', 'host': 'compute-2'}, {})
+        self.discovery.info({}, 'compute.compute-2',
+                            'compute.instance.create.end',
+                            {'instance_id': 'c', 'host': 'compute-2'}, {})
+        self.assertEqual(['b'], [i.id for i in self.discovery.discover()])
+        self.assertEqual(1, self.nova_cli.instance_get_all_by_host.call_count)
+
+    @mock.patch('ceilometer.messaging.get_transport')
+    @mock.patch('ceilometer.messaging.get_notification_listener')
+    def test_listen(self, get_listener, get_transport):
+        self.CONF.set_override('instance_discovery_notification_topic',
+                               'compute_agent')
+        self.discovery.discover()
+        self.discovery.discover()
+        get_listener.assert_called_once_with(get_transport.return_value,
+                                             mock.ANY, [self.discovery])
+        self.assertEqual('compute_agent',
+                         get_listener.call_args[0][1][0].topic)
+        get_listener.return_value.start.assert_called_once_with()
@@ -91,3 +91,19 @@ class TestRunTasks(agentbase.BaseAgentManagerTestCase):
         self._verify_discovery_params([None])
         self.assertEqual(set(self.Pollster.resources),
                          set(self.instances))
+
+    def test_interval_task_snapshot(self):
+        self.mgr._inspector = mock.Mock()
+        polling_tasks = self.mgr.setup_polling_tasks()
+        self.mgr.interval_task(polling_tasks.get(60))
+        self.mgr._inspector.begin_snapshot.assert_called_once_with()
+        self.mgr._inspector.end_snapshot.assert_called_once_with()
+
+    def test_interval_task_no_snapshot(self):
+        self.mgr._inspector = mock.Mock()
+        polling_tasks = self.mgr.setup_polling_tasks()
+        task = polling_tasks.get(60)
+        for pollster in task.pollsters:
+            pollster.obj.uses_inspector = False
+        self.mgr.interval_task(task)
+        self.assertFalse(self.mgr._inspector.begin_snapshot.called)
@@ -25,6 +25,8 @@ import mock
 
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.compute.virt.libvirt import inspector as libvirt_inspector
+from ceilometer.openstack.common.fixture import config
+from ceilometer.openstack.common.fixture import mockpatch
 from ceilometer.openstack.common import test
 
 
@@ -267,3 +269,192 @@ class TestLibvirtInspectionWithError(test.BaseTestCase):
     def test_inspect_unknown_error(self):
         self.assertRaises(virt_inspector.InspectorException,
                           self.inspector.inspect_cpus, 'foo')
+
+
+class TestLibvirtSnapshot(test.BaseTestCase):
+
+    dom_xml = """
+         <domain type='kvm'>
+             <devices>
+                <disk type='file' device='disk'>
+                    <target dev='vda' bus='virtio'/>
+                </disk>
+                <interface type='bridge'>
+                   <mac address='fa:16:3e:71:ec:6d'/>
+                   <source bridge='br100'/>
+                   <target dev='vnet0'/>
+                   <filterref filter='nova-instance-00000001-fa163e71ec6d'>
+                     <parameter name='IP' value='10.0.0.2'/>
+                   </filterref>
+                </interface>
+             </devices>
+         </domain>
+    """
+
+    def setUp(self):
+        super(TestLibvirtSnapshot, self).setUp()
+        self.CONF = self.useFixture(config.Config()).conf
+        self.CONF.set_override('libvirt_bulk_stats', True)
+        self.useFixture(mockpatch.PatchObject(libvirt_inspector, 'libvirt',
+                                              mock.MagicMock()))
+        self.inspector = libvirt_inspector.LibvirtInspector()
+        self.domain = mock.Mock()
+        self.domain.name.return_value = 'instance-00000001'
+        self.domain.UUIDString.return_value = 'uuid'
+        self.domain.ID.return_value = 42
+        self.domain.XMLDesc.return_value = self.dom_xml
+        self.domain.info.return_value = (1L, 2048L, 2048L, 2L, 999999L)
+        self.domain.interfaceStats.return_value = (1L, 2L, 0L, 0L, 3L, 4L,
+                                                   0L, 0L)
+        self.domain.blockStats.return_value = (1L, 2L, 3L, 4L, -1)
+        self.record = {'state.state': 1,
+                       'vcpu.current': 2,
+                       'cpu.time': 999999,
+                       'net.count': 1,
+                       'net.0.name': 'vnet0',
+                       'net.0.rx.bytes': 1,
+                       'net.0.rx.pkts': 2,
+                       'net.0.tx.bytes': 3,
+                       'net.0.tx.pkts': 4,
+                       'block.count': 1,
+                       'block.0.name': 'vda',
+                       'block.0.rd.reqs': 1,
+                       'block.0.rd.bytes': 2,
+                       'block.0.wr.reqs': 3,
+                       'block.0.wr.bytes': 4}
+
+    def _bulk_connection(self):
+        connection = mock.Mock(spec=['getCapabilities', 'getAllDomainStats',
+                                     'lookupByName'])
+        connection.getAllDomainStats.return_value = [(self.domain,
+                                                      self.record)]
+        self.inspector.connection = connection
+        return connection
+
+    def _check_snapshot(self, connection):
+        cpu_info = self.inspector.inspect_cpus('instance-00000001')
+        self.assertEqual(2L, cpu_info.number)
+        self.assertEqual(999999L, cpu_info.time)
+        vnics = list(self.inspector.inspect_vnics('instance-00000001'))
+        self.assertEqual(1, len(vnics))
+        vnic0, info0 = vnics[0]
+        self.assertEqual('vnet0', vnic0.name)
+        self.assertEqual('fa:16:3e:71:ec:6d', vnic0.mac)
+        self.assertEqual({'ip': '10.0.0.2'}, vnic0.parameters)
+        self.assertEqual(virt_inspector.InterfaceStats(rx_bytes=1,
+                                                       rx_packets=2,
+                                                       tx_bytes=3,
+                                                       tx_packets=4),
+                         info0)
+        disks = list(self.inspector.inspect_disks('instance-00000001'))
+        self.assertEqual(1, len(disks))
+        disk0, info0 = disks[0]
+        self.assertEqual('vda', disk0.device)
+        self.assertEqual(virt_inspector.DiskStats(read_requests=1,
+                                                  read_bytes=2,
+                                                  write_requests=3,
+                                                  write_bytes=4,
+                                                  errors=-1),
+                         info0)
+        self.assertFalse(connection.lookupByName.called)
+        self.assertEqual(1, connection.getCapabilities.call_count)
+
+    def test_snapshot_bulk(self):
+        connection = self._bulk_connection()
+        self.inspector.begin_snapshot()
+        self._check_snapshot(connection)
+        self.assertEqual(1, connection.getAllDomainStats.call_count)
+        self.assertEqual(1, self.domain.XMLDesc.call_count)
+
+    def _per_domain_connection(self):
+        connection = mock.Mock(spec=['getCapabilities', 'numOfDomains',
+                                     'listDomainsID', 'lookupByID',
+                                     'lookupByName'])
+        connection.numOfDomains.return_value = 1
+        connection.listDomainsID.return_value = [42]
+        connection.lookupByID.return_value = self.domain
+        self.inspector.connection = connection
+        return connection
+
+    def test_snapshot_per_domain(self):
+        connection = self._per_domain_connection()
+        self.inspector.begin_snapshot()
+        self._check_snapshot(connection)
+        self.assertEqual(1, self.domain.XMLDesc.call_count)
+        self.assertEqual(1, self.domain.info.call_count)
+
+    def test_snapshot_devices_cached(self):
+        self._bulk_connection()
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.inspector.begin_snapshot()
+        self.assertEqual(1, self.domain.XMLDesc.call_count)
+        self.domain.ID.return_value = 43
+        self.inspector.end_snapshot()
+        self.inspector.begin_snapshot()
+        self.assertEqual(2, self.domain.XMLDesc.call_count)
+
+    def test_snapshot_per_domain_devices_cached(self):
+        connection = self._per_domain_connection()
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.inspector.begin_snapshot()
+        self.assertEqual(1, self.domain.XMLDesc.call_count)
+        self.inspector.end_snapshot()
+        connection.listDomainsID.return_value = [43]
+        self.domain.ID.return_value = 43
+        self.inspector.begin_snapshot()
+        self.assertEqual(2, self.domain.XMLDesc.call_count)
+        self.inspector.end_snapshot()
+        # a device was unplugged
+        libvirt_inspector.libvirt.libvirtError = type('libvirtError',
+                                                      (Exception,), {})
+        self.domain.blockStats.side_effect = (
+            libvirt_inspector.libvirt.libvirtError)
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.domain.blockStats.side_effect = None
+        self.inspector.begin_snapshot()
+        self.assertEqual(3, self.domain.XMLDesc.call_count)
+
+    def test_snapshot_device_plugged(self):
+        self._bulk_connection()
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.record.update({'block.count': 2, 'block.1.name': 'vdb'})
+        self.inspector.begin_snapshot()
+        self.assertEqual(2, self.domain.XMLDesc.call_count)
+
+    def test_snapshot_released(self):
+        connection = self._bulk_connection()
+        connection.lookupByName.return_value = self.domain
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.inspector.inspect_cpus('instance-00000001')
+        self.assertTrue(connection.lookupByName.called)
+
+    def test_snapshot_failed(self):
+        connection = self._bulk_connection()
+        connection.lookupByName.return_value = self.domain
+        self.inspector.begin_snapshot()
+        connection.getAllDomainStats.side_effect = Exception
+        self.inspector.begin_snapshot()
+        self.assertIsNone(self.inspector._snapshot)
+        self.inspector.inspect_cpus('instance-00000001')
+        self.assertTrue(connection.lookupByName.called)
+        # the connection is tested again rather than trusted
+        self.assertEqual(3, connection.getCapabilities.call_count)
+
+    def test_snapshot_unknown_instance(self):
+        connection = self._bulk_connection()
+        connection.lookupByName.return_value = self.domain
+        self.inspector.begin_snapshot()
+        self.inspector.inspect_cpus('instance-00000002')
+        connection.lookupByName.assert_called_once_with('instance-00000002')
+
+    def test_snapshot_disabled(self):
+        self.CONF.set_override('libvirt_bulk_stats', False)
+        connection = self._bulk_connection()
+        self.inspector.begin_snapshot()
+        self.inspector.end_snapshot()
+        self.assertFalse(connection.getAllDomainStats.called)
@@ -44,10 +44,10 @@ class TestDispatcherDB(test.BaseTestCase):
         )
 
         with mock.patch.object(self.dispatcher.storage_conn,
-                               'record_metering_data') as record_metering_data:
+                               'record_metering_data_batch') as record_batch:
             self.dispatcher.record_metering_data(msg)
 
-        record_metering_data.assert_called_once_with(msg)
+        record_batch.assert_called_once_with([msg])
 
     def test_invalid_message(self):
         msg = {'counter_name': 'test',
@@ -63,6 +63,9 @@ class TestDispatcherDB(test.BaseTestCase):
             def record_metering_data(self, data):
                 self.called = True
 
+            def record_metering_data_batch(self, samples):
+                self.called = True
+
         self.dispatcher.storage_conn = ErrorConnection()
 
         self.dispatcher.record_metering_data(msg)
@@ -70,6 +73,81 @@ class TestDispatcherDB(test.BaseTestCase):
         if self.dispatcher.storage_conn.called:
             self.fail('Should not have called the storage connection')
 
+    def test_batch_message(self):
+        msgs = []
+        for i in range(3):
+            msg = {'counter_name': 'test',
+                   'resource_id': '%s-%d' % (self.id(), i),
+                   'counter_volume': i,
+                   }
+            msg['message_signature'] = utils.compute_signature(
+                msg,
+                self.CONF.publisher.metering_secret,
+            )
+            msgs.append(msg)
+        invalid = {'counter_name': 'test',
+                   'resource_id': self.id(),
+                   'counter_volume': 1,
+                   'message_signature': 'invalid-signature',
+                   }
+
+        with mock.patch.object(self.dispatcher.storage_conn,
+                               'record_metering_data_batch') as record_batch:
+            self.dispatcher.record_metering_data(msgs + [invalid])
+
+        record_batch.assert_called_once_with(msgs)
+
+    def test_batch_failure_records_one_by_one(self):
+        msgs = []
+        for i in range(3):
+            msg = {'counter_name': 'test',
+                   'resource_id': '%s-%d' % (self.id(), i),
+                   'counter_volume': i,
+                   }
+            msg['message_signature'] = utils.compute_signature(
+                msg,
+                self.CONF.publisher.metering_secret,
+            )
+            msgs.append(msg)
+
+        recorded = []
+
+        def record(data):
+            if data['counter_volume'] == 1:
+                raise Exception('bad sample')
+            recorded.append(data)
+
+        with mock.patch.object(self.dispatcher.storage_conn,
+                               'record_metering_data_batch',
+                               side_effect=Exception('bad batch')):
+            with mock.patch.object(self.dispatcher.storage_conn,
+                                   'record_metering_data',
+                                   side_effect=record):
+                self.dispatcher.record_metering_data(msgs)
+
+        self.assertEqual([msgs[0], msgs[2]], recorded)
+
+    def test_batch_failure_not_atomic(self):
+        msg = {'counter_name': 'test',
+               'resource_id': self.id(),
+               'counter_volume': 1,
+               }
+        msg['message_signature'] = utils.compute_signature(
+            msg,
+            self.CONF.publisher.metering_secret,
+        )
+
+        with mock.patch.object(self.dispatcher.storage_conn,
+                               'ATOMIC_BATCH', False):
+            with mock.patch.object(self.dispatcher.storage_conn,
+                                   'record_metering_data_batch',
+                                   side_effect=Exception('bad batch')):
+                with mock.patch.object(self.dispatcher.storage_conn,
+                                       'record_metering_data') as record:
+                    self.dispatcher.record_metering_data([msg])
+
+        self.assertFalse(record.called)
+
     def test_timestamp_conversion(self):
         msg = {'counter_name': 'test',
                'resource_id': self.id(),
@@ -85,10 +163,10 @@ class TestDispatcherDB(test.BaseTestCase):
         expected['timestamp'] = datetime.datetime(2012, 7, 2, 13, 53, 40)
 
         with mock.patch.object(self.dispatcher.storage_conn,
-                               'record_metering_data') as record_metering_data:
+                               'record_metering_data_batch') as record_batch:
             self.dispatcher.record_metering_data(msg)
 
-        record_metering_data.assert_called_once_with(expected)
+        record_batch.assert_called_once_with([expected])
 
     def test_timestamp_tzinfo_conversion(self):
         msg = {'counter_name': 'test',
@@ -106,7 +184,7 @@ class TestDispatcherDB(test.BaseTestCase):
                                                   31, 50, 262000)
 
         with mock.patch.object(self.dispatcher.storage_conn,
-                               'record_metering_data') as record_metering_data:
+                               'record_metering_data_batch') as record_batch:
             self.dispatcher.record_metering_data(msg)
 
-        record_metering_data.assert_called_once_with(expected)
+        record_batch.assert_called_once_with([expected])
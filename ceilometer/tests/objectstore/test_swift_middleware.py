@@ -58,6 +58,9 @@ class TestSwiftMiddleware(tests_base.BaseTestCase):
                 self.pipeline_manager = pipeline_manager
                 self.samples = []
 
+            def support_meter(self, meter_name):
+                return True
+
             def publish_samples(self, ctxt, samples):
                 self.samples.extend(samples)
 
@@ -66,6 +69,7 @@ class TestSwiftMiddleware(tests_base.BaseTestCase):
 
         def __init__(self):
             self.pipelines = [self._faux_pipeline(self)]
+            self.router = pipeline.MeterRouter(self.pipelines)
 
     def _fake_setup_pipeline(self, transformer_manager=None):
         return self.pipeline_manager
@@ -19,7 +19,9 @@
 
 import abc
 import datetime
+import os
 
+import fixtures
 import mock
 import six
 from stevedore import extension
@@ -69,13 +71,22 @@ class BasePipelineTestCase(test.BaseTestCase):
     def get_publisher(self, url, namespace=''):
         fake_drivers = {'test://': test_publisher.TestPublisher,
                         'new://': test_publisher.TestPublisher,
-                        'except://': self.PublisherClassException}
+                        'except://': self.PublisherClassException,
+                        'message://': self.MessagePublisherClass,
+                        'new-message://': self.MessagePublisherClass}
         return fake_drivers[url](url)
 
     class PublisherClassException(publisher.PublisherBase):
         def publish_samples(self, ctxt, counters):
             raise Exception()
 
+    class MessagePublisherClass(publisher.MessagePublisherBase):
+        def __init__(self, parsed_url):
+            self.messages = []
+
+        def publish_messages(self, ctxt, messages):
+            self.messages.extend(messages)
+
     class TransformerClass(transformer.TransformerBase):
         samples = []
 
@@ -382,6 +393,42 @@ class BasePipelineTestCase(test.BaseTestCase):
         self.assertTrue(pipeline_manager.pipelines[0].
                         support_meter('instance'))
 
+    def test_variable_counter_and_wildcard_counters(self):
+        counter_cfg = ['instance:*', 'disk.[rw]*']
+        self._set_pipeline_cfg('counters', counter_cfg)
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        self.assertTrue(pipeline_manager.pipelines[0].
+                        support_meter('instance:m1.tiny'))
+        self.assertTrue(pipeline_manager.pipelines[0].
+                        support_meter('disk.read.bytes'))
+        self.assertFalse(pipeline_manager.pipelines[0].
+                         support_meter('disk.ephemeral.size'))
+        self.assertFalse(pipeline_manager.pipelines[0].
+                         support_meter('instance'))
+
+    def test_support_meter_cached(self):
+        counter_cfg = ['cpu', 'disk.*']
+        self._set_pipeline_cfg('counters', counter_cfg)
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        source = pipeline_manager.pipelines[0].source
+        with mock.patch.object(source, '_match',
+                               side_effect=source._match) as match:
+            self.assertTrue(source.support_meter('disk.read.bytes'))
+            self.assertTrue(source.support_meter('disk.read.bytes'))
+        self.assertEqual(2, match.call_count)
+
+    def test_pipelines_for(self):
+        self._augment_pipeline_cfg()
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        self.assertEqual([pipeline_manager.pipelines[0]],
+                         pipeline_manager.pipelines_for('a'))
+        self.assertEqual([pipeline_manager.pipelines[1]],
+                         pipeline_manager.pipelines_for('b'))
+        self.assertEqual([], pipeline_manager.pipelines_for('c'))
+
     def test_multiple_pipeline(self):
         self._augment_pipeline_cfg()
 
@@ -474,6 +521,40 @@ class BasePipelineTestCase(test.BaseTestCase):
         self.assertEqual(1, publisher.calls)
         self.assertEqual('a', getattr(publisher.samples[0], 'name'))
 
+    def test_multiple_meters_single_publish(self):
+        self._set_pipeline_cfg('counters', ['*'])
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        samples = [sample.Sample(
+            name=name,
+            type=self.test_counter.type,
+            volume=self.test_counter.volume,
+            unit=self.test_counter.unit,
+            user_id=self.test_counter.user_id,
+            project_id=self.test_counter.project_id,
+            resource_id=self.test_counter.resource_id,
+            timestamp=self.test_counter.timestamp,
+            resource_metadata=self.test_counter.resource_metadata,
+        ) for name in ('b', 'a', 'b')]
+        with pipeline_manager.publisher(None) as p:
+            p(samples)
+        publisher = pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(1, publisher.calls)
+        self.assertEqual(['b_update', 'a_update', 'b_update'],
+                         [s.name for s in publisher.samples])
+
+    def test_transform_debug_log_disabled(self):
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        with mock.patch.object(pipeline.LOG, 'isEnabledFor',
+                               return_value=False):
+            with mock.patch.object(pipeline.LOG, 'debug') as debug:
+                with pipeline_manager.publisher(None) as p:
+                    p([self.test_counter])
+        self.assertFalse(debug.called)
+        publisher = pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(1, len(publisher.samples))
+
     def test_multiple_transformer_same_class(self):
         transformer_cfg = [
             {
@@ -591,6 +672,25 @@ class BasePipelineTestCase(test.BaseTestCase):
         self.assertEqual('a_update',
                          getattr(publisher.samples[0], 'name'))
 
+    def test_multiple_message_publisher(self):
+        self._set_pipeline_cfg('publishers', ['test://', 'message://',
+                                              'new-message://'])
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+
+        with mock.patch('ceilometer.publisher.utils.'
+                        'meter_message_from_counter') as sign:
+            sign.side_effect = lambda s, secret: {'counter_name': s.name}
+            with pipeline_manager.publisher(None) as p:
+                p([self.test_counter])
+
+        publishers = pipeline_manager.pipelines[0].publishers
+        self.assertEqual(1, sign.call_count)
+        self.assertEqual('a_update', publishers[0].samples[0].name)
+        self.assertEqual([{'counter_name': 'a_update'}],
+                         publishers[1].messages)
+        self.assertIs(publishers[1].messages[0], publishers[2].messages[0])
+
     def test_multiple_publisher_isolation(self):
         self._set_pipeline_cfg('publishers', ['except://', 'new://'])
         pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
@@ -1032,6 +1132,146 @@ class BasePipelineTestCase(test.BaseTestCase):
         pipe.flush(None)
         self.assertEqual(0, len(publisher.samples))
 
+    def _rate_of_change_pipeline(self, **parameters):
+        parameters.update({'source': {},
+                           'target': {'name': 'cpu_util',
+                                      'unit': 'ns/s',
+                                      'type': sample.TYPE_GAUGE}})
+        self._set_pipeline_cfg('transformers', [{'name': 'rate_of_change',
+                                                 'parameters': parameters}])
+        self._set_pipeline_cfg('counters', ['cpu'])
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        return pipeline_manager.pipelines[0]
+
+    @staticmethod
+    def _cpu_sample(resource_id, volume, timestamp):
+        return sample.Sample(
+            name='cpu',
+            type=sample.TYPE_CUMULATIVE,
+            volume=volume,
+            unit='ns',
+            user_id='test_user',
+            project_id='test_proj',
+            resource_id=resource_id,
+            timestamp=timestamp,
+            resource_metadata={},
+        )
+
+    def test_rate_of_change_datetime_and_epoch_timestamps(self):
+        pipe = self._rate_of_change_pipeline()
+        now = datetime.datetime(2014, 1, 1)
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 100, now),
+            self._cpu_sample('test_resource', 160,
+                             now + datetime.timedelta(seconds=60)),
+            self._cpu_sample('test_resource', 280, 1388534520),
+        ])
+        publisher = pipe.publishers[0]
+        self.assertEqual([1.0, 2.0], [s.volume for s in publisher.samples])
+
+    def test_rate_of_change_cache_ttl(self):
+        pipe = self._rate_of_change_pipeline(cache_ttl=600)
+        now = datetime.datetime(2014, 1, 1)
+        later = now + datetime.timedelta(seconds=900)
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 100, now),
+            self._cpu_sample('test_resource2', 100, now),
+            self._cpu_sample('test_resource2', 1000, later),
+        ])
+        transformer = pipe.sink.transformers[0]
+        self.assertEqual(2, len(transformer.cache))
+        pipe.flush(None)
+        self.assertEqual(['cputest_resource2'], list(transformer.cache))
+
+    def test_rate_of_change_cache_size(self):
+        pipe = self._rate_of_change_pipeline(cache_size=2)
+        now = datetime.datetime(2014, 1, 1)
+        later = now + datetime.timedelta(seconds=60)
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 100, now),
+            self._cpu_sample('test_resource2', 100, now),
+            self._cpu_sample('test_resource3', 100, now),
+            self._cpu_sample('test_resource', 160, later),
+            self._cpu_sample('test_resource3', 160, later),
+        ])
+        publisher = pipe.publishers[0]
+        self.assertEqual(['test_resource3'],
+                         [s.resource_id for s in publisher.samples])
+
+    def test_rate_of_change_snapshot(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'snapshot')
+        now = timeutils.utcnow()
+        pipe = self._rate_of_change_pipeline(snapshot_path=path)
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 100, now),
+        ])
+        pipe.flush(None)
+        self.assertTrue(os.path.exists(path))
+
+        pipe = self._rate_of_change_pipeline(snapshot_path=path)
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 160,
+                             now + datetime.timedelta(seconds=60)),
+        ])
+        publisher = pipe.publishers[0]
+        self.assertEqual([1.0], [s.volume for s in publisher.samples])
+
+    def test_rate_of_change_snapshot_corrupted(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'snapshot')
+        with open(path, 'w') as f:
+            f.write('not json')
+        pipe = self._rate_of_change_pipeline(snapshot_path=path)
+        self.assertEqual(0, len(pipe.sink.transformers[0].cache))
+
+    def test_scale_expression_compiled_once(self):
+        transformer = conversions.ScalingTransformer(
+            target={'scale': 'volume * (resource_metadata.get("cpus", 2))'})
+        counter = self._cpu_sample('test_resource', 10, timeutils.utcnow())
+        with mock.patch.object(conversions, 'compile_scale') as compile_scale:
+            self.assertEqual(20, transformer._scale(counter))
+            self.assertEqual(20, transformer._scale(counter))
+        self.assertFalse(compile_scale.called)
+
+    def test_scale_expression_constant(self):
+        transformer = conversions.ScalingTransformer(
+            target={'scale': '100.0 / 10'})
+        counter = self._cpu_sample('test_resource', 10, timeutils.utcnow())
+        self.assertEqual(10.0, transformer._scale(counter))
+
+    def test_scale_expression_builtins(self):
+        transformer = conversions.ScalingTransformer(
+            target={'scale': 'min(float(volume) / 3, 100)'})
+        counter = self._cpu_sample('test_resource', 10, timeutils.utcnow())
+        self.assertEqual(10 / 3.0, transformer._scale(counter))
+        transformer = conversions.ScalingTransformer(
+            target={'scale': 'round(abs(-2.4))'})
+        self.assertEqual(2, transformer._scale(counter))
+
+    def test_scale_expression_restricted(self):
+        for scale in ("__import__('os').getcwd()",
+                      "volume.__class__",
+                      "resource_metadata.get.im_func",
+                      "resource_metadata.get.func_globals",
+                      "len(resource_metadata)",
+                      "max(volume, key=abs)",
+                      "resource_metadata.keys()",
+                      "[volume for i in (1, 2)]",
+                      "volume *"):
+            self.assertRaises(ValueError, conversions.ScalingTransformer,
+                              target={'scale': scale})
+
+    def test_map_invalid_pattern(self):
+        transformer = conversions.ScalingTransformer(
+            source={'map_from': {'name': '(cpu', 'unit': '(ns)'}},
+            target={'map_to': {'name': 'cpu_util', 'unit': '\\1/s'}})
+        counter = self._cpu_sample('test_resource', 10, timeutils.utcnow())
+        self.assertEqual(['unit'], list(transformer.mappings))
+        self.assertEqual('cpu', transformer._map(counter, 'name'))
+        self.assertEqual('ns/s', transformer._map(counter, 'unit'))
+
     def test_resources(self):
         resources = ['test1://', 'test2://']
         self._set_pipeline_cfg('resources', resources)
@@ -1441,3 +1681,110 @@ class BasePipelineTestCase(test.BaseTestCase):
         pipe.flush(None)
         publisher = pipeline_manager.pipelines[0].publishers[0]
         self.assertEqual(1, len(publisher.samples))
+
+    def test_aggregator_max(self):
+        samples = self._do_test_aggregator({
+            'resource_metadata': 'drop',
+            'user_id': 'last',
+            'project_id': 'last',
+            'aggregation': 'max',
+        }, expected_length=1)
+        self.assertEqual(53, samples[0].volume)
+
+    def test_aggregator_mean(self):
+        samples = self._do_test_aggregator({
+            'resource_metadata': 'drop',
+            'user_id': 'last',
+            'project_id': 'last',
+            'aggregation': 'mean',
+        }, expected_length=1)
+        self.assertEqual(154 / 6.0, samples[0].volume)
+
+    def _windowed_aggregator(self, **parameters):
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.set_time_override(datetime.datetime(2014, 1, 1))
+        self._set_pipeline_cfg('transformers', [{'name': 'aggregator',
+                                                 'parameters': parameters}])
+        self._set_pipeline_cfg('counters', ['cpu'])
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        return pipeline_manager.pipelines[0]
+
+    def test_aggregator_tumbling_window(self):
+        pipe = self._windowed_aggregator(window=60, aggregation='max')
+        now = timeutils.utcnow()
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 26, now),
+            self._cpu_sample('test_resource', 16, now),
+        ])
+        pipe.flush(None)
+        publisher = pipe.publishers[0]
+        self.assertEqual(0, len(publisher.samples))
+
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        self.assertEqual([26], [s.volume for s in publisher.samples])
+        end = timeutils.parse_isotime(publisher.samples[0].timestamp)
+        self.assertTrue(now < timeutils.normalize_time(end) <=
+                        timeutils.utcnow())
+        self.assertEqual({}, pipe.sink.transformers[0].windows)
+
+    def test_aggregator_sliding_window(self):
+        pipe = self._windowed_aggregator(window=120, slide=60,
+                                         aggregation='mean')
+        now = timeutils.utcnow()
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 10, now),
+            self._cpu_sample('test_resource', 20, now),
+        ])
+        transformer = pipe.sink.transformers[0]
+        self.assertEqual(2, len(transformer.windows))
+
+        publisher = pipe.publishers[0]
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        self.assertEqual([15.0], [s.volume for s in publisher.samples])
+
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        self.assertEqual([15.0, 15.0], [s.volume for s in publisher.samples])
+        self.assertEqual([], transformer.window_ends)
+
+    def test_aggregator_window_late_sample(self):
+        pipe = self._windowed_aggregator(window=60)
+        now = timeutils.utcnow()
+        pipe.publish_samples(None, [self._cpu_sample('test_resource', 10,
+                                                     now)])
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        publisher = pipe.publishers[0]
+        self.assertEqual([10], [s.volume for s in publisher.samples])
+
+        pipe.publish_samples(None, [self._cpu_sample('test_resource', 5,
+                                                     now)])
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        transformer = pipe.sink.transformers[0]
+        self.assertEqual([10], [s.volume for s in publisher.samples])
+        self.assertEqual(1, transformer.late_samples)
+        self.assertEqual({}, transformer.windows)
+
+        # the flushed windows are forgotten once every sample is late
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        self.assertEqual({}, transformer.flushed)
+
+    def test_aggregator_windows_by_key(self):
+        pipe = self._windowed_aggregator(window=60)
+        now = timeutils.utcnow()
+        pipe.publish_samples(None, [
+            self._cpu_sample('test_resource', 10, now),
+            self._cpu_sample('test_resource2', 20, now),
+            self._cpu_sample('test_resource', 5, now),
+        ])
+        timeutils.advance_time_seconds(60)
+        pipe.flush(None)
+        publisher = pipe.publishers[0]
+        self.assertEqual([('test_resource', 15), ('test_resource2', 20)],
+                         sorted((s.resource_id, s.volume)
+                                for s in publisher.samples))
@@ -0,0 +1,103 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Tests for ceilometer/publisher/diskqueue.py
+"""
+import os
+
+import fixtures
+
+from ceilometer.openstack.common import test
+from ceilometer.publisher import diskqueue
+
+
+class TestSegmentQueue(test.BaseTestCase):
+    def setUp(self):
+        super(TestSegmentQueue, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if name.endswith(diskqueue.SEGMENT_SUFFIX))
+
+    def test_fifo(self):
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024)
+        self.assertTrue(q.empty())
+        for i in range(5):
+            q.append({'i': i})
+        self.assertFalse(q.empty())
+        self.assertEqual([{'i': 0}, {'i': 1}], q.peek(2))
+        q.commit(2)
+        self.assertEqual([{'i': 2}, {'i': 3}, {'i': 4}], q.peek(10))
+        q.commit(1)
+        self.assertEqual([{'i': 3}, {'i': 4}], q.peek(10))
+        q.commit(2)
+        self.assertTrue(q.empty())
+        self.assertEqual([], q.peek(10))
+
+    def test_peek_without_commit(self):
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024)
+        q.append([1])
+        self.assertEqual([[1]], q.peek(10))
+        self.assertEqual([[1]], q.peek(10))
+
+    def test_segments(self):
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024, segment_size=32)
+        for i in range(10):
+            q.append('entry-%d' % i)
+        self.assertTrue(len(self._segments()) > 1)
+        self.assertEqual(['entry-%d' % i for i in range(10)], q.peek(20))
+        q.commit(10)
+        self.assertEqual(1, len(self._segments()))
+        self.assertTrue(q.empty())
+
+    def test_resume_after_restart(self):
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024, segment_size=32)
+        for i in range(10):
+            q.append(i)
+        q.peek(4)
+        q.commit(4)
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024, segment_size=32)
+        q.append(10)
+        self.assertEqual(range(4, 11), q.peek(20))
+
+    def test_truncated_entry(self):
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024)
+        q.append('complete')
+        q.append('truncated')
+        path = os.path.join(self.path, self._segments()[0])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 2)
+        q = diskqueue.SegmentQueue(self.path, 1024 * 1024)
+        q.append('next')
+        self.assertEqual(['complete', 'next'], q.peek(10))
+
+    def test_byte_budget(self):
+        q = diskqueue.SegmentQueue(self.path, 64, segment_size=32)
+        for i in range(20):
+            q.append('entry-%02d' % i)
+        self.assertTrue(q.size <= 64 + 32)
+        entries = q.peek(20)
+        self.assertEqual('entry-19', entries[-1])
+        self.assertNotIn('entry-00', entries)
+        self.assertEqual(sorted(entries), entries)
+
+    def test_commit_after_budget_dropped_peeked(self):
+        q = diskqueue.SegmentQueue(self.path, 64, segment_size=32)
+        for i in range(4):
+            q.append('entry-%02d' % i)
+        self.assertEqual(['entry-%02d' % i for i in range(4)], q.peek(4))
+        # the first segment, holding 3 of the peeked entries, is dropped
+        q.append('entry-04')
+        q.append('entry-05')
+        q.commit(4)
+        self.assertEqual(['entry-04', 'entry-05'], q.peek(10))
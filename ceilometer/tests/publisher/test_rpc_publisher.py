@@ -18,8 +18,10 @@
 """Tests for ceilometer/publisher/rpc.py
 """
 import datetime
+import os
 
 import eventlet
+import fixtures
 import mock
 import oslo.messaging
 import oslo.messaging._drivers.common
@@ -299,6 +301,26 @@ class TestPublish(tests_base.BaseTestCase):
                         mock.call(topic=topic)]
             self.assertEqual(expected, prepare.mock_calls)
 
+    def test_published_with_policy_queue_merged(self):
+        publisher = rpc.RPCPublisher(
+            network_utils.urlsplit('rpc://?policy=queue'))
+        ctxt = context.RequestContext(user='user', tenant='tenant')
+        side_effect = oslo.messaging._drivers.common.RPCException()
+        with mock.patch.object(publisher.rpc_client, 'prepare') as prepare:
+            prepare.side_effect = side_effect
+            for i in range(3):
+                publisher.publish_samples(ctxt, self.test_data)
+            self.assertEqual(1, len(publisher.local_queue))
+
+            prepare.side_effect = None
+            publisher.publish_samples(ctxt, self.test_data)
+
+        self.assertEqual(0, len(publisher.local_queue))
+        prepare.return_value.cast.assert_called_once_with(
+            ctxt, 'record_metering_data', data=mock.ANY)
+        cast = prepare.return_value.cast.call_args
+        self.assertEqual(4 * len(self.test_data), len(cast[1]['data']))
+
     def test_published_with_policy_sized_queue_and_rpc_down(self):
         publisher = rpc.RPCPublisher(
             network_utils.urlsplit('rpc://?policy=queue&max_queue_length=3'))
@@ -348,3 +370,78 @@ class TestPublish(tests_base.BaseTestCase):
             'test-1999',
             publisher.local_queue[1023][2][0]['source']
         )
+
+    def _make_disk_queue_publisher(self):
+        self.queue_path = self.useFixture(fixtures.TempDir()).path
+        return rpc.RPCPublisher(network_utils.urlsplit(
+            'rpc://?policy=queue&queue_path=%s' % self.queue_path))
+
+    def test_published_with_disk_queue_and_rpc_down(self):
+        publisher = self._make_disk_queue_publisher()
+        side_effect = oslo.messaging._drivers.common.RPCException()
+        with mock.patch.object(publisher.rpc_client, 'prepare') as prepare:
+            prepare.side_effect = side_effect
+            publisher.publish_samples(context.RequestContext(),
+                                      self.test_data)
+        self.assertEqual(0, len(publisher.local_queue))
+        self.assertFalse(publisher.disk_queue.empty())
+
+        # a restarted publisher finds the queued samples
+        publisher = rpc.RPCPublisher(network_utils.urlsplit(
+            'rpc://?policy=queue&queue_path=%s' % self.queue_path))
+        self.assertFalse(publisher.disk_queue.empty())
+
+    def test_disk_queue_without_auth_token(self):
+        publisher = self._make_disk_queue_publisher()
+        ctxt = context.RequestContext(auth_token='secret-token', user='user')
+        side_effect = oslo.messaging._drivers.common.RPCException()
+        with mock.patch.object(publisher.rpc_client, 'prepare') as prepare:
+            prepare.side_effect = side_effect
+            publisher.publish_samples(ctxt, self.test_data)
+        for name in os.listdir(self.queue_path):
+            with open(os.path.join(self.queue_path, name), 'rb') as f:
+                self.assertNotIn('secret-token', f.read())
+        entry_context = publisher.disk_queue.peek(1)[0][0]
+        self.assertEqual('user', entry_context['user'])
+        self.assertNotIn('auth_token', entry_context)
+
+    def test_published_with_disk_queue_and_rpc_down_up(self):
+        publisher = self._make_disk_queue_publisher()
+        ctxt = context.RequestContext(user='user', tenant='tenant')
+        side_effect = oslo.messaging._drivers.common.RPCException()
+        with mock.patch.object(publisher.rpc_client, 'prepare') as prepare:
+            prepare.side_effect = side_effect
+            for i in range(3):
+                for s in self.test_data:
+                    s.source = 'test-%d' % i
+                publisher.publish_samples(ctxt, self.test_data)
+            self.assertEqual(3, prepare.call_count)
+
+            prepare.reset_mock()
+            prepare.side_effect = None
+            for s in self.test_data:
+                s.source = 'test-3'
+            publisher.publish_samples(ctxt, self.test_data)
+
+        # the queued samples are replayed in order, in a single cast with
+        # the new samples queued after them
+        self.assertTrue(publisher.disk_queue.empty())
+        prepare.return_value.cast.assert_called_once_with(
+            mock.ANY, 'record_metering_data', data=mock.ANY)
+        cast = prepare.return_value.cast.call_args
+        self.assertEqual('user', cast[0][0].user)
+        self.assertEqual(
+            ['test-%d' % i for i in range(4) for s in self.test_data],
+            [m['source'] for m in cast[1]['data']])
+
+    def test_published_with_disk_queue_replay_interrupted(self):
+        publisher = self._make_disk_queue_publisher()
+        side_effect = oslo.messaging._drivers.common.RPCException()
+        with mock.patch.object(publisher.rpc_client, 'prepare') as prepare:
+            prepare.side_effect = side_effect
+            publisher.publish_samples(context.RequestContext(),
+                                      self.test_data)
+            publisher.publish_samples(context.RequestContext(),
+                                      self.test_data)
+            # the queued samples are still there, followed by the new ones
+            self.assertEqual(2, len(publisher.disk_queue.peek(10)))
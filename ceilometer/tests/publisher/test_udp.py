@@ -139,6 +139,46 @@ class TestUDPPublisher(test.BaseTestCase):
             [utils.meter_message_from_counter(d, "not-so-secret")
              for d in self.test_data]), sorted(sent_counters))
 
+    def test_published_batch(self):
+        self.data_sent = []
+        with mock.patch('socket.socket',
+                        self._make_fake_socket(self.data_sent)):
+            publisher = udp.UDPPublisher(
+                network_utils.urlsplit('udp://somehost?batch=1'))
+        publisher.publish_samples(None,
+                                  self.test_data)
+
+        self.assertEqual(1, len(self.data_sent))
+        data, dest = self.data_sent[0]
+        self.assertEqual(('somehost', self.CONF.collector.udp_port), dest)
+        self.assertEqual(
+            [utils.meter_message_from_counter(d, "not-so-secret")
+             for d in self.test_data],
+            msgpack.loads(data))
+
+    def test_published_batch_max_datagram_size(self):
+        size = max(len(msgpack.dumps(utils.meter_message_from_counter(
+            d, "not-so-secret"))) for d in self.test_data)
+        self.data_sent = []
+        with mock.patch('socket.socket',
+                        self._make_fake_socket(self.data_sent)):
+            publisher = udp.UDPPublisher(network_utils.urlsplit(
+                'udp://somehost?batch=1&max_datagram_size=%d' %
+                (size * 2 + udp.ARRAY_HEADER_SIZE)))
+        publisher.publish_samples(None,
+                                  self.test_data)
+
+        self.assertEqual(3, len(self.data_sent))
+        sent_counters = []
+        for data, dest in self.data_sent:
+            counters = msgpack.loads(data)
+            self.assertTrue(len(counters) <= 2)
+            sent_counters.extend(counters)
+        self.assertEqual(
+            [utils.meter_message_from_counter(d, "not-so-secret")
+             for d in self.test_data],
+            sent_counters)
+
     @staticmethod
     def _raise_ioerror(*args):
         raise IOError
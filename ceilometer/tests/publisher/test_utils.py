@@ -22,6 +22,7 @@
 from ceilometer.openstack.common import jsonutils
 from ceilometer.openstack.common import test
 from ceilometer.publisher import utils
+from ceilometer import sample
 
 
 class TestSignature(test.BaseTestCase):
@@ -100,3 +101,80 @@ class TestSignature(test.BaseTestCase):
             'not-so-secret')
         jsondata = jsonutils.loads(jsonutils.dumps(data))
         self.assertTrue(utils.verify_signature(jsondata, 'not-so-secret'))
+
+    def test_compute_signature_versioned(self):
+        sig = utils.compute_signature({'a': 'A', 'b': 'B'}, 'not-so-secret')
+        self.assertTrue(sig.startswith(utils.SIGNATURE_PREFIX))
+
+    def test_compute_signature_key_order(self):
+        sig1 = utils.compute_signature({'a': 'A', 'b': {'c': 1, 'd': 2}},
+                                       'not-so-secret')
+        sig2 = utils.compute_signature({'b': {'d': 2, 'c': 1}, 'a': 'A'},
+                                       'not-so-secret')
+        self.assertEqual(sig1, sig2)
+
+    def test_verify_signature_legacy(self):
+        data = {'a': 'A',
+                'b': 'B',
+                'nested': {'a': 'A',
+                           'b': 'B',
+                           'c': [{'d': 'D', 'e': 'E'}],
+                           },
+                }
+        data['message_signature'] = utils.compute_legacy_signature(
+            data,
+            'not-so-secret')
+        self.assertFalse(data['message_signature'].startswith(
+            utils.SIGNATURE_PREFIX))
+        jsondata = jsonutils.loads(jsonutils.dumps(data))
+        self.assertTrue(utils.verify_signature(jsondata, 'not-so-secret'))
+
+    def test_verify_signature_legacy_incorrect(self):
+        data = {'a': 'A', 'b': 'B'}
+        data['message_signature'] = utils.compute_legacy_signature(
+            data,
+            'not-so-secret')
+        data['b'] = 'C'
+        self.assertFalse(utils.verify_signature(data, 'not-so-secret'))
+
+    def test_verify_signature_not_a_string(self):
+        data = {'a': 'A', 'b': 'B', 'message_signature': 42}
+        self.assertFalse(utils.verify_signature(data, 'not-so-secret'))
+
+
+class TestMeterMessage(test.BaseTestCase):
+    def setUp(self):
+        super(TestMeterMessage, self).setUp()
+        self.sample = sample.Sample(
+            name='test',
+            type=sample.TYPE_CUMULATIVE,
+            unit='',
+            volume=1,
+            user_id='test',
+            project_id='test',
+            resource_id='test_run_tasks',
+            timestamp='2012-05-08T20:23:48.028195',
+            resource_metadata={'name': 'TestPublish'},
+        )
+
+    def test_meter_message_verified(self):
+        msg = utils.meter_message_from_counter(self.sample, 'not-so-secret')
+        jsondata = jsonutils.loads(jsonutils.dumps(msg))
+        self.assertTrue(utils.verify_signature(jsondata, 'not-so-secret'))
+
+    def test_meter_message_sample_changed(self):
+        msg1 = utils.meter_message_from_counter(self.sample, 'not-so-secret')
+        self.sample.volume = 2
+        msg2 = utils.meter_message_from_counter(self.sample, 'not-so-secret')
+        self.assertEqual(2, msg2['counter_volume'])
+        self.assertNotEqual(msg1['message_signature'],
+                            msg2['message_signature'])
+        self.assertTrue(utils.verify_signature(msg2, 'not-so-secret'))
+
+    def test_meter_message_other_secret(self):
+        msg1 = utils.meter_message_from_counter(self.sample, 'not-so-secret')
+        msg2 = utils.meter_message_from_counter(self.sample,
+                                                'different-value')
+        self.assertNotEqual(msg1['message_signature'],
+                            msg2['message_signature'])
+        self.assertTrue(utils.verify_signature(msg2, 'different-value'))
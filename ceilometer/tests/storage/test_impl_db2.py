@@ -23,8 +23,13 @@
 
 """
 
+import datetime
+
+from ceilometer import storage
 from ceilometer.storage import impl_db2
 from ceilometer.tests import base as test_base
+from ceilometer.tests import db as tests_db
+from ceilometer.tests.storage import test_storage_scenarios
 
 
 class CapabilitiesTest(test_base.BaseTestCase):
@@ -53,13 +58,13 @@ class CapabilitiesTest(test_base.BaseTestCase):
                                      'complex': False},
                            'aggregation': {'standard': True,
                                            'selectable': {
-                                               'max': False,
-                                               'min': False,
-                                               'sum': False,
-                                               'avg': False,
-                                               'count': False,
-                                               'stddev': False,
-                                               'cardinality': False}}
+                                               'max': True,
+                                               'min': True,
+                                               'sum': True,
+                                               'avg': True,
+                                               'count': True,
+                                               'stddev': True,
+                                               'cardinality': True}}
                            },
             'alarms': {'query': {'simple': True,
                                  'complex': True},
@@ -73,7 +78,52 @@ class CapabilitiesTest(test_base.BaseTestCase):
 
     def test_storage_capabilities(self):
         expected_capabilities = {
-            'storage': {'production_ready': True},
+            'storage': {'production_ready': True,
+                        'rollups': False},
         }
         actual_capabilities = impl_db2.Connection.get_storage_capabilities()
         self.assertEqual(expected_capabilities, actual_capabilities)
+
+
+class Aggregate(object):
+    def __init__(self, func, param=None):
+        self.func = func
+        self.param = param
+
+
+@tests_db.run_with('db2')
+class FoldedStatisticsTest(test_storage_scenarios.DBTestBase):
+
+    def _compare_with_pipeline(self, *args, **kwargs):
+        if not self.conn.aggregation_pipeline:
+            self.skipTest('MongoDB 2.6 is required by the pipeline')
+        results = [r.as_dict()
+                   for r in self.conn.get_meter_statistics(*args, **kwargs)]
+        self.conn.aggregation_pipeline = False
+        try:
+            expected = [r.as_dict() for r in
+                        self.conn.get_meter_statistics(*args, **kwargs)]
+        finally:
+            self.conn.aggregation_pipeline = True
+        self.assertTrue(expected)
+        self.assertEqual(expected, results)
+
+    def test_statistics_period_groupby(self):
+        f = storage.SampleFilter(meter='instance')
+        self._compare_with_pipeline(f, period=60, groupby=['resource_id'])
+
+    def test_statistics_selectable_aggregates(self):
+        f = storage.SampleFilter(meter='instance')
+        aggregate = [Aggregate('stddev'),
+                     Aggregate('cardinality', 'resource_id')]
+        self._compare_with_pipeline(f, period=60, aggregate=aggregate)
+
+    def test_statistics_period_start_filtered(self):
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2010, 1, 1, 0, 0, 30),
+            name='other-meter')
+        self.conn.aggregation_pipeline = False
+        f = storage.SampleFilter(meter='instance')
+        results = list(self.conn.get_meter_statistics(f, period=60))
+        self.assertEqual(datetime.datetime(2011, 5, 30, 18, 3),
+                         results[0].period_start)
@@ -23,9 +23,12 @@
   running the tests. Make sure the Thrift server is running on that server.
 
 """
+import datetime
+
 import mock
 
 from ceilometer.storage.hbase import inmemory as hbase_inmemory
+from ceilometer.storage.hbase import utils as hbase_utils
 from ceilometer.storage import impl_hbase as hbase
 from ceilometer.tests import base as test_base
 from ceilometer.tests import db as tests_db
@@ -56,6 +59,16 @@ class ConnectionTest(tests_db.TestBase,
         self.assertIsInstance(conn.conn_pool, TestConn)
 
 
+class UtilsTest(test_base.BaseTestCase):
+
+    def test_timestamp_from_meter_rowkey(self):
+        ts = datetime.datetime(2013, 8, 1, 10, 11, 12, 345678)
+        row = "%s_%d_%s" % ('disk.write_bytes', hbase_utils.timestamp(ts),
+                            'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEqual(hbase_utils.timestamp(ts, reverse=False),
+                         hbase_utils.timestamp_from_meter_rowkey(row))
+
+
 class CapabilitiesTest(test_base.BaseTestCase):
     # Check the returned capabilities list, which is specific to each DB
     # driver
@@ -76,19 +89,19 @@ class CapabilitiesTest(test_base.BaseTestCase):
                                   'metadata': True,
                                   'complex': False}},
             'statistics': {'pagination': False,
-                           'groupby': False,
+                           'groupby': True,
                            'query': {'simple': True,
                                      'metadata': True,
                                      'complex': False},
                            'aggregation': {'standard': True,
                                            'selectable': {
-                                               'max': False,
-                                               'min': False,
-                                               'sum': False,
-                                               'avg': False,
-                                               'count': False,
-                                               'stddev': False,
-                                               'cardinality': False}}
+                                               'max': True,
+                                               'min': True,
+                                               'sum': True,
+                                               'avg': True,
+                                               'count': True,
+                                               'stddev': True,
+                                               'cardinality': True}}
                            },
             'alarms': {'query': {'simple': True,
                                  'complex': False},
@@ -102,7 +115,8 @@ class CapabilitiesTest(test_base.BaseTestCase):
 
     def test_storage_capabilities(self):
         expected_capabilities = {
-            'storage': {'production_ready': True},
+            'storage': {'production_ready': True,
+                        'rollups': False},
         }
         actual_capabilities = hbase.Connection.get_storage_capabilities()
         self.assertEqual(expected_capabilities, actual_capabilities)
@@ -23,6 +23,11 @@
 
 """
 
+import datetime
+
+import mock
+
+from ceilometer import storage
 from ceilometer.storage import base
 from ceilometer.storage import impl_mongodb
 from ceilometer.tests import base as test_base
@@ -81,6 +86,50 @@ class MongoDBTestMarkerBase(test_storage_scenarios.DBTestBase):
             self.assertTrue(True)
 
 
+@tests_db.run_with('mongodb')
+class AggregationPipelineTest(test_storage_scenarios.DBTestBase):
+
+    def setUp(self):
+        super(AggregationPipelineTest, self).setUp()
+        if not self.conn.aggregation_pipeline:
+            self.skipTest('MongoDB 2.6 is required by the pipeline')
+
+    def _compare_with_map_reduce(self, method, *args, **kwargs):
+        results = [r.as_dict() for r in method(*args, **kwargs)]
+        self.conn.aggregation_pipeline = False
+        try:
+            expected = [r.as_dict() for r in method(*args, **kwargs)]
+        finally:
+            self.conn.aggregation_pipeline = True
+        self.assertTrue(expected)
+        key = lambda r: (r.get('period_start'), r.get('resource_id'))
+        self.assertEqual(sorted(expected, key=key), sorted(results, key=key))
+
+    def test_statistics_period(self):
+        f = storage.SampleFilter(meter='instance')
+        self._compare_with_map_reduce(self.conn.get_meter_statistics,
+                                      f, period=60)
+
+    def test_statistics_period_groupby(self):
+        f = storage.SampleFilter(meter='instance')
+        self._compare_with_map_reduce(self.conn.get_meter_statistics,
+                                      f, period=3600 * 24,
+                                      groupby=['resource_id', 'source'])
+
+    def test_statistics_cardinality(self):
+        f = storage.SampleFilter(meter='instance')
+        aggregate = [mock.Mock(func='cardinality', param='resource_id'),
+                     mock.Mock(func='max', param=None)]
+        self._compare_with_map_reduce(self.conn.get_meter_statistics,
+                                      f, period=3600 * 24,
+                                      aggregate=aggregate)
+
+    def test_time_constrained_resources(self):
+        self._compare_with_map_reduce(
+            self.conn.get_resources,
+            start_timestamp=datetime.datetime(2012, 7, 2, 10, 42))
+
+
 @tests_db.run_with('mongodb')
 class IndexTest(tests_db.TestBase):
     def test_meter_ttl_index_absent(self):
@@ -186,7 +235,8 @@ class CapabilitiesTest(test_base.BaseTestCase):
 
     def test_storage_capabilities(self):
         expected_capabilities = {
-            'storage': {'production_ready': True},
+            'storage': {'production_ready': True,
+                        'rollups': False},
         }
         actual_capabilities = impl_mongodb.Connection.\
             get_storage_capabilities()
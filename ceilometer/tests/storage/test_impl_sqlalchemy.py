@@ -27,7 +27,10 @@ import repr
 
 import mock
 
+from ceilometer.openstack.common.db import exception as dbexc
 from ceilometer.openstack.common import timeutils
+from ceilometer import storage
+from ceilometer.storage import base
 from ceilometer.storage import impl_sqlalchemy
 from ceilometer.storage import models
 from ceilometer.storage.sqlalchemy import models as sql_models
@@ -192,6 +195,336 @@ class RelationshipTest(scenarios.DBTestBase):
                                      .group_by(sql_models.Sample.id))).count()
                                  ))
 
+    @mock.patch.object(timeutils, 'utcnow')
+    def test_clear_metering_data_meta_tables_chunked(self, mock_utcnow):
+        mock_utcnow.return_value = datetime.datetime(2012, 7, 2, 10, 45)
+        with mock.patch('time.sleep') as sleep:
+            self.conn.clear_expired_metering_data(3 * 60, chunk_size=2,
+                                                  throttle=0.5)
+        # six expired samples, deleted in three chunks and a last empty one
+        self.assertEqual([mock.call(0.5)] * 3, sleep.call_args_list)
+
+        session = self.conn._engine_facade.get_session()
+        meta_tables = [sql_models.MetaText, sql_models.MetaFloat,
+                       sql_models.MetaBigInt, sql_models.MetaBool]
+        for table in meta_tables:
+            self.assertEqual(0, (session.query(table)
+                                 .filter(~table.id.in_(
+                                     session.query(sql_models.Sample.id)
+                                     .group_by(sql_models.Sample.id))).count()
+                                 ))
+
+
+@tests_db.run_with('sqlite')
+class MeterCacheTest(scenarios.DBTestBase):
+
+    def test_cache_filled_by_recording(self):
+        # all samples of prepare_data() share the same meter definition
+        self.assertEqual(1, len(self.conn.meter_cache))
+        self.assertTrue(self.conn.meter_cache.hits > 0)
+
+    def test_cache_avoids_meter_lookup(self):
+        with mock.patch.object(self.conn, '_create_meter') as create_meter:
+            self.create_and_store_sample()
+        self.assertFalse(create_meter.called)
+
+    def test_cache_not_filled_on_rollback(self):
+        with mock.patch.object(self.conn, '_insert_metadata_rows',
+                               side_effect=MyException("Boom")):
+            self.assertRaises(MyException, self.create_and_store_sample,
+                              name='new.meter')
+        self.assertIsNone(
+            self.conn.meter_cache.get(('new.meter', 'cumulative', '')))
+
+    def test_cache_loaded_on_first_use(self):
+        self.conn.meter_cache = impl_sqlalchemy.MeterCache(16)
+        self.create_and_store_sample()
+        self.assertTrue(self.conn.meter_cache.loaded)
+        self.assertEqual(1, self.conn.meter_cache.hits)
+        self.assertEqual(0, self.conn.meter_cache.misses)
+
+    def test_cache_invalidated_on_clear(self):
+        self.conn.clear()
+        self.assertEqual(0, len(self.conn.meter_cache))
+        self.assertFalse(self.conn.meter_cache.loaded)
+
+    def test_cache_bounded(self):
+        cache = impl_sqlalchemy.MeterCache(2)
+        for i in range(5):
+            cache.set(('meter-%d' % i, 'gauge', ''), i)
+        self.assertEqual(2, len(cache))
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = impl_sqlalchemy.MeterCache(2)
+        cache.set(('meter-0', 'gauge', ''), 0)
+        cache.set(('meter-1', 'gauge', ''), 1)
+        self.assertEqual(0, cache.get(('meter-0', 'gauge', '')))
+        cache.set(('meter-2', 'gauge', ''), 2)
+        self.assertEqual(0, cache.get(('meter-0', 'gauge', '')))
+        self.assertIsNone(cache.get(('meter-1', 'gauge', '')))
+        self.assertEqual(2, cache.get(('meter-2', 'gauge', '')))
+
+    def test_cache_disabled(self):
+        cache = impl_sqlalchemy.MeterCache(0)
+        cache.set(('meter', 'gauge', ''), 1)
+        self.assertIsNone(cache.get(('meter', 'gauge', '')))
+        self.assertEqual(1, cache.misses)
+
+
+@tests_db.run_with('sqlite')
+class PeriodStatisticsTest(scenarios.DBTestBase):
+
+    def _compare_with_per_period_queries(self, sample_filter, period,
+                                         groupby=None):
+        results = list(self.conn.get_meter_statistics(sample_filter,
+                                                      period=period,
+                                                      groupby=groupby))
+        with mock.patch.dict(impl_sqlalchemy.PERIOD_BUCKETS, clear=True):
+            expected = list(self.conn.get_meter_statistics(sample_filter,
+                                                           period=period,
+                                                           groupby=groupby))
+        self.assertTrue(expected)
+        self.assertEqual([e.as_dict() for e in expected],
+                         [r.as_dict() for r in results])
+
+    def test_period(self):
+        f = storage.SampleFilter(meter='instance')
+        self._compare_with_per_period_queries(f, 60)
+
+    def test_period_start_end(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2, 10, 40, 30),
+            end=datetime.datetime(2012, 7, 2, 10, 43, 30))
+        self._compare_with_per_period_queries(f, 60)
+
+    def test_period_groupby(self):
+        f = storage.SampleFilter(meter='instance')
+        self._compare_with_per_period_queries(f, 3600 * 24,
+                                              groupby=['resource_id'])
+
+    def test_period_single_query(self):
+        f = storage.SampleFilter(meter='instance')
+        with mock.patch.object(self.conn,
+                               '_get_period_statistics_per_query') as loop:
+            list(self.conn.get_meter_statistics(f, period=60))
+        self.assertFalse(loop.called)
+
+
+@tests_db.run_with('sqlite')
+class ResourceSummaryTest(scenarios.DBTestBase):
+
+    def _from_samples(self, **kwargs):
+        args = dict(user=None, project=None, source=None,
+                    start_timestamp=None, start_timestamp_op=None,
+                    end_timestamp=None, end_timestamp_op=None,
+                    metaquery=None, resource=None)
+        args.update(kwargs)
+        return sorted((r.as_dict() for r in
+                       self.conn._get_resources_from_samples(**args)),
+                      key=lambda r: r['resource_id'])
+
+    def _from_summary(self, **kwargs):
+        return sorted((r.as_dict() for r in
+                       self.conn.get_resources(**kwargs)),
+                      key=lambda r: r['resource_id'])
+
+    def test_summary_matches_samples(self):
+        self.assertEqual(self._from_samples(), self._from_summary())
+
+    def test_summary_matches_samples_filtered(self):
+        self.assertEqual(self._from_samples(user='user-id'),
+                         self._from_summary(user='user-id'))
+        self.assertEqual(self._from_samples(source='test-2'),
+                         self._from_summary(source='test-2'))
+
+    def test_summary_used_without_time_constraints(self):
+        with mock.patch.object(self.conn,
+                               '_get_resources_from_samples') as samples:
+            list(self.conn.get_resources(user='user-id'))
+        self.assertFalse(samples.called)
+
+    def test_summary_updated_by_older_sample(self):
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2012, 7, 2, 10, 0),
+            metadata={'tag': 'older'})
+        self.assertEqual(self._from_samples(), self._from_summary())
+
+    def test_summary_unique(self):
+        session = self.conn._engine_facade.get_session()
+        row = session.query(sql_models.Resource).filter(
+            sql_models.Resource.user_id == 'user-id').first()
+
+        def add_duplicate():
+            with session.begin():
+                session.add(sql_models.Resource(
+                    resource_id=row.resource_id,
+                    user_id=row.user_id,
+                    project_id=row.project_id,
+                    source_id=row.source_id))
+
+        self.assertRaises(dbexc.DBDuplicateEntry, add_duplicate)
+
+    def test_pagination_with_time_constraints(self):
+        start = datetime.datetime(2010, 1, 1)
+        for sort_dir in ['asc', 'desc']:
+            pagination = base.Pagination(limit=3, primary_sort_dir=sort_dir,
+                                         sort_keys=['user_id'],
+                                         marker_value='resource-id-4')
+            summary = self.conn.get_resources(pagination=pagination)
+            samples = self.conn.get_resources(start_timestamp=start,
+                                              pagination=pagination)
+            self.assertEqual([r.resource_id for r in summary],
+                             [r.resource_id for r in samples])
+
+    @mock.patch.object(timeutils, 'utcnow')
+    def test_summary_after_expiry(self, mock_utcnow):
+        mock_utcnow.return_value = datetime.datetime(2012, 7, 2, 10, 45)
+        self.conn.clear_expired_metering_data(3 * 60)
+        self.assertEqual(self._from_samples(), self._from_summary())
+
+
+@tests_db.run_with('sqlite')
+class RollupStatisticsTest(scenarios.DBTestBase):
+
+    def prepare_data(self):
+        self.CONF.set_override('statistics_rollups', True, group='database')
+        super(RollupStatisticsTest, self).prepare_data()
+        # several samples per minute, recorded in distinct transactions
+        for second, volume in ((5, 3), (10, 7), (50, 2)):
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, 41, second),
+                volume=volume)
+
+    def _get_statistics(self, sample_filter, period, groupby=None,
+                        aggregate=None):
+        return sorted((s.as_dict() for s in self.conn.get_meter_statistics(
+            sample_filter, period=period, groupby=groupby,
+            aggregate=aggregate)),
+            key=lambda s: (s['period_start'], s['groupby']))
+
+    def _compare_with_samples(self, sample_filter, period, groupby=None,
+                              aggregate=None):
+        with mock.patch.object(self.conn, '_get_period_statistics') as raw:
+            results = self._get_statistics(sample_filter, period, groupby,
+                                           aggregate)
+        self.assertFalse(raw.called)
+        self.CONF.set_override('statistics_rollups', False, group='database')
+        expected = self._get_statistics(sample_filter, period, groupby,
+                                        aggregate)
+        self.assertTrue(expected)
+        self.assertEqual(expected, results)
+
+    def test_minute_period(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2, 10, 30),
+            end=datetime.datetime(2012, 7, 2, 11, 0))
+        self._compare_with_samples(f, 120)
+
+    def test_hour_period_groupby(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 1),
+            end=datetime.datetime(2012, 7, 3))
+        self._compare_with_samples(f, 7200, groupby=['resource_id'])
+
+    def test_day_period_filtered(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            user='user-id',
+            start=datetime.datetime(2012, 1, 1),
+            end=datetime.datetime(2013, 1, 1))
+        self._compare_with_samples(f, 24 * 3600)
+
+    def test_selectable_aggregates(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2),
+            end=datetime.datetime(2012, 7, 3))
+        aggregate = [mock.Mock(func='max', param=None),
+                     mock.Mock(func='cardinality', param='resource_id')]
+        self._compare_with_samples(f, 3600, aggregate=aggregate)
+
+    def test_granularity(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2),
+            end=datetime.datetime(2012, 7, 3))
+        self.assertEqual(24 * 3600,
+                         self.conn._get_rollup_granularity(f, 24 * 3600))
+        self.assertEqual(3600, self.conn._get_rollup_granularity(f, 7200))
+        self.assertEqual(60, self.conn._get_rollup_granularity(f, 90 * 60))
+        self.assertIsNone(self.conn._get_rollup_granularity(f, 90))
+
+    def test_unaligned_filter(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2, 10, 40, 30),
+            end=datetime.datetime(2012, 7, 2, 11, 0))
+        self.assertIsNone(self.conn._get_rollup_granularity(f, 60))
+
+    def test_unsupported_aggregate(self):
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2),
+            end=datetime.datetime(2012, 7, 3))
+        self.assertIsNone(self.conn._get_rollup_statistics(
+            f, impl_sqlalchemy.PERIOD_BUCKETS['sqlite'], 3600, None,
+            [mock.Mock(func='stddev', param=None)]))
+
+    def test_samples_older_than_rollups(self):
+        self.CONF.set_override('statistics_rollups', False, group='database')
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2012, 7, 2, 9, 0))
+        self.CONF.set_override('statistics_rollups', True, group='database')
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 7, 2),
+            end=datetime.datetime(2012, 7, 3))
+        self.assertIsNone(self.conn._get_rollup_statistics(
+            f, impl_sqlalchemy.PERIOD_BUCKETS['sqlite'], 3600, None, None))
+        stats = list(self.conn.get_meter_statistics(f, period=3600))
+        self.assertEqual(datetime.datetime(2012, 7, 2, 9, 0),
+                         stats[0].period_start)
+
+    def test_rollups_unique(self):
+        session = self.conn._engine_facade.get_session()
+        row = session.query(sql_models.MeterRollup).filter(
+            sql_models.MeterRollup.user_id == 'user-id').first()
+
+        def add_duplicate():
+            with session.begin():
+                session.add(sql_models.MeterRollup(
+                    granularity=row.granularity,
+                    meter_id=row.meter_id,
+                    resource_id=row.resource_id,
+                    user_id=row.user_id,
+                    project_id=row.project_id,
+                    source_id=row.source_id,
+                    period_start=row.period_start))
+
+        self.assertRaises(dbexc.DBDuplicateEntry, add_duplicate)
+
+    @mock.patch.object(timeutils, 'utcnow')
+    def test_rollups_expired(self, mock_utcnow):
+        mock_utcnow.return_value = datetime.datetime(2012, 12, 1, 1, 30)
+        self.conn.clear_expired_metering_data(3 * 60)
+        # whole days of samples expire, and so do all their rollups
+        session = self.conn._engine_facade.get_session()
+        periods = session.query(sql_models.MeterRollup.period_start)
+        for period_start, in periods:
+            self.assertTrue(period_start >= datetime.datetime(2012, 12, 1))
+        f = storage.SampleFilter(
+            meter='instance',
+            start=datetime.datetime(2012, 1, 1),
+            end=datetime.datetime(2014, 1, 1))
+        self._compare_with_samples(f, 24 * 3600)
+
+    def test_storage_capabilities(self):
+        self.assertTrue(self.conn.get_storage_capabilities()
+                        ['storage']['rollups'])
+
 
 class CapabilitiesTest(test_base.BaseTestCase):
     # Check the returned capabilities list, which is specific to each DB
@@ -203,7 +536,7 @@ class CapabilitiesTest(test_base.BaseTestCase):
                        'query': {'simple': True,
                                  'metadata': True,
                                  'complex': False}},
-            'resources': {'pagination': False,
+            'resources': {'pagination': True,
                           'query': {'simple': True,
                                     'metadata': True,
                                     'complex': False}},
@@ -239,7 +572,8 @@ class CapabilitiesTest(test_base.BaseTestCase):
 
     def test_storage_capabilities(self):
         expected_capabilities = {
-            'storage': {'production_ready': True},
+            'storage': {'production_ready': True,
+                        'rollups': False},
         }
         actual_capabilities = impl_sqlalchemy.Connection.\
             get_storage_capabilities()
@@ -635,6 +635,20 @@ class RawSampleTest(DBTestBase,
         results = list(self.conn.get_resources())
         self.assertEqual(len(results), 5)
 
+    def test_clear_metering_data_chunked(self):
+        # NOTE(jd) Override this test in MongoDB because our code doesn't clear
+        # the collections, this is handled by MongoDB TTL feature.
+        if isinstance(self.conn, mongodb.Connection):
+            return
+
+        self.mock_utcnow.return_value = datetime.datetime(2012, 7, 2, 10, 45)
+        self.conn.clear_expired_metering_data(3 * 60, chunk_size=2)
+        f = storage.SampleFilter(meter='instance')
+        results = list(self.conn.get_samples(f))
+        self.assertEqual(len(results), 5)
+        results = list(self.conn.get_resources())
+        self.assertEqual(len(results), 5)
+
     def test_clear_metering_data_no_data_to_remove(self):
         # NOTE(jd) Override this test in MongoDB because our code doesn't clear
         # the collections, this is handled by MongoDB TTL feature.
@@ -2225,6 +2239,56 @@ class StatisticsGroupByTest(DBTestBase,
                                      datetime.datetime(2013, 8, 1, 14, 0)])
 
 
+class RecordBatchTest(DBTestBase,
+                      tests_db.MixinTestsWithBackendScenarios):
+
+    def prepare_data(self):
+        self.msgs = []
+        for i in range(5):
+            s = sample.Sample(
+                'batch.meter', sample.TYPE_GAUGE, unit='B', volume=i,
+                user_id='user-id', project_id='project-id',
+                resource_id='resource-id-%d' % (i % 2),
+                timestamp=datetime.datetime(2012, 7, 2, 10, 40 + i),
+                resource_metadata={'display_name': 'batch-%d' % i},
+                source='test-batch')
+            self.msgs.append(utils.meter_message_from_counter(
+                s, self.CONF.publisher.metering_secret))
+        self.conn.record_metering_data_batch(self.msgs)
+
+    def test_record_batch_samples(self):
+        f = storage.SampleFilter(meter='batch.meter')
+        results = list(self.conn.get_samples(f))
+        self.assertEqual(5, len(results))
+        self.assertEqual(set(range(5)),
+                         set(r.counter_volume for r in results))
+
+    def test_record_batch_metaquery(self):
+        f = storage.SampleFilter(
+            meter='batch.meter',
+            metaquery={'metadata.display_name': 'batch-3'})
+        results = list(self.conn.get_samples(f))
+        self.assertEqual(1, len(results))
+        self.assertEqual(3, results[0].counter_volume)
+
+    def test_record_batch_resources(self):
+        resources = dict((r.resource_id, r)
+                         for r in self.conn.get_resources(source='test-batch'))
+        self.assertEqual(set(['resource-id-0', 'resource-id-1']),
+                         set(resources))
+        resource = resources['resource-id-0']
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 40),
+                         resource.first_sample_timestamp)
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 44),
+                         resource.last_sample_timestamp)
+        self.assertEqual('batch-4', resource.metadata['display_name'])
+
+    def test_record_batch_empty(self):
+        self.conn.record_metering_data_batch([])
+        f = storage.SampleFilter(meter='batch.meter')
+        self.assertEqual(5, len(list(self.conn.get_samples(f))))
+
+
 class CounterDataTypeTest(DBTestBase,
                           tests_db.MixinTestsWithBackendScenarios):
     def prepare_data(self):
@@ -0,0 +1,78 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Tests for the polling schedule of ceilometer/agent.py
+"""
+import mock
+
+from ceilometer import agent
+from ceilometer.openstack.common import test
+
+
+class TestPollingSchedule(test.BaseTestCase):
+
+    def test_stagger_deterministic(self):
+        first = agent.PollingSchedule(60, 'compute-1')
+        again = agent.PollingSchedule(60, 'compute-1')
+        self.assertEqual(first.offset, again.offset)
+        self.assertTrue(0 <= first.offset < 60)
+
+    def test_stagger_spread(self):
+        offsets = set(agent.PollingSchedule(60, 'compute-%d' % i).offset
+                      for i in range(100))
+        self.assertTrue(len(offsets) > 30)
+
+    def test_stagger_aligned(self):
+        schedule = agent.PollingSchedule(60, 'compute-1')
+        delay = schedule.delay(1000)
+        self.assertTrue(0 < delay <= 60)
+        self.assertEqual(schedule.offset, (1000 + delay) % 60)
+
+    def test_no_stagger(self):
+        with mock.patch('time.time', return_value=1000):
+            schedule = agent.PollingSchedule(60, 'compute-1', stagger=False)
+        self.assertEqual(60, schedule.delay(1000))
+
+    def test_no_drift(self):
+        with mock.patch('time.time', return_value=0):
+            schedule = agent.PollingSchedule(60, 'compute-1', stagger=False)
+        self.assertEqual(60, schedule.delay(0))
+        self.assertEqual(48, schedule.delay(72))
+        self.assertEqual(59, schedule.delay(121))
+        self.assertEqual(0, schedule.overruns)
+
+    def test_woken_early(self):
+        with mock.patch('time.time', return_value=0):
+            schedule = agent.PollingSchedule(60, 'compute-1', stagger=False)
+        schedule.delay(0)
+        self.assertEqual(61, schedule.delay(59))
+        self.assertEqual(0, schedule.overruns)
+
+    def test_overrun(self):
+        with mock.patch('time.time', return_value=0):
+            schedule = agent.PollingSchedule(60, 'compute-1', stagger=False)
+        schedule.delay(0)
+        with mock.patch.object(agent.LOG, 'warning') as warning:
+            self.assertEqual(20, schedule.delay(160))
+        self.assertEqual(1, schedule.overruns)
+        self.assertEqual(1, warning.call_count)
+
+    def test_jitter(self):
+        with mock.patch('time.time', return_value=0):
+            schedule = agent.PollingSchedule(60, 'compute-1', stagger=False,
+                                             jitter=0.5)
+        with mock.patch('random.uniform', return_value=3) as uniform:
+            self.assertEqual(63, schedule.delay(0))
+            uniform.assert_called_once_with(0, 30.0)
+        # the jitter of a cycle does not shift the following ones
+        self.assertTrue(57 <= schedule.delay(63) <= 87)
+        self.assertEqual(0, schedule.overruns)
@@ -15,8 +15,10 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import contextlib
+import os
 import socket
 
+import fixtures
 import mock
 import msgpack
 import oslo.messaging
@@ -116,10 +118,24 @@ class TestCollector(tests_base.BaseTestCase):
         sock.recvfrom = recvfrom
         return sock
 
+    def _make_fake_socket_datagrams(self, datagrams):
+        def recvfrom(size):
+            if len(datagrams) == 1:
+                # Make the loop stop after the last datagram
+                self.srv.stop()
+            return msgpack.dumps(datagrams.pop(0)), ('127.0.0.1', 12345)
+
+        sock = mock.Mock()
+        sock.recvfrom = recvfrom
+        return sock
+
     def _verify_udp_socket(self, udp_socket):
         conf = self.CONF.collector
-        udp_socket.setsockopt.assert_called_once_with(socket.SOL_SOCKET,
-                                                      socket.SO_REUSEADDR, 1)
+        udp_socket.setsockopt.assert_any_call(socket.SOL_SOCKET,
+                                              socket.SO_REUSEADDR, 1)
+        if collector.SO_REUSEPORT is not None:
+            udp_socket.setsockopt.assert_any_call(socket.SOL_SOCKET,
+                                                  collector.SO_REUSEPORT, 1)
         udp_socket.bind.assert_called_once_with((conf.udp_address,
                                                  conf.udp_port))
 
@@ -147,7 +163,7 @@ class TestCollector(tests_base.BaseTestCase):
         self._verify_udp_socket(udp_socket)
 
         mock_dispatcher.record_metering_data.assert_called_once_with(
-            self.counter)
+            [self.counter])
 
     def test_udp_receive_storage_error(self):
         self._setup_messaging(False)
@@ -167,7 +183,57 @@ class TestCollector(tests_base.BaseTestCase):
         self._verify_udp_socket(udp_socket)
 
         mock_dispatcher.record_metering_data.assert_called_once_with(
-            self.counter)
+            [self.counter])
+        self.assertEqual(0, self.srv.udp_counters['stored'])
+
+    def test_udp_receive_array(self):
+        self._setup_messaging(False)
+        mock_dispatcher = self._setup_fake_dispatcher()
+        samples = [self.utf8_msg, self.utf8_msg]
+        udp_socket = self._make_fake_socket(samples)
+        with mock.patch('socket.socket', return_value=udp_socket):
+            self.srv.start()
+
+        self._verify_udp_socket(udp_socket)
+
+        mock_dispatcher.record_metering_data.assert_called_once_with(
+            samples)
+
+    def test_udp_receive_invalid_array(self):
+        self._setup_messaging(False)
+        mock_dispatcher = self._setup_fake_dispatcher()
+        udp_socket = self._make_fake_socket([self.utf8_msg, 'garbage'])
+        with mock.patch('socket.socket', return_value=udp_socket):
+            self.srv.start()
+
+        self.assertFalse(mock_dispatcher.record_metering_data.called)
+
+    def test_udp_receive_queue_full(self):
+        self._setup_messaging(False)
+        self.CONF.set_override('udp_queue_size', 1, group='collector')
+        mock_dispatcher = self._setup_fake_dispatcher()
+        udp_socket = self._make_fake_socket_datagrams(
+            [self.utf8_msg, [self.utf8_msg, self.utf8_msg], self.utf8_msg])
+        with mock.patch('socket.socket', return_value=udp_socket):
+            self.srv.start()
+
+        mock_dispatcher.record_metering_data.assert_called_once_with(
+            [self.utf8_msg])
+        self.assertEqual({'received': 3, 'decoded': 3, 'dropped': 2,
+                          'buffered': 0, 'stored': 1}, self.srv.udp_counters)
+
+    def test_udp_receive_batch(self):
+        self._setup_messaging(False)
+        mock_dispatcher = self._setup_fake_dispatcher()
+        udp_socket = self._make_fake_socket_datagrams(
+            [self.utf8_msg, [self.utf8_msg, self.utf8_msg], self.utf8_msg])
+        with mock.patch('socket.socket', return_value=udp_socket):
+            self.srv.start()
+
+        mock_dispatcher.record_metering_data.assert_called_once_with(
+            [self.utf8_msg] * 4)
+        self.assertEqual({'received': 3, 'decoded': 3, 'dropped': 0,
+                          'buffered': 0, 'stored': 3}, self.srv.udp_counters)
 
     @staticmethod
     def _raise_error():
@@ -211,9 +277,20 @@ class TestCollector(tests_base.BaseTestCase):
                         return_value=self._make_fake_socket(self.utf8_msg)):
             self.srv.start()
             self.assertTrue(utils.verify_signature(
-                mock_dispatcher.method_calls[0][1][0],
+                mock_dispatcher.method_calls[0][1][0][0],
                 "not-so-secret"))
 
+    def test_record_metering_data_write_behind(self):
+        mock_dispatcher = self._setup_fake_dispatcher()
+        self.srv.dispatcher_manager = dispatcher.load_dispatcher_manager()
+        self.srv.write_behind = collector.WriteBehindBuffer(
+            self.srv._dispatch, 10, 10, 60)
+        self.srv.record_metering_data(None, self.counter)
+        self.assertFalse(mock_dispatcher.record_metering_data.called)
+        self.srv.write_behind.flush()
+        mock_dispatcher.record_metering_data.assert_called_once_with(
+            [self.counter])
+
     @mock.patch('ceilometer.storage.impl_log.LOG')
     def test_collector_no_mock(self, mylog):
         self.CONF.set_override('udp_address', '', group='collector')
@@ -228,3 +305,87 @@ class TestCollector(tests_base.BaseTestCase):
         self.srv.rpc_server.wait()
         mylog.info.assert_called_once_with(
             'metering data test for test_run_tasks: 1')
+
+
+class TestWriteBehindBuffer(tests_base.BaseTestCase):
+    def setUp(self):
+        super(TestWriteBehindBuffer, self).setUp()
+        self.written = []
+
+    def _make_buffer(self, size=10, flush_size=2, flush_interval=60,
+                     overflow='block', spill_dir=None):
+        return collector.WriteBehindBuffer(self.written.append, size,
+                                           flush_size, flush_interval,
+                                           overflow, spill_dir)
+
+    def test_flush_size(self):
+        buf = self._make_buffer()
+        buf.put([1, 2, 3])
+        self.assertEqual([1, 2], buf._next_batch())
+        self.assertEqual(1, len(buf))
+
+    @mock.patch('time.time')
+    def test_flush_interval(self, mock_time):
+        buf = self._make_buffer()
+        mock_time.return_value = 100
+        buf.put([1])
+        mock_time.return_value = 160
+        self.assertEqual([1], buf._next_batch())
+
+    def test_stop_writes_everything(self):
+        buf = self._make_buffer()
+        buf.put([1, 2, 3])
+        buf.stop()
+        buf.run()
+        self.assertEqual([[1, 2], [3]], self.written)
+        self.assertEqual(3, buf.written)
+
+    def test_write_error(self):
+        buf = collector.WriteBehindBuffer(mock.Mock(side_effect=Exception),
+                                          10, 2, 60)
+        buf.put([1, 2, 3])
+        buf.flush()
+        self.assertEqual(0, len(buf))
+        self.assertEqual(0, buf.written)
+
+    def test_drop_oldest(self):
+        buf = self._make_buffer(size=3, overflow='drop_oldest')
+        buf.put([1, 2])
+        buf.put([3, 4])
+        buf.put([5, 6, 7, 8])
+        self.assertEqual(3, len(buf))
+        self.assertEqual(5, buf.dropped)
+        buf.flush()
+        self.assertEqual([[6, 7], [8]], self.written)
+
+    def test_spill(self):
+        spill_dir = self.useFixture(fixtures.TempDir()).path
+        buf = self._make_buffer(size=2, overflow='spill',
+                                spill_dir=spill_dir)
+        buf.put([1, 2])
+        buf.put([3])
+        buf.put([4, 5])
+        self.assertEqual(3, buf.spilled)
+        self.assertEqual(2, len(os.listdir(spill_dir)))
+        buf.stop()
+        buf.run()
+        self.assertEqual([[1, 2], [3], [4, 5]], self.written)
+        self.assertEqual([], os.listdir(spill_dir))
+
+    def test_spill_left_by_previous_run(self):
+        spill_dir = self.useFixture(fixtures.TempDir()).path
+        buf = self._make_buffer(size=0, overflow='spill',
+                                spill_dir=spill_dir)
+        buf.put([{'counter_name': u'foo'}])
+        buf = self._make_buffer(overflow='spill', spill_dir=spill_dir)
+        buf.stop()
+        buf.run()
+        self.assertEqual([[{'counter_name': u'foo'}]], self.written)
+
+    def test_spill_without_directory(self):
+        buf = self._make_buffer(overflow='spill')
+        self.assertEqual('block', buf.overflow)
+
+    def test_unknown_overflow_policy(self):
+        buf = self._make_buffer(overflow='foobar')
+        self.assertEqual('block', buf.overflow)
@@ -16,12 +16,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
+
 import mock
 import novaclient
 
 from ceilometer import nova_client
 from ceilometer.openstack.common.fixture import mockpatch
 from ceilometer.openstack.common import test
+from ceilometer.openstack.common import timeutils
 
 
 class TestNovaClient(test.BaseTestCase):
@@ -233,3 +236,28 @@ class TestNovaClient(test.BaseTestCase):
         self.assertIsNone(instance.kernel_id)
         self.assertIsNone(instance.image)
         self.assertIsNone(instance.ramdisk_id)
+
+    def test_with_flavor_and_image_cache_across_calls(self):
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.assertEqual(2, self._flavors_count)
+        self.assertEqual(2, self._images_count)
+
+    def test_with_flavor_and_image_cache_expiry(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        timeutils.advance_time_delta(nova_client.CACHE_TTL)
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.assertEqual(4, self._flavors_count)
+        self.assertEqual(4, self._images_count)
+
+    def test_instance_get_all_by_host_since(self):
+        since = datetime.datetime(2014, 1, 1, 12)
+        with mock.patch.object(self.nv.nova_client.servers, 'list',
+                               return_value=[]) as servers_list:
+            self.nv.instance_get_all_by_host('foobar', since)
+        servers_list.assert_called_once_with(
+            detailed=True,
+            search_opts={'host': 'foobar', 'all_tenants': True,
+                         'changes-since': '2014-01-01T12:00:00Z'})
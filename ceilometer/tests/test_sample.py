@@ -0,0 +1,81 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Tests for ceilometer/sample.py
+"""
+import mock
+
+from ceilometer.openstack.common import test
+from ceilometer import sample
+
+
+class TestSample(test.BaseTestCase):
+
+    def setUp(self):
+        super(TestSample, self).setUp()
+        self.sample = sample.Sample(
+            name='test',
+            type=sample.TYPE_CUMULATIVE,
+            unit='',
+            volume=1,
+            user_id='test',
+            project_id='test',
+            resource_id='test_run_tasks',
+            timestamp='2012-05-08T20:23:48.028195',
+            resource_metadata={'name': 'TestPublish'},
+            source='testsource',
+        )
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.sample, '__dict__'))
+
+    def test_id_generated_once(self):
+        with mock.patch('uuid.uuid1', return_value='an-id') as uuid1:
+            s = sample.Sample('test', sample.TYPE_GAUGE, '', 1, 'test',
+                              'test', 'test', None, {})
+            self.assertEqual(0, uuid1.call_count)
+            self.assertEqual('an-id', s.id)
+            self.assertEqual('an-id', s.id)
+        self.assertEqual(1, uuid1.call_count)
+
+    def test_id_unique(self):
+        other = sample.Sample('test', sample.TYPE_GAUGE, '', 1, 'test',
+                              'test', 'test', None, {})
+        self.assertNotEqual(self.sample.id, other.id)
+
+    def test_id_set(self):
+        self.sample.id = 'an-id'
+        self.assertEqual('an-id', self.sample.id)
+
+    def test_as_dict(self):
+        d = self.sample.as_dict()
+        self.assertEqual({'name': 'test',
+                          'type': sample.TYPE_CUMULATIVE,
+                          'unit': '',
+                          'volume': 1,
+                          'user_id': 'test',
+                          'project_id': 'test',
+                          'resource_id': 'test_run_tasks',
+                          'timestamp': '2012-05-08T20:23:48.028195',
+                          'resource_metadata': {'name': 'TestPublish'},
+                          'source': 'testsource',
+                          'id': self.sample.id},
+                         d)
+        d['volume'] = 2
+        self.assertEqual(1, self.sample.volume)
+
+    def test_default_source(self):
+        with mock.patch.object(sample, '_default_source', None):
+            s = sample.Sample('test', sample.TYPE_GAUGE, '', 1, 'test',
+                              'test', 'test', None, {})
+            self.assertEqual('openstack', s.source)
+            self.assertEqual('openstack', sample._default_source)
@@ -130,3 +130,37 @@ class TestUtils(test.BaseTestCase):
                          ('nested.a', 'A'),
                          ('nested.b', 'B')],
                          pairs)
+
+    def test_lru_cache(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        cache['c'] = 3
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_lru_cache_overwrite(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(3, cache.get('a'))
+        self.assertNotIn('b', cache)
+        self.assertEqual(2, len(cache))
+
+    def test_lru_cache_items(self):
+        cache = utils.LRUCache(None)
+        for key in 'abc':
+            cache[key] = key.upper()
+        cache.get('a')
+        self.assertEqual([('b', 'B'), ('c', 'C'), ('a', 'A')], cache.items())
+        self.assertEqual('C', cache.pop('c'))
+        self.assertIsNone(cache.pop('c'))
+        self.assertEqual(['b', 'a'], list(cache))
@@ -15,39 +15,162 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import collections
+import ast
+import calendar
+import datetime
+import heapq
+import os
 import re
+import zlib
+
+import six
 
 from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import jsonutils
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
 from ceilometer import sample
 from ceilometer import transformer
+from ceilometer import utils
 
 LOG = log.getLogger(__name__)
 
+# Seconds after which the previous volume of a resource is forgotten
+DEFAULT_CACHE_TTL = 24 * 3600
+
+
+# AST nodes allowed in scale expressions: arithmetic, boolean and
+# comparison operators over literals and the attributes of the sample
+SCALE_NODES = tuple(getattr(ast, name) for name in (
+    'Expression', 'BoolOp', 'BinOp', 'UnaryOp', 'Compare', 'IfExp',
+    'Num', 'Str', 'Constant', 'NameConstant', 'Name', 'Load', 'Attribute',
+    'Subscript', 'Index', 'Call', 'boolop', 'operator', 'unaryop', 'cmpop',
+) if hasattr(ast, name))
+
+# Builtins that can be called in scale expressions
+SCALE_FUNCTIONS = {'abs': abs, 'float': float, 'int': int, 'max': max,
+                   'min': min, 'round': round}
+
+SCALE_GLOBALS = {'__builtins__': SCALE_FUNCTIONS}
+
+# Prefixes of the attributes which can not be read in scale expressions,
+# those of the internals of functions, methods, generators and frames
+PRIVATE_PREFIXES = ('_', 'im_', 'func_', 'gi_', 'f_', 'co_', 'tb_')
+
 
 class Namespace(object):
     """Encapsulates the namespace wrapping the evaluation of the
        configured scale factor. This allows nested dicts to be
        accessed in the attribute style, and missing attributes
        to yield false when used in a boolean expression.
+
+       Nested dicts are only wrapped when they are accessed.
     """
+    __slots__ = ('_seed',)
+
     def __init__(self, seed):
-        self.__dict__ = collections.defaultdict(lambda: Namespace({}))
-        self.__dict__.update(seed)
-        for k, v in self.__dict__.iteritems():
-            if isinstance(v, dict):
-                self.__dict__[k] = Namespace(v)
+        self._seed = seed
 
     def __getattr__(self, attr):
-        return self.__dict__[attr]
+        return self[attr]
 
     def __getitem__(self, key):
-        return self.__dict__[key]
+        return self.get(key, {})
+
+    def get(self, key, default=None):
+        value = self._seed.get(key, default)
+        return Namespace(value) if isinstance(value, dict) else value
 
     def __nonzero__(self):
-        return len(self.__dict__) > 0
+        return len(self._seed) > 0
+
+
+class SampleNamespace(object):
+    """Namespace of a sample, only reading the attributes an expression
+       refers to.
+    """
+    __slots__ = ('_sample',)
+
+    def __init__(self, s):
+        self._sample = s
+
+    def __getitem__(self, name):
+        if name in sample.FIELDS:
+            value = getattr(self._sample, name)
+        elif name in SCALE_FUNCTIONS:
+            # looked up in the builtins of the expression
+            raise KeyError(name)
+        else:
+            value = {}
+        return Namespace(value) if isinstance(value, dict) else value
+
+
+def _check_scale_node(node, scale):
+    if not isinstance(node, SCALE_NODES):
+        raise ValueError(_('Unsupported %(node)s in scale expression '
+                           '%(scale)s') % {'node': type(node).__name__,
+                                           'scale': scale})
+    if (isinstance(node, ast.Attribute) and
+            node.attr.startswith(PRIVATE_PREFIXES)):
+        raise ValueError(_('Private attribute %(attr)s in scale '
+                           'expression %(scale)s') % {'attr': node.attr,
+                                                      'scale': scale})
+    if isinstance(node, ast.Call) and not (
+            ((isinstance(node.func, ast.Attribute) and
+              node.func.attr == 'get') or
+             (isinstance(node.func, ast.Name) and
+              node.func.id in SCALE_FUNCTIONS)) and
+            not node.keywords and
+            not getattr(node, 'starargs', None) and
+            not getattr(node, 'kwargs', None)):
+        raise ValueError(_('Only get() and %(functions)s can be called in '
+                           'scale expression %(scale)s') %
+                         {'functions': ', '.join(sorted(SCALE_FUNCTIONS)),
+                          'scale': scale})
+
+
+def compile_scale(scale):
+    """Compile a scale expression once, after checking it only uses
+       operators, literals, the attributes of the sample, the get()
+       method of nested dicts and a few numeric builtins.
+
+    :returns: a function evaluating the expression for a sample
+    """
+    try:
+        tree = ast.parse(scale.strip(), mode='eval')
+    except SyntaxError as err:
+        raise ValueError(_('Invalid scale expression %(scale)s: %(err)s')
+                         % {'scale': scale, 'err': err})
+    names = False
+    for node in ast.walk(tree):
+        _check_scale_node(node, scale)
+        names = names or (isinstance(node, ast.Name) and
+                          node.id not in SCALE_FUNCTIONS)
+    code = compile(tree, '<scale>', 'eval')
+    if not names:
+        value = eval(code, SCALE_GLOBALS)
+        return lambda s: value
+    return lambda s: eval(code, SCALE_GLOBALS, SampleNamespace(s))
+
+
+def sample_datetime(value):
+    """Return a sample timestamp as a naive UTC datetime.
+
+    Datetimes and POSIX timestamps are used as is, only strings are parsed.
+    """
+    if isinstance(value, datetime.datetime):
+        return timeutils.normalize_time(value)
+    if isinstance(value, (six.integer_types, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+    return timeutils.normalize_time(timeutils.parse_isotime(value))
+
+
+def sample_epoch(value):
+    """Return a sample timestamp as seconds since the epoch."""
+    if isinstance(value, (six.integer_types, float)):
+        return float(value)
+    value = sample_datetime(value)
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
 
 
 class ScalingTransformer(transformer.TransformerBase):
@@ -67,34 +190,62 @@ class ScalingTransformer(transformer.TransformerBase):
         self.source = source
         self.target = target
         self.scale = target.get('scale')
+        self.mappings = self._compile_mappings(source.get('map_from'),
+                                               target.get('map_to'))
         LOG.debug(_('scaling conversion transformer with source:'
                     ' %(source)s target: %(target)s:')
                   % {'source': source,
                      'target': target})
         super(ScalingTransformer, self).__init__(**kwargs)
 
+    @property
+    def scale(self):
+        return self._scale_factor
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale_factor = scale
+        self._scale_expression = (compile_scale(scale)
+                                  if isinstance(scale, six.string_types)
+                                  else None)
+
+    @staticmethod
+    def _compile_mappings(from_, to_):
+        mappings = {}
+        if from_ and to_:
+            for attr in ('name', 'unit'):
+                if from_.get(attr) and to_.get(attr):
+                    try:
+                        mappings[attr] = (re.compile(from_[attr]),
+                                          to_[attr])
+                    except re.error as err:
+                        LOG.warn(_('Ignoring the %(attr)s mapping %(from)s: '
+                                   '%(err)s') % {'attr': attr,
+                                                 'from': from_[attr],
+                                                 'err': err})
+        return mappings
+
     def _scale(self, s):
         """Apply the scaling factor (either a straight multiplicative
-           factor or else a string to be eval'd).
+           factor or else a compiled expression).
         """
-        ns = Namespace(s.as_dict())
-
-        scale = self.scale
-        return ((eval(scale, {}, ns) if isinstance(scale, basestring)
-                 else s.volume * scale) if scale else s.volume)
+        scale = self._scale_factor
+        if not scale:
+            return s.volume
+        if self._scale_expression:
+            return self._scale_expression(s)
+        return s.volume * scale
 
     def _map(self, s, attr):
         """Apply the name or unit mapping if configured.
         """
         mapped = None
-        from_ = self.source.get('map_from')
-        to_ = self.target.get('map_to')
-        if from_ and to_:
-            if from_.get(attr) and to_.get(attr):
-                try:
-                    mapped = re.sub(from_[attr], to_[attr], getattr(s, attr))
-                except Exception:
-                    pass
+        mapping = self.mappings.get(attr)
+        if mapping:
+            try:
+                mapped = mapping[0].sub(mapping[1], getattr(s, attr))
+            except Exception:
+                pass
         return mapped or self.target.get(attr, getattr(s, attr))
 
     def _convert(self, s, growth=1):
@@ -128,20 +279,87 @@ class RateOfChangeTransformer(ScalingTransformer):
        proportion of some maximum used.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, cache_ttl=DEFAULT_CACHE_TTL, cache_size=None,
+                 snapshot_path=None, **kwargs):
         """Initialize transformer with configured parameters.
+
+        :param cache_ttl: seconds after which the previous volume of a
+                          resource is forgotten, relative to the newest
+                          sample received (0 to keep it forever)
+        :param cache_size: maximum number of previous volumes kept, the
+                           least recently updated are dropped first
+        :param snapshot_path: file the previous volumes are saved to on
+                              each flush and loaded from on startup
         """
         super(RateOfChangeTransformer, self).__init__(**kwargs)
-        self.cache = {}
+        self.cache_ttl = (datetime.timedelta(seconds=int(cache_ttl))
+                          if cache_ttl else None)
+        self.cache_size = int(cache_size) if cache_size else None
+        # previous (volume, timestamp) by meter and resource, in update order
+        self.cache = utils.LRUCache(self.cache_size)
+        self.snapshot_path = snapshot_path
         self.scale = self.scale or '1'
+        self._latest = None
+        self._changed = False
+        if snapshot_path:
+            self._load_snapshot()
+
+    def _remember(self, key, volume, timestamp):
+        """Store the volume of a sample, and return the previous one."""
+        prev = self.cache.pop(key)
+        self.cache[key] = (volume, timestamp)
+        if self._latest is None or timestamp > self._latest:
+            self._latest = timestamp
+        self._changed = True
+        return prev
+
+    def _expire(self, now):
+        limit = now - self.cache_ttl
+        expired = [key for key, (volume, timestamp) in
+                   self.cache.items() if timestamp < limit]
+        for key in expired:
+            self.cache.pop(key)
+        if expired:
+            self._changed = True
+            LOG.debug(_('forgot the volume of %d stale resources'),
+                      len(expired))
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                entries = jsonutils.loads(f.read())
+            for key, volume, timestamp in entries:
+                self._remember(key, volume, timeutils.parse_strtime(timestamp))
+        except (IOError, ValueError, TypeError) as err:
+            LOG.warn(_('unable to load the snapshot %(path)s: %(err)s'),
+                     {'path': self.snapshot_path, 'err': err})
+            self.cache.clear()
+        if self.cache_ttl:
+            self._expire(timeutils.utcnow())
+        self._changed = False
+
+    def _save_snapshot(self):
+        entries = [(key, volume, timeutils.strtime(timestamp))
+                   for key, (volume, timestamp) in self.cache.items()]
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(jsonutils.dumps(entries))
+            os.rename(tmp_path, self.snapshot_path)
+        except (IOError, OSError) as err:
+            LOG.warn(_('unable to save the snapshot %(path)s: %(err)s'),
+                     {'path': self.snapshot_path, 'err': err})
+        else:
+            self._changed = False
 
     def handle_sample(self, context, s):
         """Handle a sample, converting if necessary."""
         LOG.debug(_('handling sample %s'), (s,))
         key = s.name + s.resource_id
-        prev = self.cache.get(key)
-        timestamp = timeutils.parse_isotime(s.timestamp)
-        self.cache[key] = (s.volume, timestamp)
+        timestamp = sample_datetime(s.timestamp)
+        prev = self._remember(key, s.volume, timestamp)
 
         if prev:
             prev_volume = prev[0]
@@ -165,11 +383,64 @@ class RateOfChangeTransformer(ScalingTransformer):
             s = None
         return s
 
+    def flush(self, context):
+        """Forget the stale resources and save the snapshot."""
+        if self.cache_ttl and self._latest:
+            self._expire(self._latest)
+        if self.snapshot_path and self._changed:
+            self._save_snapshot()
+        return []
+
+
+# Attribute of Aggregate holding the volume of each reduction, the mean is
+# computed from the total
+REDUCTIONS = {'sum': 'total', 'min': 'minimum', 'max': 'maximum',
+              'last': 'last', 'mean': None}
+
+
+class Aggregate(object):
+    """Aggregated sample and statistics over the volumes it merges."""
+
+    __slots__ = ('sample', 'count', 'total', 'minimum', 'maximum', 'last')
+
+    def __init__(self, s, volume):
+        self.sample = s
+        self.count = 1
+        self.total = self.minimum = self.maximum = self.last = volume
+
+    def add(self, volume):
+        self.count += 1
+        self.total += volume
+        self.minimum = min(self.minimum, volume)
+        self.maximum = max(self.maximum, volume)
+        self.last = volume
+
+    def reduce(self, reduction):
+        """Set the volume of the aggregated sample and return it."""
+        if reduction == 'mean':
+            self.sample.volume = 1.0 * self.total / self.count
+        else:
+            self.sample.volume = getattr(self, REDUCTIONS[reduction])
+        return self.sample
+
 
 class AggregatorTransformer(ScalingTransformer):
     """Transformer that aggregate sample until a threshold or/and a
     retention_time, and then flush them out in the wild.
 
+    When a window is given, the samples are instead aggregated by key in
+    windows of that many seconds of their timestamps, starting every
+    slide seconds (every window by default, for tumbling windows). The
+    windows of each key are shifted by an offset derived from the key,
+    and each is flushed on its own once its end has passed, so that the
+    aggregated samples are spread over time. Their timestamp is the end
+    of their window. Samples arriving for windows already flushed, or
+    ended for more than a window, are late: they are dropped from those
+    windows and counted in late_samples.
+
+    The volumes are summed, or reduced to their min, max, mean or last
+    value according to the aggregation.
+
     Example:
       To aggregate sample by resource_metadata and keep the
       resource_metadata of the latest received sample;
@@ -182,11 +453,16 @@ class AggregatorTransformer(ScalingTransformer):
         AggregatorTransformer(size=15, user_id='first',
                               resource_metadata='drop')
 
+      To publish every minute the maximum volume of the last five minutes
+      of each resource.
+
+        AggregatorTransformer(window=300, slide=60, aggregation='max')
+
     """
 
     def __init__(self, size=1, retention_time=None,
                  project_id=None, user_id=None, resource_metadata="last",
-                 **kwargs):
+                 window=None, slide=None, aggregation='sum', **kwargs):
         super(AggregatorTransformer, self).__init__(**kwargs)
         self.samples = {}
         self.size = size
@@ -194,6 +470,25 @@ class AggregatorTransformer(ScalingTransformer):
         self.initial_timestamp = None
         self.aggregated_samples = 0
 
+        if aggregation not in REDUCTIONS:
+            LOG.warn('aggregation is unknown (%s), using sum' % aggregation)
+            aggregation = 'sum'
+        self.aggregation = aggregation
+
+        self.window = int(window) if window else None
+        self.slide = int(slide) if slide else self.window
+        if self.window and not 0 < self.slide <= self.window:
+            LOG.warn('slide must be between 1 and window (%s), using %s' %
+                     (slide, self.window))
+            self.slide = self.window
+        # aggregates by key and window start, and heap of their window end
+        self.windows = {}
+        self.window_ends = []
+        # end of the latest flushed window by key, and heap of those ends
+        self.flushed = {}
+        self.flushed_ends = []
+        self.late_samples = 0
+
         self.key_attributes = []
         self.merged_attribute_policy = {}
 
@@ -219,32 +514,85 @@ class AggregatorTransformer(ScalingTransformer):
         # NOTE(sileht): it assumes, a meter always have the same unit/type
         return "%s-%s-%s" % (s.name, s.resource_id, non_aggregated_keys)
 
+    def _aggregate(self, aggregates, key, sample):
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            s = self._convert(sample)
+            if self.merged_attribute_policy[
+                    'resource_metadata'] == 'drop':
+                s.resource_metadata = {}
+            aggregates[key] = Aggregate(s, s.volume)
+            return True
+        aggregate.add(self._scale(sample))
+        for field in self.merged_attribute_policy:
+            if self.merged_attribute_policy[field] == 'last':
+                setattr(aggregate.sample, field, getattr(sample, field))
+        return False
+
+    def _window_starts(self, key, timestamp):
+        """Return the start of the windows of the key containing the
+        timestamp.
+        """
+        offset = zlib.crc32(key.encode('utf-8')
+                            if isinstance(key, six.text_type)
+                            else key) % self.slide
+        last = (timestamp - offset) // self.slide * self.slide + offset
+        return [last - i * self.slide
+                for i in range(-(-self.window // self.slide))
+                if last - i * self.slide + self.window > timestamp]
+
     def handle_sample(self, context, sample):
-        if not self.initial_timestamp:
-            self.initial_timestamp = timeutils.parse_strtime(
-                sample.timestamp)
+        key = self._get_unique_key(sample)
+        if self.window:
+            timestamp = sample_epoch(sample.timestamp)
+            # windows ending before that limit may have been flushed
+            limit = max(self.flushed.get(key, 0),
+                        sample_epoch(timeutils.utcnow()) - self.window)
+            late = False
+            for start in self._window_starts(key, timestamp):
+                if start + self.window <= limit:
+                    late = True
+                elif self._aggregate(self.windows, (key, start), sample):
+                    heapq.heappush(self.window_ends,
+                                   (start + self.window, key, start))
+            if late:
+                self.late_samples += 1
+                LOG.debug(_('dropped late sample %s from its flushed '
+                            'windows'), (sample,))
+            return
 
+        if not self.initial_timestamp:
+            self.initial_timestamp = sample_datetime(sample.timestamp)
         self.aggregated_samples += 1
-        key = self._get_unique_key(sample)
-        if key not in self.samples:
-            self.samples[key] = self._convert(sample)
-            if self.merged_attribute_policy[
-                    'resource_metadata'] == 'drop':
-                self.samples[key].resource_metadata = {}
-        else:
-            self.samples[key].volume += self._scale(sample)
-            for field in self.merged_attribute_policy:
-                if self.merged_attribute_policy[field] == 'last':
-                    setattr(self.samples[key], field,
-                            getattr(sample, field))
+        self._aggregate(self.samples, key, sample)
+
+    def _flush_windows(self):
+        now = sample_epoch(timeutils.utcnow())
+        flushed = []
+        while self.window_ends and self.window_ends[0][0] <= now:
+            end, key, start = heapq.heappop(self.window_ends)
+            s = self.windows.pop((key, start)).reduce(self.aggregation)
+            s.timestamp = datetime.datetime.utcfromtimestamp(end).isoformat()
+            flushed.append(s)
+            self.flushed[key] = end
+            heapq.heappush(self.flushed_ends, (end, key))
+        # older windows are all late anyway
+        while self.flushed_ends and \
+                self.flushed_ends[0][0] <= now - self.window:
+            end, key = heapq.heappop(self.flushed_ends)
+            if self.flushed.get(key) == end:
+                del self.flushed[key]
+        return flushed
 
     def flush(self, context):
+        if self.window:
+            return self._flush_windows()
         expired = self.retention_time and \
             timeutils.is_older_than(self.initial_timestamp,
                                     self.retention_time)
         full = self.aggregated_samples >= self.size
         if full or expired:
-            x = self.samples.values()
+            x = [a.reduce(self.aggregation) for a in self.samples.values()]
             self.samples = {}
             self.aggregated_samples = 0
             self.initial_timestamp = None
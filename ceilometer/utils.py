@@ -183,3 +183,79 @@ def uniq(dupes, attrs):
             deduped.append(d)
             keys.append(key(d))
     return deduped
+
+
+class LRUCache(object):
+    """Mapping keeping at most size entries (no limit if size is None), the
+    least recently used ones are evicted first.
+    """
+
+    # NOTE: collections.OrderedDict is not available on Python 2.6, so the
+    # entries are [prev, next, key, value] links of a circular doubly
+    # linked list, the most recently used one being the last.
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, size):
+        self.size = size
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __iter__(self):
+        return (key for key, value in self.items())
+
+    def items(self):
+        """Return the (key, value) pairs, least recently used first."""
+        items = []
+        link = self._root[self.NEXT]
+        while link is not self._root:
+            items.append((link[self.KEY], link[self.VALUE]))
+            link = link[self.NEXT]
+        return items
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _append(self, link):
+        last = self._root[self.PREV]
+        link[self.PREV], link[self.NEXT] = last, self._root
+        last[self.NEXT] = self._root[self.PREV] = link
+
+    def get(self, key, default=None):
+        link = self._links.get(key)
+        if link is None:
+            return default
+        self._unlink(link)
+        self._append(link)
+        return link[self.VALUE]
+
+    def pop(self, key, default=None):
+        link = self._links.pop(key, None)
+        if link is None:
+            return default
+        self._unlink(link)
+        return link[self.VALUE]
+
+    def __setitem__(self, key, value):
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[self.VALUE] = value
+        else:
+            link = self._links[key] = [None, None, key, value]
+        self._append(link)
+        if self.size is not None and len(self._links) > self.size:
+            oldest = self._root[self.NEXT]
+            self._unlink(oldest)
+            del self._links[oldest[self.KEY]]
+
+    def clear(self):
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the cost of building samples and pushing them through a sink.
+
+Samples are built in batches and published through a pipeline sink,
+optionally chaining unit conversion transformers, to a publisher doing
+nothing. The time spent building the samples and the time spent in the
+sink are reported separately.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import time
+
+from oslo.config import cfg
+
+from ceilometer.openstack.common import context
+from ceilometer import pipeline
+from ceilometer import sample
+from ceilometer import transformer
+
+
+class NullPublisher(object):
+    def __init__(self):
+        self.count = 0
+
+    def publish_samples(self, context, samples):
+        self.count += len(samples)
+
+
+def make_samples(count, timestamp):
+    return [sample.Sample(name='cpu',
+                          type=sample.TYPE_CUMULATIVE,
+                          unit='ns',
+                          volume=i,
+                          user_id='user',
+                          project_id='project',
+                          resource_id='resource-%d' % (i % 1000),
+                          timestamp=timestamp,
+                          resource_metadata={'cpu_number': 1},
+                          source='benchmark',
+                          )
+            for i in range(count)]
+
+
+def main():
+    cfg.CONF([], project='ceilometer')
+
+    parser = argparse.ArgumentParser(
+        description='benchmark building and publishing samples',
+    )
+    parser.add_argument(
+        '--samples',
+        default=1000000,
+        type=int,
+        help='The number of samples built and published.',
+    )
+    parser.add_argument(
+        '--batch',
+        default=1000,
+        type=int,
+        help='The number of samples published at once.',
+    )
+    parser.add_argument(
+        '--transformers',
+        default=0,
+        type=int,
+        help='The number of unit conversion transformers of the sink.',
+    )
+    args = parser.parse_args()
+
+    transformers = [{'name': 'unit_conversion',
+                     'parameters': {'target': {'scale': 1.0}}}
+                    for i in range(args.transformers)]
+    sink = pipeline.Sink({'name': 'benchmark',
+                          'transformers': transformers,
+                          'publishers': ['test://']},
+                         transformer.TransformerExtensionManager(
+                             'ceilometer.transformer'))
+    null = NullPublisher()
+    sink.publishers = [null]
+    ctxt = context.get_admin_context()
+    timestamp = datetime.datetime.utcnow().isoformat()
+
+    build_time = publish_time = 0
+    for i in range(0, args.samples, args.batch):
+        before = time.time()
+        samples = make_samples(min(args.batch, args.samples - i), timestamp)
+        built = time.time()
+        sink.publish_samples(ctxt, samples)
+        published = time.time()
+        build_time += built - before
+        publish_time += published - built
+
+    print('%d samples published through %d transformers' % (
+        null.count, args.transformers))
+    print('build:   %.3fs' % build_time)
+    print('publish: %.3fs' % publish_time)
+
+    return 0
+
+if __name__ == '__main__':
+    main()
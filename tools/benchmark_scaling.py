@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the evaluation of scale expressions by the transformers.
+
+The compiled expressions of ScalingTransformer are timed against the
+historical evaluation, which wrapped every sample in a namespace and
+evaluated the expression string each time, on cpu samples carrying
+the metadata of nova instances.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import time
+
+from oslo.config import cfg
+
+from ceilometer import sample
+from ceilometer.transformer import conversions
+
+# The cpu_util expression of the default pipeline.yaml
+CPU_UTIL_SCALE = "100.0 / (10**9 * (resource_metadata.cpu_number or 1))"
+
+
+class LegacyNamespace(object):
+    """The namespace the scale expressions were evaluated in."""
+
+    def __init__(self, seed):
+        self.__dict__ = collections.defaultdict(lambda: LegacyNamespace({}))
+        self.__dict__.update(seed)
+        for k, v in self.__dict__.iteritems():
+            if isinstance(v, dict):
+                self.__dict__[k] = LegacyNamespace(v)
+
+    def __getattr__(self, attr):
+        return self.__dict__[attr]
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __nonzero__(self):
+        return len(self.__dict__) > 0
+
+
+def legacy_scale(scale, s):
+    return eval(scale, {}, LegacyNamespace(dict(s.as_dict())))
+
+
+def make_samples(count):
+    timestamp = datetime.datetime(2014, 1, 1).isoformat()
+    return [sample.Sample(name='cpu',
+                          type=sample.TYPE_CUMULATIVE,
+                          unit='ns',
+                          volume=i * 10 ** 9,
+                          user_id='user',
+                          project_id='project',
+                          resource_id='resource-%d' % i,
+                          timestamp=timestamp,
+                          resource_metadata={
+                              'display_name': 'instance-%d' % i,
+                              'host': 'compute-%d' % (i % 16),
+                              'instance_type': 'm1.small',
+                              'flavor': {'id': 2, 'name': 'm1.small',
+                                         'vcpus': 1, 'ram': 2048,
+                                         'disk': 20, 'ephemeral': 0},
+                              'image': {'id': 'image-%d' % (i % 8)},
+                              'cpu_number': 1 + i % 4,
+                              'memory_mb': 2048,
+                              'status': 'active',
+                              'metadata': {'role': 'webserver'},
+                          },
+                          source='benchmark',
+                          )
+            for i in range(count)]
+
+
+def timed(func, samples, repeat):
+    best = None
+    for i in range(repeat):
+        before = time.time()
+        result = [func(s) for s in samples]
+        elapsed = time.time() - before
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    cfg.CONF([], project='ceilometer')
+
+    parser = argparse.ArgumentParser(
+        description='benchmark the evaluation of scale expressions',
+    )
+    parser.add_argument(
+        '--samples',
+        default=100000,
+        type=int,
+        help='The number of samples scaled.',
+    )
+    parser.add_argument(
+        '--scale',
+        default=CPU_UTIL_SCALE,
+        help='The scale expression evaluated.',
+    )
+    parser.add_argument(
+        '--repeat',
+        default=3,
+        type=int,
+        help='The number of runs of each method, the best one is kept.',
+    )
+    args = parser.parse_args()
+
+    samples = make_samples(args.samples)
+    transformer = conversions.ScalingTransformer(target={'scale': args.scale})
+
+    compiled_time, compiled = timed(transformer._scale, samples, args.repeat)
+    legacy_time, legacy = timed(lambda s: legacy_scale(args.scale, s),
+                                samples, args.repeat)
+
+    if compiled != legacy:
+        print('WARNING: the two methods returned different volumes')
+    print('%d samples scaled by %s' % (args.samples, args.scale))
+    print('compiled: %.3fs' % compiled_time)
+    print('legacy:   %.3fs' % legacy_time)
+
+    return 0
+
+if __name__ == '__main__':
+    main()
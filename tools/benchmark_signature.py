@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the message signature schemes of the publishers.
+
+Samples carrying the resource metadata of a nova instance notification
+are signed and verified with both the versioned canonical JSON scheme and
+the legacy key pairs one, and published through several publishers.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import time
+import uuid
+
+from oslo.config import cfg
+
+from ceilometer.openstack.common import jsonutils
+from ceilometer.publisher import utils
+from ceilometer import sample
+
+
+def instance_metadata(i):
+    return {
+        'display_name': 'instance-%d' % i,
+        'name': 'instance-%08x' % i,
+        'host': 'compute-%d' % (i % 16),
+        'hostname': 'instance-%d' % i,
+        'node': 'compute-%d.example.com' % (i % 16),
+        'instance_id': str(uuid.uuid4()),
+        'instance_type': 'm1.small',
+        'instance_type_id': 2,
+        'flavor': {'id': 2, 'name': 'm1.small', 'vcpus': 1, 'ram': 2048,
+                   'disk': 20, 'ephemeral': 0, 'swap': 0},
+        'image': {'id': str(uuid.uuid4()),
+                  'links': [{'href': 'http://example.com:8774/images/1',
+                             'rel': 'bookmark'}]},
+        'image_ref': str(uuid.uuid4()),
+        'image_ref_url': 'http://example.com:9292/images/1',
+        'architecture': 'x86_64',
+        'os_type': 'linux',
+        'kernel_id': '',
+        'ramdisk_id': '',
+        'memory_mb': 2048,
+        'disk_gb': 20,
+        'root_gb': 20,
+        'ephemeral_gb': 0,
+        'vcpus': 1,
+        'state': 'active',
+        'state_description': '',
+        'status': 'active',
+        'availability_zone': 'nova',
+        'reservation_id': 'r-%08x' % i,
+        'created_at': '2014-01-01 00:00:00',
+        'launched_at': '2014-01-01T00:00:10.000000',
+        'terminated_at': '',
+        'deleted_at': '',
+        'fixed_ips': [{'address': '10.0.%d.%d' % (i // 250 % 250, i % 250),
+                       'floating_ips': [], 'label': 'private',
+                       'type': 'fixed', 'version': 4,
+                       'vif_mac': 'fa:16:3e:00:%02x:%02x' % (i // 256 % 256,
+                                                             i % 256)}],
+        'metadata': {'role': 'webserver', 'group': 'frontend'},
+        'properties': {'metering.stack': str(uuid.uuid4())},
+        'tenant_id': 'project',
+        'user_id': 'user',
+    }
+
+
+def make_samples(count):
+    timestamp = datetime.datetime(2014, 1, 1).isoformat()
+    return [sample.Sample(name='cpu_util',
+                          type=sample.TYPE_GAUGE,
+                          unit='%',
+                          volume=float(i),
+                          user_id='user',
+                          project_id='project',
+                          resource_id='resource-%d' % i,
+                          timestamp=timestamp,
+                          resource_metadata=instance_metadata(i),
+                          source='benchmark',
+                          )
+            for i in range(count)]
+
+
+def timed(func, repeat):
+    best = None
+    for i in range(repeat):
+        before = time.time()
+        func()
+        elapsed = time.time() - before
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    cfg.CONF([], project='ceilometer')
+
+    parser = argparse.ArgumentParser(
+        description='benchmark the signature of metering messages',
+    )
+    parser.add_argument(
+        '--samples',
+        default=10000,
+        type=int,
+        help='The number of samples signed and verified.',
+    )
+    parser.add_argument(
+        '--publishers',
+        default=3,
+        type=int,
+        help='The number of publishers each sample is published through.',
+    )
+    parser.add_argument(
+        '--repeat',
+        default=3,
+        type=int,
+        help='The number of runs of each benchmark, the best one is kept.',
+    )
+    args = parser.parse_args()
+
+    secret = cfg.CONF.publisher.metering_secret
+    samples = make_samples(args.samples)
+    # messages as received by the collector, after a trip on the wire
+    messages = [jsonutils.loads(jsonutils.dumps(
+        utils.meter_message_from_counter(s, secret))) for s in samples]
+    legacy_messages = []
+    for message in messages:
+        message = dict(message)
+        message['message_signature'] = utils.compute_legacy_signature(
+            message, secret)
+        legacy_messages.append(message)
+
+    def sign(compute):
+        return lambda: [compute(m, secret) for m in messages]
+
+    def verify(messages):
+        def run():
+            if not all(utils.verify_signature(m, secret) for m in messages):
+                print('WARNING: a message signature is invalid')
+        return run
+
+    def publish(signatures):
+        def run():
+            for i in range(signatures):
+                [utils.meter_message_from_counter(s, secret) for s in samples]
+        return run
+
+    print('%d samples, %d bytes of JSON each' % (
+        args.samples, len(jsonutils.dumps(messages[0]))))
+    print('sign legacy:      %.3fs' % timed(
+        sign(utils.compute_legacy_signature), args.repeat))
+    print('sign %s:          %.3fs' % (utils.SIGNATURE_VERSION, timed(
+        sign(utils.compute_signature), args.repeat)))
+    print('verify legacy:    %.3fs' % timed(
+        verify(legacy_messages), args.repeat))
+    print('verify %s:        %.3fs' % (utils.SIGNATURE_VERSION, timed(
+        verify(messages), args.repeat)))
+    print('publish through %d publishers, signed by publisher: %.3fs' % (
+        args.publishers, timed(publish(args.publishers), args.repeat)))
+    print('publish through %d publishers, signed by batch:     %.3fs' % (
+        args.publishers, timed(publish(1), args.repeat)))
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the period statistics queries of the SQLAlchemy driver.
+
+The single GROUP BY query over period buckets is timed against the
+historical one-query-per-period loop, on the same generated data.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import time
+
+import mock
+from oslo.config import cfg
+
+from ceilometer.publisher import utils
+from ceilometer import sample
+from ceilometer import storage
+from ceilometer.storage import impl_sqlalchemy
+
+
+def make_samples(start, days, interval, resources):
+    timestamp = start
+    end = start + datetime.timedelta(days=days)
+    increment = datetime.timedelta(seconds=interval)
+    while timestamp < end:
+        for r in range(resources):
+            s = sample.Sample(name='cpu_util',
+                              type=sample.TYPE_GAUGE,
+                              unit='%',
+                              volume=float(r),
+                              user_id='user',
+                              project_id='project',
+                              resource_id='resource-%d' % r,
+                              timestamp=timestamp,
+                              resource_metadata={},
+                              source='benchmark',
+                              )
+            yield utils.meter_message_from_counter(
+                s, cfg.CONF.publisher.metering_secret)
+        timestamp += increment
+
+
+def timed(func, repeat):
+    best = None
+    for i in range(repeat):
+        before = time.time()
+        result = list(func())
+        elapsed = time.time() - before
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    cfg.CONF([], project='ceilometer')
+
+    parser = argparse.ArgumentParser(
+        description='benchmark SQL period statistics',
+    )
+    parser.add_argument(
+        '--url',
+        default='sqlite://',
+        help='The database to run the benchmark against.',
+    )
+    parser.add_argument(
+        '--days',
+        default=7,
+        type=int,
+        help='The number of days of samples to generate.',
+    )
+    parser.add_argument(
+        '--interval',
+        default=60,
+        type=int,
+        help='The period between samples, in seconds.',
+    )
+    parser.add_argument(
+        '--resources',
+        default=1,
+        type=int,
+        help='The number of resources sampled at each interval.',
+    )
+    parser.add_argument(
+        '--period',
+        default=60,
+        type=int,
+        help='The statistics period, in seconds.',
+    )
+    parser.add_argument(
+        '--repeat',
+        default=3,
+        type=int,
+        help='The number of runs of each query, the best one is kept.',
+    )
+    args = parser.parse_args()
+
+    conn = storage.get_connection(args.url)
+    conn.upgrade()
+    start = datetime.datetime(2014, 1, 1)
+    samples = list(make_samples(start, args.days, args.interval,
+                                args.resources))
+    for i in range(0, len(samples), 1000):
+        conn.record_metering_data_batch(samples[i:i + 1000])
+    print('Recorded %d samples' % len(samples))
+
+    f = storage.SampleFilter(meter='cpu_util', start=start,
+                             end=start + datetime.timedelta(days=args.days))
+    get_stats = lambda: conn.get_meter_statistics(f, period=args.period)
+
+    bucket_time, bucket_stats = timed(get_stats, args.repeat)
+    with mock.patch.dict(impl_sqlalchemy.PERIOD_BUCKETS, clear=True):
+        loop_time, loop_stats = timed(get_stats, args.repeat)
+
+    if ([s.as_dict() for s in bucket_stats] !=
+            [s.as_dict() for s in loop_stats]):
+        print('WARNING: the two methods returned different statistics')
+    print('%d periods' % len(bucket_stats))
+    print('single query:     %.3fs' % bucket_time)
+    print('query per period: %.3fs' % loop_time)
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the UDP throughput of collector workers on the loopback.
+
+Collector workers are started in child processes, each bound to the same
+port with SO_REUSEPORT, and store the samples in a dispatcher doing
+nothing. Datagrams are then sent to them from several sockets for the
+requested duration, and the counters of every worker are reported.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import socket
+import time
+
+import eventlet
+import msgpack
+from oslo.config import cfg
+from stevedore import extension
+
+from ceilometer import collector
+from ceilometer.openstack.common import network_utils
+from ceilometer.publisher import udp
+from ceilometer.publisher import utils
+from ceilometer import sample
+
+
+class NullDispatcher(object):
+    def record_metering_data(self, data):
+        pass
+
+
+def make_samples(count):
+    for i in range(count):
+        yield sample.Sample(
+            name='cpu_util',
+            type=sample.TYPE_GAUGE,
+            unit='%',
+            volume=float(i),
+            user_id='user',
+            project_id='project',
+            resource_id='resource-%d' % i,
+            timestamp=datetime.datetime.utcnow().isoformat(),
+            resource_metadata={'name': 'benchmark'},
+            source='benchmark',
+        )
+
+
+def run_worker(port, duration, results):
+    eventlet.monkey_patch(socket=True, select=True, thread=True)
+    cfg.CONF([], project='ceilometer')
+    cfg.CONF.set_override('udp_address', '127.0.0.1', group='collector')
+    cfg.CONF.set_override('udp_port', port, group='collector')
+    srv = collector.CollectorService()
+    srv.dispatcher_manager = extension.ExtensionManager.make_test_instance([
+        extension.Extension('null', None, None, NullDispatcher()),
+    ])
+    eventlet.spawn(srv.start_udp)
+    # leave some time to the other workers and to the sender to start
+    eventlet.sleep(duration + 2)
+    results.put((os.getpid(), dict(srv.udp_counters)))
+    os._exit(0)
+
+
+def send(url, port, duration, senders, samples):
+    publisher = udp.UDPPublisher(network_utils.urlsplit(url))
+    messages = [msgpack.dumps(utils.meter_message_from_counter(
+        s, cfg.CONF.publisher.metering_secret))
+        for s in make_samples(samples)]
+    datagrams = (list(publisher._make_datagrams(messages))
+                 if publisher.batch else messages)
+    # the kernel balances datagrams according to their source address and
+    # port, so send them from several sockets
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+               for i in range(senders)]
+    sent = 0
+    end = time.time() + duration
+    while time.time() < end:
+        for sock in sockets:
+            for datagram in datagrams:
+                try:
+                    sock.sendto(datagram, ('127.0.0.1', port))
+                except socket.error:
+                    # the receive buffer of the workers is full
+                    continue
+                sent += 1
+    return sent, len(datagrams)
+
+
+def main():
+    cfg.CONF([], project='ceilometer')
+
+    parser = argparse.ArgumentParser(
+        description='measure the UDP throughput of collector workers',
+    )
+    parser.add_argument(
+        '--workers',
+        default=2,
+        type=int,
+        help='The number of collector workers.',
+    )
+    parser.add_argument(
+        '--port',
+        default=14952,
+        type=int,
+        help='The UDP port the workers are bound to.',
+    )
+    parser.add_argument(
+        '--duration',
+        default=10,
+        type=int,
+        help='The number of seconds datagrams are sent for.',
+    )
+    parser.add_argument(
+        '--senders',
+        default=16,
+        type=int,
+        help='The number of sockets datagrams are sent from.',
+    )
+    parser.add_argument(
+        '--samples',
+        default=100,
+        type=int,
+        help='The number of samples published at once.',
+    )
+    parser.add_argument(
+        '--batch',
+        default=False,
+        action='store_true',
+        help='Pack the samples into arrays rather than one per datagram.',
+    )
+    args = parser.parse_args()
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(args.port, args.duration,
+                                             results))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    time.sleep(1)
+
+    url = 'udp://127.0.0.1:%d?batch=%d' % (args.port, int(args.batch))
+    sent, per_publish = send(url, args.port, args.duration, args.senders,
+                             args.samples)
+    print('%d datagrams sent, %d per publication of %d samples' %
+          (sent, per_publish, args.samples))
+
+    for worker in workers:
+        pid, counters = results.get()
+        print('worker %d: %s, %.0f datagrams/s' % (
+            pid,
+            ', '.join('%d %s' % (counters[c], c)
+                      for c in collector.UDP_COUNTERS),
+            counters['stored'] / float(args.duration)))
+    for worker in workers:
+        worker.join()
+
+    return 0
+
+if __name__ == '__main__':
+    main()